@@ -0,0 +1,177 @@
+import argparse
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from enum import Enum
+from time import perf_counter
+
+from viki.data import TaxSystem
+from viki.kkt import KKT
+
+
+def jsonable(value):
+    """Привести результат операции к типам JSON"""
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, datetime):
+        return None if value == datetime.min else value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [jsonable(x) for x in value]
+    if isinstance(value, dict):
+        return {str(k): jsonable(v) for k, v in value.items()}
+    if hasattr(value, "__dict__"):
+        return {k: jsonable(v) for k, v in vars(value).items() if k != "source"}
+    return value
+
+
+def begin(kkt: KKT):
+    """Начало работы, если еще не выполнено"""
+    if kkt.status.current.no_begin:
+        kkt.begin()
+
+
+def setting_key(key: str) -> (int, int):
+    """Номер и индекс настройки из "номер" или "номер.индекс\""""
+    number, _, index = key.partition(".")
+    return int(number), int(index or 0)
+
+
+def status(kkt: KKT, options) -> dict:
+    return {"status": jsonable(kkt.status), "printer": jsonable(kkt.printer)}
+
+
+def snapshot(kkt: KKT, options) -> dict:
+    begin(kkt)
+    return {
+        "serial": kkt.information.manufacture_number,
+        "inn": kkt.information.inn,
+        "registration_number": kkt.information.registration_number,
+        "firmware": kkt.information.firmware_id,
+        "datetime": jsonable(kkt.datetime),
+        "status": jsonable(kkt.status),
+        "printer": jsonable(kkt.printer),
+        "battery": kkt.service.battery,
+        "fn": kkt.exchange_fn.reg_number,
+        "fn_last_document": kkt.exchange_fn.number_last_doc,
+        "shift": jsonable(kkt.exchange_fn.shift_status),
+        "ofd": jsonable(kkt.exchange_fn.exchange_status),
+    }
+
+
+def x_report(kkt: KKT, options) -> dict:
+    begin(kkt)
+    kkt.report_x()
+    return {}
+
+
+def close_shift(kkt: KKT, options) -> dict:
+    begin(kkt)
+    shift = kkt.exchange_fn.shift_status
+    if shift.is_open:
+        kkt.close_shift()
+    return {"shift": int(shift.number), "closed": shift.is_open}
+
+
+def open_shift(kkt: KKT, options) -> dict:
+    begin(kkt)
+    opened = not kkt.status.current.shift_open
+    if opened:
+        kkt.open_shift()
+    return {"shift": int(kkt.exchange_fn.shift_status.number), "opened": opened}
+
+
+def set_datetime(kkt: KKT, options) -> dict:
+    value = datetime.fromisoformat(options.value) if options.value else datetime.now()
+    kkt.datetime = value
+    return {"datetime": jsonable(kkt.datetime)}
+
+
+def settings_read(kkt: KKT, options) -> dict:
+    return {key: kkt.settings.read(*setting_key(key)) for key in options.keys}
+
+
+def settings_apply(kkt: KKT, options) -> dict:
+    changed = {}
+    for key, value in options.settings.items():
+        number, index = setting_key(key)
+        if kkt.settings.read(number, index) != str(value):
+            kkt.settings.write(number, value, index)
+            changed[key] = str(value)
+    return {"changed": changed}
+
+
+OPERATIONS = {
+    "status": (status, "статус ККТ и ПУ"),
+    "snapshot": (snapshot, "сведения о кассе, ФН, смене и обмене с ОФД"),
+    "x-report": (x_report, "X-отчет"),
+    "close-shift": (close_shift, "закрыть смену, если открыта"),
+    "open-shift": (open_shift, "открыть смену, если закрыта"),
+    "set-datetime": (set_datetime, "установить дату и время (при закрытой смене)"),
+    "settings-read": (settings_read, "прочитать настройки"),
+    "settings-apply": (settings_apply, "записать отличающиеся настройки"),
+}
+
+
+def run(port: str, operation, options) -> dict:
+    """Выполнить операцию на одной кассе"""
+    start = perf_counter()
+    kkt = KKT(port, options.inn, options.operator, TaxSystem[options.tax_system], options.password)
+    try:
+        result = {"port": port, "ok": True, "result": operation(kkt, options)}
+    except Exception as e:
+        result = {"port": port, "ok": False, "error": "%s: %s" % (type(e).__name__, e)}
+    finally:
+        kkt.close()
+    result["elapsed"] = round(perf_counter() - start, 3)
+    return result
+
+
+def read_fleet(path: str) -> [str]:
+    """Порты из файла парка: один порт на строку, # - комментарий"""
+    with open(path, encoding="utf-8") as file:
+        return [line.split("#", 1)[0].strip() for line in file if line.split("#", 1)[0].strip()]
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="python -m viki",
+                                     description="Операции над парком касс, результат - JSON по строке на кассу")
+    parser.add_argument("--fleet", action="append", default=[], help="файл со списком портов")
+    parser.add_argument("--jobs", type=int, default=16, help="количество касс, обрабатываемых одновременно")
+    parser.add_argument("--operator", default="Администратор")
+    parser.add_argument("--inn", default="")
+    parser.add_argument("--tax-system", default=TaxSystem.OVERALL.name, choices=[x.name for x in TaxSystem])
+    parser.add_argument("--password", default="PIRI")
+    commands = parser.add_subparsers(dest="operation", required=True)
+    for name, (_, description) in OPERATIONS.items():
+        command = commands.add_parser(name, help=description)
+        if name == "set-datetime":
+            command.add_argument("--value", help="дата и время ISO 8601, по умолчанию - текущие")
+        elif name == "settings-read":
+            command.add_argument("--key", dest="keys", action="append", required=True,
+                                 help="настройка: номер или номер.индекс, можно повторять")
+        elif name == "settings-apply":
+            command.add_argument("--file", required=True, help='JSON {"номер[.индекс]": значение}')
+        command.add_argument("ports", nargs="*", help="порты касс")
+    options = parser.parse_args(args)
+    if options.operation == "settings-apply":
+        with open(options.file, encoding="utf-8") as file:
+            options.settings = json.load(file)
+    ports = list(options.ports)
+    for path in options.fleet:
+        ports.extend(read_fleet(path))
+    if not ports:
+        parser.error("не заданы порты касс")
+    operation = OPERATIONS[options.operation][0]
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, options.jobs)) as executor:
+        futures = [executor.submit(run, port, operation, options) for port in ports]
+        for future in as_completed(futures):
+            result = future.result()
+            failed += not result["ok"]
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,185 @@
+import csv
+import json
+from dataclasses import dataclass, asdict, fields
+from datetime import datetime, timezone
+
+from viki.kkt import KKT
+from viki.transport import TransportError
+
+# Теги ФФД
+TAG_DATETIME = 1012  # Дата, время
+TAG_TOTAL = 1020  # Сумма расчета, указанного в чеке
+TAG_SHIFT = 1038  # Номер смены
+TAG_NUMBER = 1040  # Номер ФД
+TAG_NUMBER_IN_SHIFT = 1042  # Номер чека за смену
+TAG_OPERATION = 1054  # Признак расчета
+TAG_ITEM = 1059  # Предмет расчета
+TAG_FP = 1077  # ФПД
+
+CHEQUE_DOCUMENT = 3  # Тип документа “Кассовый чек”
+
+
+@dataclass
+class Document:
+    """Фискальный документ из архива ФН в сжатом виде"""
+    number: int  # Номер ФД
+    type: int  # Тип документа (1 - отчет о регистрации, 2 - открытие смены, 3 - кассовый чек, 5 - закрытие смены ...)
+    datetime: datetime = None  # Дата и время документа
+    shift: int = None  # Номер смены
+    number_in_shift: int = None  # Номер чека за смену
+    operation: int = None  # Признак расчета (1 - приход, 2 - возврат прихода, 3 - расход, 4 - возврат расхода)
+    total: int = None  # Сумма расчета (коп)
+    fp: int = None  # Фискальный признак
+    items: int = 0  # Количество предметов расчета
+
+    def dict(self) -> dict:
+        """Словарь для сериализации"""
+        result = asdict(self)
+        if self.datetime is not None:
+            result["datetime"] = self.datetime.isoformat()
+        return result
+
+
+class TLVDecoder:
+    """
+    Потоковый разбор TLV
+
+    Данные подаются блоками по мере чтения из ФН, разобранные теги верхнего уровня отдаются сразу, незавершенный
+    хвост хранится до следующего блока
+    """
+
+    def __init__(self):
+        self.__buffer = bytearray()
+
+    def feed(self, data: bytes):
+        """
+        Добавить блок данных
+        :return: итератор (тег, значение) завершенных тегов
+        """
+        self.__buffer.extend(data)
+        offset = 0
+        while len(self.__buffer) - offset >= 4:
+            tag = int.from_bytes(self.__buffer[offset:offset + 2], "little")
+            size = int.from_bytes(self.__buffer[offset + 2:offset + 4], "little")
+            if len(self.__buffer) - offset - 4 < size:
+                break
+            yield tag, bytes(self.__buffer[offset + 4:offset + 4 + size])
+            offset += 4 + size
+        del self.__buffer[:offset]
+
+
+def decode(number: int, document_type: int, tags) -> Document:
+    """
+    Собрать сжатую запись документа из тегов верхнего уровня
+    :param number: номер ФД
+    :param document_type: тип документа
+    :param tags: итератор (тег, значение)
+    """
+    result = Document(number, document_type)
+    for tag, value in tags:
+        if tag == TAG_DATETIME:
+            result.datetime = datetime.fromtimestamp(int.from_bytes(value, "little"), timezone.utc).replace(tzinfo=None)
+        elif tag == TAG_TOTAL:
+            result.total = int.from_bytes(value, "little")
+        elif tag == TAG_SHIFT:
+            result.shift = int.from_bytes(value, "little")
+        elif tag == TAG_NUMBER:
+            result.number = int.from_bytes(value, "little")
+        elif tag == TAG_NUMBER_IN_SHIFT:
+            result.number_in_shift = int.from_bytes(value, "little")
+        elif tag == TAG_OPERATION:
+            result.operation = int.from_bytes(value, "little")
+        elif tag == TAG_FP:
+            # ФПД - 6 байт, фискальный признак - последние 4 байта
+            result.fp = int.from_bytes(value[-4:], "big")
+        elif tag == TAG_ITEM:
+            result.items += 1
+    return result
+
+
+class ArchiveReader:
+    """
+    Чтение фискальных документов из архива ФН
+
+    Документы читаются по одному и разбираются по мере поступления блоков, в памяти держится только текущий
+    документ. Номер последнего прочитанного документа хранится в position, чтение можно продолжить с него.
+
+    Чтение блока сдвигает курсор ФН, поэтому после ошибки связи блок не повторяется: документ читается заново с
+    начала.
+    """
+
+    def __init__(self, kkt: KKT, position: int = 0, attempts: int = 2):
+        """
+        :param kkt: касса
+        :param position: номер последнего уже прочитанного документа
+        :param attempts: количество попыток прочитать документ при ошибках связи
+        """
+        self.kkt = kkt
+        self.position = position
+        self.attempts = attempts
+
+    def document(self, number: int) -> Document:
+        """Прочитать один документ"""
+        with self.kkt.lock:
+            for attempt in range(self.attempts):
+                try:
+                    document_type, _ = self.kkt.exchange_fn.start_document(number)
+                    return decode(number, document_type, self.__tags())
+                except TransportError:
+                    if attempt + 1 >= self.attempts:
+                        raise
+
+    def __tags(self):
+        decoder = TLVDecoder()
+        while True:
+            block = self.kkt.exchange_fn.read_document()
+            if not block:
+                return
+            yield from decoder.feed(block)
+
+    def read(self, first: int = None, last: int = None):
+        """
+        Прочитать документы
+        :param first: номер первого документа, по умолчанию - следующий за position
+        :param last: номер последнего документа, по умолчанию - последний документ в ФН
+        :return: итератор Document
+        """
+        if first is None:
+            first = self.position + 1
+        if last is None:
+            last = int(self.kkt.exchange_fn.number_last_doc)
+        for number in range(first, last + 1):
+            document = self.document(number)
+            self.position = number
+            yield document
+
+
+def export_jsonl(documents, file) -> int:
+    """
+    Записать документы в JSON Lines по мере чтения
+    :param documents: итератор Document
+    :param file: текстовый файл
+    :return: количество записанных документов
+    """
+    count = 0
+    for document in documents:
+        file.write(json.dumps(document.dict(), ensure_ascii=False))
+        file.write("\n")
+        count += 1
+    return count
+
+
+def export_csv(documents, file) -> int:
+    """
+    Записать документы в CSV по мере чтения
+    :param documents: итератор Document
+    :param file: текстовый файл, открытый с newline=""
+    :return: количество записанных документов
+    """
+    writer = csv.DictWriter(file, [field.name for field in fields(Document)])
+    writer.writeheader()
+    count = 0
+    for document in documents:
+        writer.writerow(document.dict())
+        count += 1
+    return count
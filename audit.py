@@ -0,0 +1,227 @@
+import json
+import os
+import sqlite3
+from datetime import datetime
+from queue import Queue, Empty, Full
+from threading import Lock, Thread
+from time import monotonic
+
+from viki.data import CloseDocData
+
+STOP = object()  # Метка завершения очереди
+
+
+def record(close: CloseDocData, cheque=None, serial: str = None) -> dict:
+    """
+    Запись аудита по закрытому документу
+    :param close: ответ close_doc
+    :param cheque: helpers.CompiledCheque или helpers.Cheque
+    :param serial: заводской номер ККТ
+    """
+    result = {"time": datetime.now().isoformat(), "serial": serial, "close": close.dict()}
+    if cheque is not None:
+        result["cheque"] = {
+            "type": cheque.type.name,
+            "items": [{"title": item.title, "count": item.count, "price": item.price, "tax": item.tax,
+                       "payment": item.payment.value, "subject": item.subject.value} for item in cheque.items],
+            "payments": [[code, float(total)] for code, total in cheque.payments],
+        }
+    return result
+
+
+class Sink:
+    """Хранилище записей аудита"""
+
+    def write(self, records: [dict]):
+        """Записать пачку записей"""
+        raise NotImplementedError
+
+    def flush(self):
+        """Сбросить записанное на диск"""
+
+    def close(self):
+        """Закрыть хранилище"""
+
+
+class JsonlSink(Sink):
+    """
+    Записи аудита в JSON Lines с ротацией по размеру
+
+    При превышении max_bytes файл переименовывается в <path>.1, предыдущие - в <path>.2 ... <path>.<backups>
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, backups: int = 10):
+        """
+        :param path: путь к файлу
+        :param max_bytes: размер файла, после которого он ротируется
+        :param backups: количество хранимых старых файлов
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, records: [dict]):
+        self.file.write("".join(json.dumps(x, ensure_ascii=False) + "\n" for x in records))
+        self.file.flush()
+        if self.file.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        """Начать новый файл"""
+        self.file.close()
+        for number in range(self.backups - 1, 0, -1):
+            if os.path.exists("%s.%i" % (self.path, number)):
+                os.replace("%s.%i" % (self.path, number), "%s.%i" % (self.path, number + 1))
+        if self.backups:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class SqliteSink(Sink):
+    """Записи аудита в базе SQLite, пачка записей - одна транзакция"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS audit (
+        id INTEGER PRIMARY KEY,
+        serial TEXT,
+        number_fd INTEGER,
+        fp_sign INTEGER,
+        shift INTEGER,
+        number_in_shift INTEGER,
+        datetime TEXT,
+        data TEXT
+    );
+    CREATE INDEX IF NOT EXISTS audit_fd ON audit (serial, number_fd);
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: путь к файлу базы
+        """
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SqliteSink.SCHEMA)
+
+    def write(self, records: [dict]):
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO audit (serial, number_fd, fp_sign, shift, number_in_shift, datetime, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(x.get("serial"), x["close"]["number_fd"], x["close"]["fp_sign"], x["close"]["shift_number"],
+                  x["close"]["number_doc_in_shift"], x["close"]["date"] + x["close"]["time"],
+                  json.dumps(x, ensure_ascii=False)) for x in records])
+
+    def close(self):
+        self.db.close()
+
+
+class AuditWriter:
+    """
+    Фоновая запись аудита
+
+    Записи ставятся в ограниченную очередь в памяти и не задерживают кассовую операцию. Фоновый поток забирает их
+    пачками до batch штук и пишет во все хранилища. Если очередь переполнена, запись отбрасывается и учитывается в
+    dropped. При закрытии очередь дописывается до конца.
+    """
+
+    def __init__(self, sinks: [Sink], size: int = 10000, batch: int = 100, interval: float = 1.0):
+        """
+        :param sinks: хранилища
+        :param size: максимальное количество записей в очереди
+        :param batch: максимальное количество записей в одной пачке
+        :param interval: период сброса хранилищ на диск (сек)
+        """
+        self.sinks = list(sinks)
+        self.batch = batch
+        self.interval = interval
+        self.written = 0  # Записано
+        self.dropped = 0  # Отброшено при переполнении очереди
+        self.failed = 0  # Не записано из-за ошибки хранилища
+        self.error: Exception = None  # Последняя ошибка хранилища
+        self.__queue = Queue(size)
+        self.__lock = Lock()
+        self.__thread = Thread(target=self.__run, name="viki-audit", daemon=True)
+        self.__thread.start()
+
+    @property
+    def queued(self) -> int:
+        """Записей в очереди"""
+        return self.__queue.qsize()
+
+    def submit(self, item: dict) -> bool:
+        """
+        Поставить запись в очередь
+        :return: запись принята
+        """
+        try:
+            self.__queue.put_nowait(item)
+        except Full:
+            with self.__lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def stats(self) -> dict:
+        """Счетчики записей"""
+        with self.__lock:
+            return {"queued": self.queued, "written": self.written, "dropped": self.dropped, "failed": self.failed}
+
+    def close(self, timeout: float = None):
+        """Дописать очередь, сбросить и закрыть хранилища"""
+        if self.__thread.is_alive():
+            self.__queue.put(STOP)
+            self.__thread.join(timeout)
+
+    def __run(self):
+        flushed = monotonic()
+        while True:
+            try:
+                item = self.__queue.get(timeout=self.interval)
+            except Empty:
+                item = None
+            items = []
+            while item is not None and item is not STOP:
+                items.append(item)
+                if len(items) >= self.batch:
+                    break
+                try:
+                    item = self.__queue.get_nowait()
+                except Empty:
+                    item = None
+            if items:
+                self.__write(items)
+            if item is STOP or monotonic() - flushed >= self.interval:
+                self.__flush()
+                flushed = monotonic()
+            if item is STOP:
+                for sink in self.sinks:
+                    sink.close()
+                return
+
+    def __write(self, items: [dict]):
+        failed = 0
+        for sink in self.sinks:
+            try:
+                sink.write(items)
+            except Exception as e:
+                failed = len(items)
+                self.error = e
+        with self.__lock:
+            self.written += len(items) - failed
+            self.failed += failed
+
+    def __flush(self):
+        for sink in self.sinks:
+            try:
+                sink.flush()
+            except Exception as e:
+                self.error = e
@@ -0,0 +1,262 @@
+import struct
+from dataclasses import dataclass
+from datetime import datetime
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from threading import Event, Lock, Thread
+from time import monotonic, sleep, time
+
+from viki.data import KKTStatus, PrinterStatus, FNShiftStatus, FNOFDStatus
+from viki.kkt import KKT
+from viki.packet import Input
+from viki.schema import STATUS, PRINTER_STATUS
+
+MAGIC = b"VIKB"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHQ")  # Метка, версия раскладки, резерв, счетчик записей
+SEQUENCE = struct.Struct("<Q")  # Счетчик записей: нечетный - идет запись
+SEQUENCE_OFFSET = 8
+PAYLOAD = struct.Struct(
+    "<d"  # Время публикации (UnixTime)
+    "B"  # Опубликованные части (PART_*)
+    "III"  # Статус ККТ: фатальное состояние, текущие флаги, документ
+    "I"  # Статус ПУ
+    "IBI"  # Смена: номер, открыта, номер чека
+    "IIId"  # ОФД: статус, количество документов, номер первого документа, время первого документа
+)
+PAYLOAD_OFFSET = HEADER.size
+SIZE = HEADER.size + PAYLOAD.size
+
+PART_STATUS = 1 << 0
+PART_PRINTER = 1 << 1
+PART_SHIFT = 1 << 2
+PART_OFD = 1 << 3
+
+RETRIES = 1000  # Попыток прочитать согласованный снимок
+BUSY_DELAY = 0.5  # Пауза (сек) перед повторной попыткой опроса, если касса занята
+
+SHADOW_CODES = {0x10, 0x21, 0x23, 0x30, 0x31, 0x32, 0x33, 0x44, 0x47}  # Команды, меняющие теневое состояние
+SHIFT_CODES = {0x21, 0x23, 0x31}  # Команды, меняющие состояние смены и обмена с ОФД
+
+
+@dataclass
+class Snapshot:
+    """Согласованный снимок состояния кассы"""
+    sequence: int  # Номер публикации
+    updated: datetime  # Время публикации
+    status: KKTStatus = None
+    printer: PrinterStatus = None
+    shift: FNShiftStatus = None
+    ofd: FNOFDStatus = None
+
+
+def attach(name: str) -> SharedMemory:
+    """Подключиться к существующему сегменту, не передавая его трекеру ресурсов текущего процесса"""
+    memory = SharedMemory(name)
+    # Иначе трекер удалит сегмент при завершении читателя
+    resource_tracker.unregister(memory._name, "shared_memory")
+    return memory
+
+
+class StatusBoard:
+    """
+    Табло состояния кассы в разделяемой памяти
+
+    Процесс, владеющий кассой, публикует последние статус ККТ, состояние ПУ, состояние смены и обмена с ОФД в
+    сегмент фиксированной раскладки. Любой локальный процесс читает согласованный снимок без обращения к кассе.
+    Согласованность обеспечивает счетчик записей (seqlock): писатель делает его нечетным на время записи, читатель
+    повторяет чтение, пока счетчик до и после копирования не совпадет и не окажется четным.
+    """
+
+    def __init__(self, name: str, create: bool = False):
+        """
+        :param name: имя сегмента разделяемой памяти
+        :param create: создать сегмент (писатель), иначе подключиться к существующему (читатель)
+        """
+        self.name = name
+        self.owner = create
+        if create:
+            self.memory = SharedMemory(name, create=True, size=SIZE)
+            HEADER.pack_into(self.memory.buf, 0, MAGIC, VERSION, 0, 0)
+            PAYLOAD.pack_into(self.memory.buf, PAYLOAD_OFFSET, 0.0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0.0)
+        else:
+            self.memory = attach(name)
+            magic, version, _, _ = HEADER.unpack_from(self.memory.buf, 0)
+            if magic != MAGIC or version != VERSION:
+                self.memory.close()
+                raise Exception("Сегмент %s не является табло состояния кассы" % name)
+        self.__lock = Lock()
+        self.__stop = Event()
+        self.__wake = Event()
+        self.__thread = None
+        self.__kkt = None
+        self.__published = {}  # Часть (PART_*) -> время публикации (monotonic)
+
+    def publish(self, status: KKTStatus = None, printer: PrinterStatus = None, shift: FNShiftStatus = None,
+                ofd: FNOFDStatus = None):
+        """
+        Опубликовать состояние, не переданные части сохраняют прежние значения
+        """
+        if not self.owner:
+            raise Exception("Табло открыто только для чтения")
+        with self.__lock:
+            buf = self.memory.buf
+            values = list(PAYLOAD.unpack_from(buf, PAYLOAD_OFFSET))
+            values[0] = time()
+            now = monotonic()
+            if status is not None:
+                values[1] |= PART_STATUS
+                values[2:5] = status.source
+                self.__published[PART_STATUS] = now
+            if printer is not None:
+                values[1] |= PART_PRINTER
+                values[5] = printer.source
+                self.__published[PART_PRINTER] = now
+            if shift is not None:
+                values[1] |= PART_SHIFT
+                values[6:9] = int(shift.number), shift.is_open, int(shift.cheque)
+                self.__published[PART_SHIFT] = now
+            if ofd is not None:
+                values[1] |= PART_OFD
+                values[9:13] = (ofd.source, int(ofd.count), int(ofd.number),
+                                0.0 if ofd.date == datetime.min else ofd.date.timestamp())
+                self.__published[PART_OFD] = now
+            sequence, = SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)
+            SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, sequence + 1)
+            PAYLOAD.pack_into(buf, PAYLOAD_OFFSET, *values)
+            SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, sequence + 2)
+
+    def snapshot(self) -> Snapshot:
+        """Прочитать согласованный снимок"""
+        buf = self.memory.buf
+        for attempt in range(RETRIES):
+            before, = SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)
+            if not before & 1:
+                values = PAYLOAD.unpack_from(buf, PAYLOAD_OFFSET)
+                after, = SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)
+                if before == after:
+                    return self.__decode(before // 2, values)
+            if attempt % 100 == 99:
+                sleep(0)
+        raise Exception("Не удалось прочитать табло %s: идет запись" % self.name)
+
+    @staticmethod
+    def __decode(sequence: int, values) -> Snapshot:
+        updated, parts = values[0:2]
+        result = Snapshot(sequence, datetime.fromtimestamp(updated) if sequence else None)
+        if parts & PART_STATUS:
+            result.status = KKTStatus(*values[2:5])
+        if parts & PART_PRINTER:
+            result.printer = PrinterStatus(values[5])
+        if parts & PART_SHIFT:
+            result.shift = FNShiftStatus(str(values[6]), bool(values[7]), str(values[8]))
+        if parts & PART_OFD:
+            result.ofd = FNOFDStatus(values[9], str(values[10]), str(values[11]),
+                                     datetime.fromtimestamp(values[12]) if values[12] else datetime.min)
+        return result
+
+    def update(self, kkt: KKT):
+        """Опросить кассу и опубликовать состояние"""
+        self.publish(kkt.status, kkt.printer, kkt.exchange_fn.shift_status, kkt.exchange_fn.exchange_status)
+
+    def start(self, kkt: KKT, interval: float = 30.0):
+        """
+        Публиковать состояние кассы по мере обмена с ней
+
+        Ответы на запросы статуса и состояния ПУ, которые отправляют другие потоки, публикуются сразу (см. observe),
+        статус после команд, меняющих теневое состояние, берется из kkt.shadow. После открытия и закрытия смены и
+        закрытия чека фоновый поток перечитывает состояние смены и обмена с ОФД. Части, не обновлявшиеся interval
+        секунд, фоновый поток опрашивает сам. Опрос низкоприоритетный: если касса занята другим потоком, он
+        откладывается на BUSY_DELAY
+        :param kkt: касса
+        :param interval: период опроса частей, не обновленных обменом (сек)
+        """
+        if self.__thread is not None:
+            return
+        self.__stop.clear()
+        self.__kkt = kkt
+        kkt.observers.append(self.observe)
+        self.__thread = Thread(target=self.__run, args=(kkt, interval), name="viki-board-%s" % self.name,
+                               daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Остановить фоновую публикацию"""
+        self.__stop.set()
+        self.__wake.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        if self.__kkt is not None:
+            self.__kkt.observers.remove(self.observe)
+            self.__kkt = None
+
+    def observe(self, code: int, result: Input):
+        """
+        Опубликовать состояние по выполненной команде
+        :param code: код команды, None - переподключение
+        :param result: ответ кассы, None - ошибка связи
+        """
+        if result is None or result.error:
+            return
+        try:
+            if code == 0x00:
+                self.publish(status=KKTStatus(*STATUS.decode(result)))
+            elif code == 0x04:
+                self.publish(printer=PrinterStatus(PRINTER_STATUS.decode(result)))
+            elif code in SHADOW_CODES:
+                shadow = self.__kkt.shadow if self.__kkt is not None else None
+                status = shadow.known if shadow is not None else None
+                if status is not None:
+                    self.publish(status=status)
+                else:
+                    self.__expire(PART_STATUS)
+            if code in SHIFT_CODES:
+                self.__expire(PART_SHIFT, PART_OFD)
+        except Exception:
+            pass
+
+    def close(self):
+        """Отключиться от сегмента, писатель удаляет сегмент"""
+        self.stop()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def __expire(self, *parts):
+        """Перечитать части в фоновом потоке"""
+        with self.__lock:
+            for part in parts:
+                self.__published.pop(part, None)
+        self.__wake.set()
+
+    def __refresh(self, kkt: KKT, interval: float):
+        """Опросить части, не обновлявшиеся interval секунд"""
+        now = monotonic()
+        with self.__lock:
+            stale = {part for part in (PART_STATUS, PART_PRINTER, PART_SHIFT, PART_OFD)
+                     if now - self.__published.get(part, now - interval) >= interval}
+        if not stale:
+            return
+        self.publish(kkt.status if PART_STATUS in stale else None,
+                     kkt.printer if PART_PRINTER in stale else None,
+                     kkt.exchange_fn.shift_status if PART_SHIFT in stale else None,
+                     kkt.exchange_fn.exchange_status if PART_OFD in stale else None)
+
+    def __run(self, kkt: KKT, interval: float):
+        while True:
+            delay = interval
+            if kkt.lock.acquire(blocking=False):
+                try:
+                    self.__refresh(kkt, interval)
+                except Exception:
+                    pass
+                finally:
+                    kkt.lock.release()
+            else:
+                delay = min(interval, BUSY_DELAY)
+            self.__wake.wait(delay)
+            self.__wake.clear()
+            if self.__stop.is_set():
+                break
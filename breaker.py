@@ -0,0 +1,78 @@
+from threading import Lock
+from time import monotonic
+
+
+class CircuitOpenError(Exception):
+    """Касса недоступна: команда отклонена без обращения к кассе"""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель кассы
+
+    После threshold ошибок связи подряд (порт недоступен, касса не ответила за таймаут) или при фатальном состоянии
+    ККТ предохранитель размыкается, и команды сразу завершаются CircuitOpenError вместо ожидания таймаута порта.
+    Через reset_timeout первая команда проверяет кассу дешевым запросом (ENQ и статус): при успехе предохранитель
+    замыкается, иначе снова размыкается на reset_timeout. Пока идет проверка, остальные команды отклоняются.
+    """
+
+    CLOSED = "closed"  # Команды выполняются
+    OPEN = "open"  # Команды отклоняются
+    HALF_OPEN = "half-open"  # Выполняется пробный запрос
+
+    def __init__(self, threshold: int = 3, reset_timeout: float = 10.0):
+        """
+        :param threshold: количество ошибок связи подряд, после которого предохранитель размыкается
+        :param reset_timeout: через сколько секунд после размыкания проверить кассу
+        """
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0  # Ошибок связи подряд
+        self.reason = None  # Причина размыкания
+        self.__opened = 0.0
+        self.__lock = Lock()
+
+    @property
+    def retry_in(self) -> float:
+        """Через сколько секунд будет проверена касса"""
+        if self.state != CircuitBreaker.OPEN:
+            return 0.0
+        return max(0.0, self.__opened + self.reset_timeout - monotonic())
+
+    def before(self) -> bool:
+        """
+        Проверить предохранитель перед командой
+        :return: текущий поток должен проверить кассу пробным запросом
+        """
+        with self.__lock:
+            if self.state == CircuitBreaker.CLOSED:
+                return False
+            if self.state == CircuitBreaker.OPEN and monotonic() - self.__opened >= self.reset_timeout:
+                self.state = CircuitBreaker.HALF_OPEN
+                return True
+        raise CircuitOpenError("Касса недоступна (%s), повтор через %0.1f сек" % (self.reason, self.retry_in))
+
+    def success(self):
+        """Команда выполнена"""
+        with self.__lock:
+            self.state = CircuitBreaker.CLOSED
+            self.failures = 0
+            self.reason = None
+
+    def failure(self, reason: str):
+        """Ошибка связи"""
+        with self.__lock:
+            self.failures += 1
+            if self.state == CircuitBreaker.HALF_OPEN or self.failures >= self.threshold:
+                self.__trip(reason)
+
+    def trip(self, reason: str):
+        """Разомкнуть предохранитель"""
+        with self.__lock:
+            self.__trip(reason)
+
+    def __trip(self, reason: str):
+        self.state = CircuitBreaker.OPEN
+        self.reason = reason
+        self.__opened = monotonic()
@@ -0,0 +1,244 @@
+import os
+import socket
+import struct
+import sys
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+from threading import Lock, Thread
+
+from viki.packet import SXT, EXT
+from viki.transport import Transport, SerialTransport, TransportError
+
+HEADER = struct.Struct("!BI")  # Флаг ожидания ответа, длина данных
+REPLY = struct.Struct("!BI")  # Флаг ошибки, длина ответа (при ошибке - текста ошибки в UTF-8)
+
+
+def receive(sock: socket.socket, size: int) -> bytes:
+    """Прочитать из сокета ровно size байт"""
+    result = bytearray()
+    while len(result) < size:
+        chunk = sock.recv(size - len(result))
+        if not chunk:
+            raise TransportError("Соединение с брокером закрыто")
+        result.extend(chunk)
+    return bytes(result)
+
+
+class Broker:
+    """
+    Брокер кадров
+
+    Единолично владеет портом кассы и принимает от локальных процессов через Unix-сокет готовые кадры команд. Каждое
+    сообщение клиента записывается в порт и на него читается один ответ ККТ (байт ACK/NAK или кадр целиком) под
+    общей блокировкой, поэтому кадры разных процессов не перемешиваются, а порт не переоткрывается. После ошибки
+    обмена порт закрывается, а при следующем открытии из него вычитываются опоздавшие байты, чтобы следующий ответ
+    соответствовал своему запросу. Ошибка передается клиенту ответом с флагом ошибки.
+
+    Согласованность документов между процессами (один открытый документ на кассу) остается на стороне приложения.
+    """
+
+    def __init__(self, transport: Transport, path: str):
+        """
+        :param transport: канал связи с кассой
+        :param path: путь Unix-сокета
+        """
+        self.transport = transport
+        self.path = path
+        self.lock = Lock()
+        self.server = None
+
+    def exchange(self, data: bytes, reply: bool) -> bytes:
+        """
+        Записать данные в порт и прочитать один ответ
+        :param data: данные для записи
+        :param reply: ожидать ответ
+        """
+        with self.lock:
+            try:
+                if not self.transport.is_open:
+                    self.transport.open()
+                    self.__drain()
+                if data:
+                    self.transport.write(data)
+                if not reply:
+                    return b""
+                return self.__read_reply()
+            except Exception:
+                self.transport.close()
+                raise
+
+    def __drain(self):
+        """Отбросить байты, оставшиеся от прерванного обмена"""
+        while self.transport.in_waiting:
+            self.transport.read(self.transport.in_waiting)
+
+    def __read_reply(self) -> bytes:
+        result = bytearray(self.transport.read(1))
+        if not result:
+            raise TransportError("Нет ответа от кассы")
+        if result[0] != SXT:
+            return bytes(result)
+        while result[-1] != EXT:
+            byte = self.transport.read(1)
+            if not byte:
+                raise TransportError("Нет ответа от кассы")
+            result.extend(byte)
+        crc = self.transport.read(2)
+        if len(crc) < 2:
+            raise TransportError("Нет ответа от кассы")
+        result.extend(crc)
+        return bytes(result)
+
+    def serve_forever(self):
+        """Обслуживать клиентов в текущем потоке"""
+        broker = self
+
+        class Handler(StreamRequestHandler):
+
+            def handle(self):
+                while True:
+                    try:
+                        reply, size = HEADER.unpack(receive(self.connection, HEADER.size))
+                        data = receive(self.connection, size)
+                    except ConnectionError:
+                        return
+                    try:
+                        answer, error = broker.exchange(data, bool(reply)), 0
+                    except Exception as e:
+                        answer, error = str(e).encode(), 1
+                    if reply:
+                        try:
+                            self.connection.sendall(REPLY.pack(error, len(answer)) + answer)
+                        except OSError:
+                            return
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = ThreadingUnixStreamServer(self.path, Handler)
+        self.server.daemon_threads = True
+        self.server.serve_forever()
+
+    def start(self) -> Thread:
+        """Запустить брокер в фоновом потоке"""
+        thread = Thread(target=self.serve_forever, name="viki-broker-%s" % self.path, daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        """Остановить брокер и закрыть порт"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            os.unlink(self.path)
+        with self.lock:
+            self.transport.close()
+
+
+class BrokerTransport(Transport):
+    """
+    Канал связи с кассой через брокер
+
+    Записанные данные накапливаются и отправляются брокеру одним сообщением при чтении ответа, поэтому команды
+    пакетного режима уходят в порт вместе с завершающей командой. При ошибке сокета или ошибке обмена на стороне
+    брокера сокет закрывается, буферы очищаются и поднимается TransportError.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: путь Unix-сокета брокера
+        """
+        self.path = path
+        self.socket = None
+        self.__pending = bytearray()
+        self.__received = bytearray()
+
+    @property
+    def is_open(self) -> bool:
+        return self.socket is not None
+
+    def open(self):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(self.path)
+        except OSError as e:
+            self.__reset()
+            raise TransportError("Нет связи с брокером %s: %s" % (self.path, e))
+
+    def close(self):
+        if self.socket is not None and self.__pending:
+            try:
+                self.__request(False)
+            except TransportError:
+                pass
+        self.__reset()
+
+    def __reset(self):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+            self.socket = None
+        self.__pending.clear()
+        self.__received.clear()
+
+    def write(self, data):
+        self.__pending.extend(data)
+
+    def read(self, size: int) -> bytes:
+        while len(self.__received) < size:
+            self.__request(True)
+        result = bytes(self.__received[:size])
+        del self.__received[:size]
+        return result
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.__received)
+
+    def __request(self, reply: bool):
+        if self.socket is None:
+            raise TransportError("Нет связи с брокером %s" % self.path)
+        try:
+            self.socket.sendall(HEADER.pack(reply, len(self.__pending)) + self.__pending)
+            self.__pending.clear()
+            if not reply:
+                return
+            error, size = REPLY.unpack(receive(self.socket, REPLY.size))
+            answer = receive(self.socket, size)
+        except OSError as e:
+            self.__reset()
+            raise TransportError("Ошибка обмена с брокером %s: %s" % (self.path, e))
+        if error:
+            self.__reset()
+            raise TransportError(answer.decode(errors="replace"))
+        self.__received.extend(answer)
+
+    def __str__(self):
+        return "unix:" + self.path
+
+
+def main(args):
+    """
+    Запуск брокера для нескольких портов
+    python -m viki.broker /dev/ttyUSB0=/run/viki/ttyUSB0.sock [/dev/ttyUSB1=/run/viki/ttyUSB1.sock ...]
+    """
+    if not args:
+        print(main.__doc__.strip())
+        return 2
+    brokers = []
+    for arg in args:
+        port, path = arg.split("=", 1)
+        brokers.append(Broker(SerialTransport(port), path))
+    threads = [broker.start() for broker in brokers]
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        for broker in brokers:
+            broker.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -233,6 +233,7 @@ class KKTStatus:
             self.condition = KKTStatus.Document.Condition(source & 0x0F)
 
     def __init__(self, fatal, current, document):
+        self.source = (fatal, current, document)  # Исходные значения статусов
         self.fatal = KKTStatus.Fatal(fatal)
         self.current = KKTStatus.Current(current)
         self.document = KKTStatus.Document(document)
@@ -244,6 +245,7 @@ class PrinterStatus:
     """
 
     def __init__(self, status):
+        self.source = status  # Исходное значение статуса
         self.no_ready = status & 1 << 0 != 0  # Принтер не готов
         self.no_paper = status & 1 << 1 != 0  # В принтере нет бумаги
         self.open_cover = status & 1 << 2 != 0  # Открыта крышка принтера
@@ -286,6 +288,7 @@ class FNOFDStatus:
     """
 
     def __init__(self, status, count, number, date):
+        self.source = status  # Исходное значение статуса
         self.connected = status & 1 << 0 != 0  # Транспортное соединение установлено
         self.has_message = status & 1 << 1 != 0  # Есть сообщение для передачи в ОФД
         self.wait_meassage = status & 1 << 2 != 0  # Ожидание ответного сообщения (квитанции) от ОФД
@@ -313,3 +316,14 @@ class CloseDocData:
         self.date = packet.to_string(7)  # Дата документа
         self.time = packet.to_string(8)  # Время документа
 
+    def dict(self) -> dict:
+        """Словарь для сериализации"""
+        return dict(vars(self))
+
+    @classmethod
+    def load(cls, data: dict) -> "CloseDocData":
+        """Восстановить из словаря dict"""
+        result = cls.__new__(cls)
+        vars(result).update(data)
+        return result
+
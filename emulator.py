@@ -0,0 +1,342 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+from time import sleep
+
+from viki.data import DocumentType
+from viki.packet import SXT, EXT, ENQ, ACK, DELIM
+from viki.preflight import item_total
+from viki.transport import Transport
+
+ERROR_STATUS = 0x01  # Функция невыполнима при данном статусе ККТ
+ERROR_FUNCTION = 0x02  # Недопустимый номер функции
+ERROR_FORMAT = 0x03  # Неверный формат команды
+
+BULK_CODES = {0x24, 0x40, 0x41, 0x42, 0x44, 0x45, 0x47, 0x48}  # Команды, на которые в пакетном режиме нет ответа
+ARCHIVE_SIZE = 1000  # Сколько последних фискальных документов хранит эмулятор
+BLOCK_SIZE = 64  # Размер блока TLV при чтении документа из архива
+OPERATIONS = {2: 1, 3: 2, 6: 3, 7: 4}  # Тип документа -> признак расчета
+
+
+class Emulator(Transport):
+    """
+    Эмулятор кассы
+
+    Транспорт, который вместо порта разбирает кадры команд и отвечает как касса: ведет смену, документы, пакетный
+    режим, счетчики документов и очередь ОФД. Предназначен для нагрузочных и длительных тестов без оборудования.
+    """
+
+    def __init__(self, serial: str = "0000000001", password: str = "PIRI", shift_open: bool = True,
+                 latency: float = 0.0):
+        """
+        :param serial: заводской номер
+        :param password: пароль связи
+        :param shift_open: смена открыта
+        :param latency: время выполнения одной команды (сек)
+        """
+        self.serial = serial
+        self.password = password
+        self.latency = latency
+        self.opened = False
+        self.no_begin = True
+        self.shift_open = shift_open
+        self.shift_more_24 = False  # Смена открыта больше 24 часов
+        self.shift = 1
+        self.cheque = 1  # Номер чека в смене
+        self.document = 1  # Сквозной номер документа
+        self.fd = 0  # Номер последнего ФД
+        self.ofd = 0  # Документов для передачи в ОФД
+        self.settings = {}
+        self.doc_type = 0
+        self.condition = 0
+        self.bulk = False
+        self.failed = False  # В пакетном режиме была ошибка
+        self.total = 0
+        self.items = 0
+        self.paid = 0
+        self.archive = OrderedDict()  # Номер ФД -> (тип документа, TLV документа)
+        self.reading = b""  # Непрочитанный остаток документа из архива
+        self.logo = b""  # Загруженный логотип
+        self.printed = 0  # Напечатано строк
+        self.frames = 0  # Обработано кадров
+        self.__fiscal(1)  # Отчет о регистрации
+        self.ofd = 0
+        self.__lock = Lock()
+        self.__input = bytearray()
+        self.__output = bytearray()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened
+
+    def open(self):
+        self.opened = True
+
+    def close(self):
+        self.opened = False
+        with self.__lock:
+            self.__input.clear()
+            self.__output.clear()
+
+    def write(self, data):
+        with self.__lock:
+            self.__input.extend(data)
+            self.__process()
+
+    def read(self, size: int) -> bytes:
+        with self.__lock:
+            result = bytes(self.__output[:size])
+            del self.__output[:size]
+            return result
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.__output)
+
+    def __process(self):
+        while self.__input:
+            if self.__input[0] == ENQ:
+                del self.__input[0]
+                self.__output.append(ACK)
+                continue
+            if self.__input[0] != SXT:
+                del self.__input[0]
+                continue
+            try:
+                end = self.__input.index(EXT)
+            except ValueError:
+                return
+            if len(self.__input) < end + 3:
+                return
+            frame = bytes(self.__input[:end + 3])
+            del self.__input[:end + 3]
+            self.__frame(frame)
+
+    def __frame(self, frame: bytes):
+        self.frames += 1
+        if self.latency:
+            sleep(self.latency)
+        packet_id = frame[5]
+        code = int(frame[6:8], 16)
+        params = [x.decode("CP866") for x in frame[8:-3].split(bytes([DELIM]))[:-1]]
+        if frame[1:5].decode() != self.password:
+            self.__reply(packet_id, code, ERROR_FORMAT)
+            return
+        if self.bulk and self.failed:
+            if code == 0x31:
+                # Ответ не возвращается, документ остается открытым в обычном режиме
+                self.bulk = self.failed = False
+                return
+            if code != 0x32:
+                self.__reply(packet_id, code, ERROR_STATUS)
+                return
+        try:
+            answer = self.__execute(code, params)
+        except KeyError:
+            error = ERROR_FUNCTION
+        except (IndexError, ValueError):
+            error = ERROR_FORMAT
+        except RuntimeError:
+            error = ERROR_STATUS
+        else:
+            if self.bulk and code in BULK_CODES:
+                return
+            if code == 0x31:
+                self.bulk = False
+            self.__reply(packet_id, code, 0, answer)
+            return
+        if self.bulk:
+            self.failed = True
+        self.__reply(packet_id, code, error)
+
+    def __reply(self, packet_id: int, code: int, error: int, data=()):
+        result = [SXT, packet_id]
+        result.extend(ord(x) for x in "%02X" % code)
+        result.extend(ord(x) for x in "%02X" % error)
+        for value in data:
+            result.extend(str(value).encode("CP866"))
+            result.append(DELIM)
+        result.append(EXT)
+        crc = 0
+        for x in result[1:]:
+            crc ^= x
+        result.extend(ord(x) for x in "%02x" % crc)
+        self.__output.extend(result)
+
+    def __require(self, condition: bool):
+        if not condition:
+            raise RuntimeError()
+
+    def __execute(self, code: int, params: [str]):
+        if code == 0x00:
+            current = int(self.no_begin) | int(self.shift_open) << 2 | int(self.shift_more_24) << 3
+            return [0, current, self.doc_type << 4 | self.condition]
+        if code == 0x01:
+            return [params[0], {"1": self.shift, "2": self.cheque}[params[0]]]
+        if code == 0x02:
+            values = {"1": self.serial, "2": 1, "3": "7700000000", "4": "0000000001000001",
+                      "8": self.document, "9": self.shift, "11": "%08i" % self.document}
+            return [params[0], values.get(params[0], "0")]
+        if code == 0x04:
+            return [0]
+        if code == 0x05:
+            return [params[0], {"7": 3100}.get(params[0], "0")]
+        if code == 0x06:
+            return [params[0], 0, ""]
+        if code == 0x0A:
+            return []
+        if code == 0x10:
+            self.no_begin = False
+            return []
+        if code == 0x11:
+            return [self.settings.get(params[0], "0")]
+        if code == 0x12:
+            self.settings[params[0]] = params[2]
+            return []
+        if code == 0x13:
+            now = datetime.now()
+            return [now.strftime("%d%m%y"), now.strftime("%H%M%S")]
+        if code == 0x14:
+            self.__require(not self.shift_open)
+            return []
+        self.__require(not self.no_begin)
+        if code == 0x15:
+            size, offset = int(params[0]), int(params[1])
+            self.__require(offset == 0 or offset == len(self.logo))
+            self.logo = (b"" if offset == 0 else self.logo) + bytes.fromhex(params[2])
+            self.__require(len(self.logo) <= size)
+            return []
+        if code == 0x16:
+            self.logo = b""
+            return []
+        if code in (0x18, 0x82):
+            return []
+        if code == 0x20:
+            self.__require(self.condition == 0)
+            self.printed += 20
+            return []
+        if code == 0x21:
+            self.__require(self.shift_open and self.condition == 0)
+            self.shift_open = self.shift_more_24 = False
+            self.__fiscal(5)
+            self.printed += 40
+            return []
+        if code == 0x23:
+            self.__require(not self.shift_open)
+            self.shift_open = True
+            self.shift += 1
+            self.cheque = 1
+            self.__fiscal(2)
+            return []
+        if code == 0x30:
+            self.__require(self.condition == 0)
+            mode = int(params[0])
+            doc_type = mode & 0x0F
+            DocumentType(doc_type)
+            self.__require(doc_type == DocumentType.SERVICE.value or self.shift_open)
+            self.doc_type = doc_type
+            self.condition = 1
+            self.bulk = mode & 1 << 4 != 0
+            self.failed = False
+            self.total = self.items = self.paid = 0
+            return []
+        if code == 0x31:
+            self.__require(self.condition != 0)
+            doc_type = self.doc_type
+            self.doc_type = self.condition = 0
+            self.document += 1
+            if doc_type not in OPERATIONS:
+                return [self.document - 1, "%08i" % self.document]
+            self.__fiscal(3, OPERATIONS[doc_type])
+            self.cheque += 1
+            now = datetime.now()
+            return [self.document - 1, "%08i" % self.document, "%i %i" % (self.fd, self.fd * 7919),
+                    self.fd, self.fd * 7919, self.shift, self.cheque - 1, now.strftime("%d%m%y"),
+                    now.strftime("%H%M%S")]
+        if code in (0x32, 0x33):
+            self.__require(self.condition != 0)
+            self.doc_type = self.condition = 0
+            self.bulk = self.failed = False
+            return []
+        if code == 0x24:
+            self.__require(self.condition == 1 and self.doc_type in OPERATIONS)
+            return []
+        if code == 0x34:
+            return []
+        if code in (0x40, 0x41):
+            self.__require(self.condition == 1)
+            self.printed += 1
+            return []
+        if code == 0x42:
+            self.__require(self.condition == 1 and self.doc_type in (2, 3, 6, 7))
+            self.__require(len(params[0]) <= 224)
+            self.total += int(item_total(params[2], params[3]) * 100)
+            self.items += 1
+            self.printed += 2
+            return []
+        if code == 0x44:
+            self.__require(self.condition in (1, 2))
+            self.condition += 1
+            return []
+        if code == 0x45:
+            self.__require(self.condition == 2 and int(params[0]) in (0, 1))
+            value = float(params[2])
+            self.total -= round(self.total * value / 100 if params[0] == "0" else value * 100)
+            return []
+        if code == 0x47:
+            self.__require(self.condition in (1, 2, 3) and 0 <= int(params[0]) <= 15)
+            self.paid += round(float(params[1]) * 100)
+            self.condition = 4 if self.paid >= self.total else 3
+            return []
+        if code == 0x48:
+            self.__require(self.condition == 1 and self.doc_type in (4, 5))
+            self.printed += 1
+            return []
+        if code == 0x78:
+            return self.__fn(params)
+        raise KeyError(code)
+
+    def __fn(self, params: [str]):
+        number = params[0]
+        if number == "1":
+            return [number, "9999078900000001"]
+        if number == "2":
+            return [number, 3 << 4 | int(self.shift_open) << 6]
+        if number == "3":
+            return [number, self.fd]
+        if number == "6":
+            return [number, self.shift, int(self.shift_open), self.cheque]
+        if number == "7":
+            return [number, 1 << 1 if self.ofd else 0, self.ofd, self.fd - self.ofd + 1 if self.ofd else 0,
+                    "000000", "000000"]
+        if number == "15":
+            doc_type, self.reading = self.archive[int(params[1])]
+            return [number, doc_type, len(self.reading)]
+        if number == "16":
+            block = self.reading[:BLOCK_SIZE]
+            self.reading = self.reading[BLOCK_SIZE:]
+            return [number, block.hex().upper()] if block else [number]
+        raise KeyError(number)
+
+    def __fiscal(self, doc_type: int, operation: int = None):
+        self.fd += 1
+        self.ofd += 1
+        tags = [(1040, self.fd.to_bytes(4, "little")),
+                # ФН хранит местное время в формате UnixTime
+                (1012, int(datetime.now().replace(tzinfo=timezone.utc).timestamp()).to_bytes(4, "little")),
+                (1038, self.shift.to_bytes(4, "little")),
+                (1077, (self.fd * 7919).to_bytes(6, "big"))]
+        if operation is not None:
+            tags += [(1042, self.cheque.to_bytes(4, "little")),
+                     (1054, operation.to_bytes(1, "little")),
+                     (1020, self.total.to_bytes(6, "little"))]
+            tags += [(1059, b"")] * self.items
+        data = bytearray()
+        for tag, value in tags:
+            data.extend(tag.to_bytes(2, "little") + len(value).to_bytes(2, "little") + value)
+        self.archive[self.fd] = doc_type, bytes(data)
+        if len(self.archive) > ARCHIVE_SIZE:
+            self.archive.popitem(last=False)
+
+    def __str__(self):
+        return "emulator:" + self.serial
@@ -0,0 +1,87 @@
+from threading import Event, Lock
+from time import monotonic
+
+
+class Call:
+    """Выполняемый или выполненный запрос"""
+
+    def __init__(self):
+        self.event = Event()
+        self.result = None
+        self.error = None
+        self.time = None  # Время получения ответа (monotonic)
+
+
+class SingleFlight:
+    """
+    Объединение одновременных одинаковых запросов
+
+    Потоки, запросившие одно и то же, пока запрос уже выполняется, ждут его и получают тот же результат. Если задано
+    окно свежести, уже полученный результат отдается без нового запроса, пока он не старше окна.
+    """
+
+    def __init__(self, freshness: float = 0.0):
+        """
+        :param freshness: окно свежести результата по умолчанию (сек)
+        """
+        self.freshness = freshness
+        self.__horizon = freshness  # Сколько хранить выполненные запросы
+        self.__lock = Lock()
+        self.__calls = {}
+
+    def do(self, key, function, freshness: float = None, wait: bool = True):
+        """
+        Выполнить запрос или присоединиться к уже выполняемому
+        :param key: ключ запроса
+        :param function: функция, выполняющая запрос
+        :param freshness: окно свежести результата (сек), по умолчанию - заданное в конструкторе
+        :param wait: присоединяться к выполняемому запросу, иначе выполнить свой
+        :return: результат function
+        """
+        if freshness is None:
+            freshness = self.freshness
+        with self.__lock:
+            call = self.__calls.get(key)
+            if call is not None and call.event.is_set():
+                if call.error is None and monotonic() - call.time <= freshness:
+                    return call.result
+                call = None
+            leader = call is None
+            if leader:
+                self.__horizon = max(self.__horizon, freshness)
+                self.__prune()
+                call = Call()
+                self.__calls[key] = call
+        if not leader:
+            if not wait:
+                return function()
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            call.time = monotonic()
+            call.event.set()
+            if self.__horizon <= 0:
+                with self.__lock:
+                    if self.__calls.get(key) is call:
+                        del self.__calls[key]
+
+    def forget(self):
+        """Сбросить сохраненные результаты"""
+        with self.__lock:
+            for key in [key for key, call in self.__calls.items() if call.event.is_set()]:
+                del self.__calls[key]
+
+    def __prune(self):
+        now = monotonic()
+        expired = [key for key, call in self.__calls.items()
+                   if call.event.is_set() and now - call.time > self.__horizon]
+        for key in expired:
+            del self.__calls[key]
@@ -1,7 +1,24 @@
-from dataclasses import dataclass
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, replace
+from datetime import date
+from threading import Lock
 
+from viki.archive import ArchiveReader, CHEQUE_DOCUMENT
+from viki.audit import AuditWriter, record
 from viki.data import TaxSystem, DocumentType, CutFlag, PaymentType, SubjectMatter, CloseDocData, KKTStatus
-from viki.kkt import KKT, KKTAccess
+from viki.idempotency import IdempotencyStore
+from viki.index import DocumentIndex, OPERATIONS
+from viki.kkt import KKT, KKTAccess, SettingsData, Session
+from viki.preflight import validate, item_total, Totals, CASH
+from viki.printing import ServicePrinter
+from viki.scheduler import ShiftScheduler
+from viki.schema import OPEN_DOC, ADD_ITEM, PAYMENT, CLOSE_DOC
+from viki.shadow import Shadow
+from viki.transport import TransportError
+
+log = logging.getLogger(__name__)
 
 
 class ItemTax:
@@ -31,14 +48,65 @@ class Cheque:
     def __init__(self, document_type: DocumentType):
         self.type = document_type
         self.items: [Item] = []
+        self.payments: [(int, float)] = []  # Оплаты (код типа платежа, сумма), если пусто - итог наличными
+        self.address: str = None  # Телефон или электронная почта покупателя для электронного чека
 
     @property
     def total(self) -> float:
-        """Сумма чека"""
-        result = 0.0
-        for item in self.items:
-            result = result + item.count * item.price
-        return result
+        """Сумма чека с округлением позиций как на кассе"""
+        return float(sum(item_total(item.count, item.price) for item in self.items))
+
+    def pay(self, code: int, total: float):
+        """
+        Добавить оплату
+        :param code: код типа платежа (0..15) из настроек кассы обычно 0 - наличными, 1-электронными
+        :param total: сумма
+        """
+        self.payments.append((code, total))
+
+    def validate(self) -> Totals:
+        """Проверить чек без обращения к кассе (см. preflight.validate)"""
+        return validate(self, self.payments or None)
+
+    def compile(self, kkt: KKT, number: int = 0, bulk: bool = True) -> "CompiledCheque":
+        """
+        Проверить чек и закодировать его команды в кадры без обращения к кассе
+        :param kkt: касса, от текущего сеанса которой берутся кассир и система налогообложения
+        :param number: номер документа при внешней нумерации чеков
+        :param bulk: открыть документ в пакетном режиме
+        """
+        totals = self.validate()
+        # Чек может меняться после кодирования, поэтому кадры и запись аудита строятся по копии
+        items = tuple(replace(item) for item in self.items)
+        payments = tuple(self.payments)
+        mode = self.type.value | 1 << 4 if bulk else self.type.value
+        frames = [OPEN_DOC.frame(mode, 0, kkt.operator, number, kkt.tax_system)]
+        for item in items:
+            frames.append(ADD_ITEM.frame(item.title, "", item.count, item.price, item.tax, payment=item.payment,
+                                         subject=item.subject))
+        for code, total in payments or [(CASH, totals.total)]:
+            frames.append(PAYMENT.frame(code, float(total)))
+        frames.append(CLOSE_DOC.frame(CutFlag.NONE, self.address or None))
+        return CompiledCheque(self.type, items, payments, self.address, tuple(frames), totals.total, number, bulk)
+
+
+@dataclass(frozen=True)
+class CompiledCheque:
+    """
+    Чек, закодированный в кадры команд
+
+    Кадры не зависят от ID пакета и не расходуются при отправке, поэтому чек можно отправить повторно или сохранить
+    в журнал как есть. Тип, позиции, оплаты и адрес копируются из исходного чека при кодировании и не меняются вместе
+    с ним
+    """
+    type: DocumentType  # Тип чека
+    items: tuple  # Копии позиций (Item)
+    payments: tuple  # Оплаты (код типа платежа, сумма)
+    address: str  # Телефон или электронная почта покупателя для электронного чека
+    frames: tuple  # schema.Frame: открыть документ, позиции, оплаты, завершить документ
+    total: float  # Итог чека
+    number: int  # Номер документа при внешней нумерации
+    bulk: bool  # Документ открывается в пакетном режиме
 
 
 class ShiftHelper(KKTAccess):
@@ -57,7 +125,7 @@ class ShiftHelper(KKTAccess):
         Статус смены
         :return: открыта или закрыта
         """
-        return self.kkt.status.current.shift_open
+        return self.kkt.state.current.shift_open
 
     def close(self):
         """Закрыть смену"""
@@ -72,28 +140,64 @@ class KKTHelper:
     Надо добавить больше проверок на состояние кассы
     """
 
-    def __init__(self, port: str,
+    def __init__(self, port,
                  operator_inn: str,
                  operator: str,
-                 tax_system: TaxSystem):
+                 tax_system: TaxSystem,
+                 reconnect: float = 30.0):
         """
 
-        :param port: порт кассы
+        Соединение с кассой и начало работы выполняются при первом обращении к кассе
+        :param port: порт кассы (имя порта, "usb:<серийный номер>" или Transport)
         :param operator_inn: ИНН оператора
         :param operator: Имя оператора
         :param tax_system: Система налогообложения
+        :param reconnect: время восстановления связи после потери (сек), 0 - не восстанавливать
         """
         # TODO Брать tax_system из натсроек кассы
-        self.kkt = KKT(port, operator_inn, operator, tax_system)
-        self.kkt.begin()
-        self.check()
+        self.kkt = KKT(port, operator_inn, operator, tax_system, reconnect=reconnect)
+        self.shadow = Shadow(self.kkt)  # Состояние смены и документа без запроса статуса перед каждым чеком
+        self.scheduler: ShiftScheduler = None
+        self.index: DocumentIndex = None  # Индекс, в который добавляются напечатанные чеки
+        self.audit: AuditWriter = None  # Фоновая запись аудита напечатанных чеков
+        self.keys: IdempotencyStore = None  # Результаты чеков по ключам идемпотентности
+        self.__begun: date = None  # День, в который уже была выполнена проверка начала работы
+        self.__electronic = 0  # Количество активных контекстов electronic
+        self.__electronic_lock = Lock()
+        self.__unrestored = False  # Последний контекст не смог восстановить параметры ПУ и оставил счетчик
+        self.__printer = None  # Параметры ПУ до включения режима без печати
+        self.__compiler: ThreadPoolExecutor = None  # Поток компиляции чеков, создается при первом обращении
+        self.__compiler_lock = Lock()
 
-    def check(self):
-        if not self.kkt.status.fatal.check():
+    def prepare(self):
+        """
+        Начало работы с кассой
+
+        Выполняется один раз в день: одним запросом статуса проверяется, было ли уже вызвано начало работы, и
+        begin отправляется только при необходимости
+        """
+        today = date.today()
+        if self.__begun == today:
+            return
+        status = self.kkt.status
+        if status.current.no_begin:
+            self.kkt.begin()
+            status.current.no_begin = False
+        self.check(status)
+        self.__begun = today
+
+    def check(self, status: KKTStatus = None):
+        """
+        Проверить состояние кассы
+        :param status: уже прочитанный статус ККТ, если не передан - запрашивается
+        """
+        if status is None:
+            status = self.kkt.status
+        if not status.fatal.check():
             raise Exception("Фатальная ошибка ККТ!")
-        if self.kkt.status.current.no_begin:
+        if status.current.no_begin:
             raise Exception("Ошибка начала работы")
-        if self.kkt.status.current.shift_more_24:
+        if status.current.shift_more_24:
             raise Exception("Смена открыта более 24 часов!")
 
     @property
@@ -101,17 +205,216 @@ class KKTHelper:
         """Управление сменой"""
         return ShiftHelper(self.kkt)
 
-    def print_cheque(self, cheque: Cheque) -> CloseDocData:
-        """Печать чека"""
-        if not self.shift.status():
-            raise Exception("Смена не открыта!")
-        if not self.kkt.status.document.condition == KKTStatus.Document.Condition.CLOSE:
-            raise Exception("Открыт другой документ")
-        self.kkt.open_doc(cheque.type)
-        for item in cheque.items:
-            self.kkt.add_item(item.title, "", item.count, item.price, item.tax, item.payment, item.subject)
-        self.kkt.doc_payment(0, cheque.total)
-        return self.kkt.close_doc(CutFlag.NONE)
-
-    def print_egais(self):
-        self.kkt.open_doc(DocumentType.SERVICE)
+    def schedule(self, **kwargs) -> ShiftScheduler:
+        """
+        Запустить планировщик смены, переоткрывающий смену в периоды простоя до истечения 24 часов
+        :param kwargs: параметры ShiftScheduler
+        """
+        if self.scheduler is None:
+            self.prepare()
+            self.scheduler = ShiftScheduler(self.kkt, **kwargs)
+            self.scheduler.track()
+            self.scheduler.start()
+        return self.scheduler
+
+    def hold(self):
+        """Контекст работы с документом, на время которого планировщик не трогает смену"""
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.hold()
+
+    @property
+    def paperless(self) -> bool:
+        """Включен режим электронных чеков без печати"""
+        return self.__electronic > 0
+
+    @contextmanager
+    def electronic(self):
+        """
+        Контекст печати электронных чеков: документы не печатаются на чековой ленте
+
+        При входе в первый контекст включается настройка ПУ “Не печатать документы”, запись проверяется чтением, при
+        выходе из последнего восстанавливаются прежние параметры ПУ. Переключение выполняется только при закрытом
+        документе. Каждый чек внутри контекста должен содержать адрес покупателя (Cheque.address).
+
+        Если восстановить параметры ПУ не удалось, касса остается в режиме без печати, а восстановление повторяется
+        при выходе из следующего контекста. Ошибка восстановления записывается в журнал и передается вызывающему,
+        только если контекст завершился без другой ошибки.
+        """
+        with self.__electronic_lock:
+            if self.__electronic == 0:
+                self.__switch(True)
+            if self.__unrestored:
+                # Контекст принимает счетчик, оставленный неудачным восстановлением
+                self.__unrestored = False
+            else:
+                self.__electronic += 1
+        error = None
+        try:
+            yield self
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            with self.__electronic_lock:
+                restored = self.__electronic > 1
+                if not restored:
+                    try:
+                        self.__switch(False)
+                        restored = True
+                    except Exception:
+                        log.exception("Не удалось восстановить параметры ПУ после печати электронных чеков")
+                        if error is None:
+                            raise
+                if restored:
+                    self.__electronic -= 1
+                else:
+                    self.__unrestored = True
+
+    def __switch(self, paperless: bool):
+        """Включить режим без печати или восстановить прежние параметры ПУ"""
+        self.prepare()
+        with self.hold(), self.kkt.lock:
+            if self.kkt.state.document.condition != KKTStatus.Document.Condition.CLOSE:
+                raise Exception("Открыт документ, параметры ПУ не изменены")
+            settings = self.kkt.settings
+            if paperless:
+                self.__printer = settings.printer
+                if self.__printer.no_print_doc:
+                    return
+                target = SettingsData.Printer(self.__printer.value())
+                target.no_print_doc = True
+            else:
+                target = self.__printer
+                if target.no_print_doc:
+                    self.__printer = None
+                    return
+            settings.printer = target
+            if settings.printer.value() != target.value():
+                raise Exception("Касса не приняла параметры ПУ")
+            if not paperless:
+                # Прежние параметры забываются только после подтверждения записи
+                self.__printer = None
+
+    def compile(self, cheque: Cheque, number: int = 0) -> Future:
+        """
+        Закодировать чек в фоновом потоке, пока касса занята предыдущим
+        :return: Future с CompiledCheque
+        """
+        with self.__compiler_lock:
+            if self.__compiler is None:
+                self.__compiler = ThreadPoolExecutor(1, thread_name_prefix="viki-compile")
+            return self.__compiler.submit(self.__compile, cheque, number, self.kkt.current)
+
+    def __compile(self, cheque: Cheque, number: int, session: Session) -> CompiledCheque:
+        # Кадр открытия документа кодируется от имени кассира вызывающего потока
+        with self.kkt.use(session):
+            return cheque.compile(self.kkt, number)
+
+    def close(self):
+        """
+        Остановить поток компиляции и закрыть соединение с кассой
+
+        Поставленные в очередь чеки докодируются до остановки потока. Последующий вызов compile создаст поток заново
+        """
+        with self.__compiler_lock:
+            compiler, self.__compiler = self.__compiler, None
+        if compiler is not None:
+            compiler.shutdown()
+        self.kkt.close()
+
+    def print_cheque(self, cheque, key: str = None) -> CloseDocData:
+        """
+        Печать чека
+
+        Чек кодируется до захвата кассы, на время печати касса занята только обменом. Если связь была потеряна и
+        восстановлена (см. KKT.reconnect), а документ остался открытым, он аннулируется и тот же чек отправляется еще раз
+        :param cheque: Cheque или CompiledCheque
+        :param key: ключ идемпотентности: повтор с тем же ключом возвращает результат первой печати (нужен keys), в
+            том числе если первая попытка завершилась ошибкой после фискализации документа
+        """
+        if key is not None:
+            if self.keys is None:
+                raise Exception("Не задано хранилище ключей идемпотентности")
+            return self.keys.run(key, lambda: self.__print(cheque, key),
+                                 lambda marker: self.__reconcile(cheque, marker))
+        return self.__print(cheque)
+
+    def __print(self, cheque, key: str = None) -> CloseDocData:
+        compiled = cheque if isinstance(cheque, CompiledCheque) else cheque.compile(self.kkt)
+        if self.paperless and not compiled.address:
+            raise Exception("Для электронного чека нужен телефон или электронная почта покупателя")
+        self.prepare()
+        with self.hold(), self.kkt.lock:
+            status = self.kkt.state
+            if not status.current.shift_open:
+                raise Exception("Смена не открыта!")
+            if not status.document.condition == KKTStatus.Document.Condition.CLOSE:
+                raise Exception("Открыт другой документ")
+            if compiled.number == 0 and self.shadow.external_counter:
+                raise Exception("Настроена внешняя нумерация чеков, необходимо передавать номер документа!")
+            # Номер запрашивается до печати: ошибка запроса после печати потеряла бы запись аудита
+            serial = self.shadow.serial if self.audit is not None else None
+            if key is not None:
+                # С этого момента чек может быть фискализирован, даже если попытка завершится ошибкой
+                self.keys.mark(key, {"number": int(self.kkt.exchange_fn.number_last_doc),
+                                     "operation": OPERATIONS.get(compiled.type), "total": round(compiled.total * 100),
+                                     "items": len(compiled.items)})
+            try:
+                result = self.kkt.send_document(compiled.frames, compiled.bulk)
+            except TransportError:
+                if not self.kkt.transport.is_open or \
+                        self.kkt.status.document.condition == KKTStatus.Document.Condition.CLOSE:
+                    raise
+                self.kkt.cancel_doc()
+                result = self.kkt.send_document(compiled.frames, compiled.bulk)
+            result = CloseDocData(result)
+        self.__register(result, compiled, serial)
+        return result
+
+    def __reconcile(self, cheque, marker: dict) -> CloseDocData:
+        """
+        Найти в ФН чек попытки, завершившейся ошибкой после отметки (см. IdempotencyStore.mark)
+
+        Отметка ставится под захватом кассы непосредственно перед отправкой документа, поэтому фискализированный чек
+        попытки - следующий за отмеченным документ. Документ признается чеком попытки, только если совпадают признак
+        расчета, итог и количество позиций из отметки. Оставшийся открытым документ попытки аннулируется
+        :return: результат по документу ФН или None, если чек не фискализирован
+        """
+        compiled = cheque if isinstance(cheque, CompiledCheque) else cheque.compile(self.kkt)
+        expected = (CHEQUE_DOCUMENT, marker.get("operation", OPERATIONS.get(compiled.type)),
+                    marker.get("total", round(compiled.total * 100)), marker.get("items", len(compiled.items)))
+        number = marker["number"] + 1
+        self.prepare()
+        with self.hold(), self.kkt.lock:
+            if int(self.kkt.exchange_fn.number_last_doc) < number:
+                if self.kkt.status.document.condition != KKTStatus.Document.Condition.CLOSE:
+                    self.kkt.cancel_doc()
+                return None
+            document = ArchiveReader(self.kkt).document(number)
+            serial = self.shadow.serial if self.audit is not None else None
+        if (document.type, document.operation, document.total, document.items) != expected:
+            return None
+        result = CloseDocData.load({
+            "number": None, "counter": None, "string_fd_fp": None, "number_fd": document.number,
+            "fp_sign": document.fp, "shift_number": document.shift, "number_doc_in_shift": document.number_in_shift,
+            "date": document.datetime.strftime("%d%m%y"), "time": document.datetime.strftime("%H%M%S")})
+        self.__register(result, compiled, serial)
+        return result
+
+    def __register(self, result: CloseDocData, compiled: CompiledCheque, serial: str):
+        """Добавить напечатанный чек в индекс и аудит"""
+        if self.index is not None:
+            self.index.add_close(result, compiled.type, compiled.total)
+        if self.audit is not None:
+            self.audit.submit(record(result, compiled, serial))
+
+    def print_egais(self, lines, width: int = 42):
+        """
+        Печать слипа ЕГАИС (или любого другого сервисного документа)
+        :param lines: итератор из строк, printing.Barcode и printing.QRCode
+        :param width: ширина строки в символах
+        """
+        self.prepare()
+        with self.hold(), self.kkt.lock:
+            ServicePrinter(self.kkt, width).print(lines)
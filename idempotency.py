@@ -0,0 +1,170 @@
+import json
+import logging
+import sqlite3
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+from viki.data import CloseDocData
+from viki.flight import Call
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    key TEXT PRIMARY KEY,
+    expires REAL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS keys_expires ON keys (expires);
+"""
+
+
+class IdempotencyStore:
+    """
+    Результаты чеков по ключам идемпотентности
+
+    Ключ задает вызывающая система (например, номер заказа). Результат закрытия чека хранится в памяти и в базе
+    SQLite ttl секунд, поэтому повтор с тем же ключом возвращает его без обращения к кассе, в том числе после
+    перезапуска. Повтор, пришедший, пока первая попытка еще печатается, ждет ее и получает ее результат или ошибку.
+    В памяти хранятся последние cache результатов, остальные читаются из базы.
+
+    Перед отправкой документа попытка сохраняет отметку (см. mark): если попытка завершилась ошибкой, документ мог
+    быть фискализирован. Следующий повтор находит отметку и сначала сверяется с ФН (reconcile), а печатает чек заново,
+    только если документа в ФН нет.
+    """
+
+    def __init__(self, path: str = ":memory:", ttl: float = 7 * 24 * 3600, purge: float = 60.0, cache: int = 1024):
+        """
+        :param path: путь к файлу базы SQLite
+        :param ttl: время хранения результата (сек)
+        :param purge: период удаления просроченных ключей (сек)
+        :param cache: количество результатов, хранимых в памяти
+        """
+        self.ttl = ttl
+        self.purge_interval = purge
+        self.cache = cache
+        self.__lock = Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.executescript(SCHEMA)
+        self.__results = OrderedDict()  # Ключ -> (срок хранения, CloseDocData), последние использованные в конце
+        self.__calls = {}  # Ключ -> выполняемая попытка
+        self.__purged = 0.0
+        self.purge()
+
+    def get(self, key: str) -> CloseDocData:
+        """Сохраненный результат или None"""
+        now = time()
+        with self.__lock:
+            return self.__get(key, now)
+
+    def put(self, key: str, result: CloseDocData):
+        """Сохранить результат"""
+        now = time()
+        expires = now + self.ttl
+        with self.__lock:
+            self.__cache(key, (expires, result))
+            with self.__db:
+                self.__db.execute("INSERT OR REPLACE INTO keys (key, expires, data) VALUES (?, ?, ?)",
+                                  (key, expires, json.dumps(result.dict(), ensure_ascii=False)))
+        if now - self.__purged >= self.purge_interval:
+            self.purge()
+
+    def mark(self, key: str, marker: dict):
+        """
+        Сохранить отметку попытки перед отправкой документа, результат попытки заменит ее
+        :param marker: данные для сверки с ФН (см. run)
+        """
+        expires = time() + self.ttl
+        with self.__lock:
+            with self.__db:
+                self.__db.execute("INSERT OR REPLACE INTO keys (key, expires, data) VALUES (?, ?, ?)",
+                                  (key, expires, json.dumps({"pending": marker}, ensure_ascii=False)))
+
+    def pending(self, key: str) -> dict:
+        """Отметка попытки, завершившейся неизвестно чем, или None"""
+        with self.__lock:
+            row = self.__db.execute("SELECT expires, data FROM keys WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] <= time():
+            return None
+        return json.loads(row[1]).get("pending")
+
+    def run(self, key: str, function, reconcile=None) -> CloseDocData:
+        """
+        Выполнить попытку по ключу один раз
+        :param key: ключ идемпотентности
+        :param function: функция, печатающая чек и возвращающая CloseDocData
+        :param reconcile: функция (отметка) -> CloseDocData документа, найденного в ФН, или None, если документа нет;
+            вызывается вместо повторной печати, если предыдущая попытка оставила отметку (см. mark)
+        :return: результат первой успешной попытки
+        """
+        with self.__lock:
+            result = self.__get(key, time())
+            if result is not None:
+                return result
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = Call()
+                self.__calls[key] = call
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            marker = self.pending(key) if reconcile is not None else None
+            if marker is not None:
+                call.result = reconcile(marker)
+            if call.result is None:
+                call.result = function()
+            try:
+                self.put(key, call.result)
+            except Exception:
+                # Чек уже напечатан: повтор найдет отметку и сверится с ФН
+                log.exception("Не удалось сохранить результат по ключу %s", key)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.event.set()
+
+    def purge(self):
+        """Удалить просроченные ключи"""
+        now = time()
+        with self.__lock:
+            self.__purged = now
+            for key in [key for key, (expires, _) in self.__results.items() if expires <= now]:
+                del self.__results[key]
+            with self.__db:
+                self.__db.execute("DELETE FROM keys WHERE expires <= ?", (now,))
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
+
+    def __get(self, key: str, now: float) -> CloseDocData:
+        cached = self.__results.get(key)
+        if cached is None:
+            row = self.__db.execute("SELECT expires, data FROM keys WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            data = json.loads(row[1])
+            if "pending" in data:
+                return None
+            cached = (row[0], CloseDocData.load(data))
+            self.__cache(key, cached)
+        else:
+            self.__results.move_to_end(key)
+        if cached[0] <= now:
+            return None
+        return cached[1]
+
+    def __cache(self, key: str, value: tuple):
+        self.__results[key] = value
+        self.__results.move_to_end(key)
+        while len(self.__results) > self.cache:
+            self.__results.popitem(last=False)
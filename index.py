@@ -0,0 +1,151 @@
+import sqlite3
+from datetime import datetime, date
+from threading import Lock
+
+from viki.archive import ArchiveReader, Document, CHEQUE_DOCUMENT
+from viki.data import CloseDocData, DocumentType
+from viki.kkt import KKT
+
+OPERATIONS = {
+    DocumentType.SALE: 1,  # Приход
+    DocumentType.SALE_RETURN: 2,  # Возврат прихода
+    DocumentType.PURCHASE: 3,  # Расход
+    DocumentType.PURCHASE_RETURN: 4,  # Возврат расхода
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    number INTEGER PRIMARY KEY,
+    type INTEGER,
+    datetime TEXT,
+    date TEXT,
+    shift INTEGER,
+    number_in_shift INTEGER,
+    operation INTEGER,
+    total INTEGER,
+    fp INTEGER,
+    items INTEGER
+);
+CREATE INDEX IF NOT EXISTS documents_shift ON documents (shift, number_in_shift);
+CREATE INDEX IF NOT EXISTS documents_date ON documents (date);
+CREATE INDEX IF NOT EXISTS documents_fp ON documents (fp);
+CREATE INDEX IF NOT EXISTS documents_total ON documents (total);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+"""
+
+COLUMNS = "number, type, datetime, shift, number_in_shift, operation, total, fp, items"
+
+
+class DocumentIndex:
+    """
+    Локальный индекс фискальных документов
+
+    Документы попадают в индекс при закрытии чека (add_close) и догружаются из архива ФН (sync), начиная с номера,
+    до которого архив уже прочитан. Поиск по номеру ФД, смене, дате, сумме и ФП не обращается к кассе.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        """
+        :param path: путь к файлу базы SQLite
+        """
+        self.__lock = Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.executescript(SCHEMA)
+
+    @property
+    def position(self) -> int:
+        """Номер документа, до которого прочитан архив ФН"""
+        with self.__lock:
+            row = self.__db.execute("SELECT value FROM meta WHERE key = 'position'").fetchone()
+        return row[0] if row else 0
+
+    def add(self, document: Document):
+        """Добавить или обновить документ"""
+        with self.__lock, self.__db:
+            self.__insert(document)
+
+    def add_close(self, close: CloseDocData, document_type: DocumentType, total) -> Document:
+        """
+        Добавить чек по ответу команды завершения документа
+        :param close: ответ close_doc
+        :param document_type: тип документа
+        :param total: итог чека (руб)
+        """
+        document = Document(close.number_fd, CHEQUE_DOCUMENT,
+                            datetime.strptime(close.date + close.time, "%d%m%y%H%M%S"),
+                            close.shift_number, close.number_doc_in_shift, OPERATIONS.get(document_type),
+                            round(total * 100), close.fp_sign)
+        self.add(document)
+        return document
+
+    def sync(self, kkt: KKT, batch: int = 100) -> int:
+        """
+        Догрузить из архива ФН документы новее прочитанных
+        :param kkt: касса
+        :param batch: документов в одной транзакции
+        :return: количество загруженных документов
+        """
+        reader = ArchiveReader(kkt, self.position)
+        count = 0
+        pending = []
+        for document in reader.read():
+            pending.append(document)
+            if len(pending) >= batch:
+                count += self.__flush(pending, reader.position)
+        return count + self.__flush(pending, reader.position)
+
+    def __flush(self, documents: [Document], position: int) -> int:
+        with self.__lock, self.__db:
+            for document in documents:
+                self.__insert(document)
+            self.__db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('position', ?)", (position,))
+        count = len(documents)
+        documents.clear()
+        return count
+
+    def __insert(self, document: Document):
+        self.__db.execute(
+            "INSERT OR REPLACE INTO documents (%s, date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)" % COLUMNS,
+            (document.number, document.type,
+             document.datetime.isoformat() if document.datetime else None,
+             document.shift, document.number_in_shift, document.operation, document.total, document.fp,
+             document.items, document.datetime.date().isoformat() if document.datetime else None))
+
+    def __select(self, where: str, *args) -> [Document]:
+        with self.__lock:
+            rows = self.__db.execute("SELECT %s FROM documents WHERE %s ORDER BY number" % (COLUMNS, where),
+                                     args).fetchall()
+        return [Document(row[0], row[1], datetime.fromisoformat(row[2]) if row[2] else None, *row[3:])
+                for row in rows]
+
+    def by_number(self, number: int) -> Document:
+        """Документ по номеру ФД"""
+        result = self.__select("number = ?", number)
+        return result[0] if result else None
+
+    def by_fp(self, fp: int) -> [Document]:
+        """Документы по фискальному признаку"""
+        return self.__select("fp = ?", fp)
+
+    def by_shift(self, shift: int) -> [Document]:
+        """Документы смены"""
+        return self.__select("shift = ?", shift)
+
+    def by_date(self, day: date) -> [Document]:
+        """Документы за день"""
+        return self.__select("date = ?", day.isoformat())
+
+    def by_total(self, total, day: date = None) -> [Document]:
+        """
+        Чеки на сумму
+        :param total: итог чека (руб)
+        :param day: день
+        """
+        if day is None:
+            return self.__select("total = ?", round(total * 100))
+        return self.__select("total = ? AND date = ?", round(total * 100), day.isoformat())
+
+    def close(self):
+        """Закрыть базу"""
+        with self.__lock:
+            self.__db.close()
@@ -1,11 +1,38 @@
-from dataclasses import dataclass
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
 from datetime import datetime
-from serial import Serial
+from threading import RLock, local
+from time import monotonic, sleep
 
+from viki.breaker import CircuitBreaker, CircuitOpenError
 from viki.data import FNStatus, FNShiftStatus, FNOFDStatus, KKTStatus, PrinterStatus, ExtendErrorCode, CloseDocData,\
     BarcodeOut, BarcodeView, FontAttribute, DocumentType, TaxSystem, PaymentType, SubjectMatter, \
     CutFlag
-from viki.packet import Input, Output, Command
+from viki.flight import SingleFlight
+from viki.packet import Input, Output, Command, ENQ, ACK, DELIM
+from viki.preflight import check_cause
+from viki.schema import STATUS, PRINTER_STATUS, FN_SHIFT_STATUS, FN_EXCHANGE_STATUS, FN_START_DOCUMENT, \
+    FN_READ_DOCUMENT, OPEN_DOC, CLOSE_DOC, PRINT_TEXT, PRINT_BARCODE, ADD_ITEM, ITEM_REQUISITES, \
+    SUBTOTAL, DISCOUNT, PAYMENT, CASH_IN_OUT, LOAD_LOGO, LOGO_CHUNK, DELETE_LOGO
+from viki.transport import Transport, TransportError, SerialTransport, make_transport
+
+BULK_ID = 0x20  # Первый ID пакета в пакетном режиме
+BULK_IDS = 0xE0  # Количество различных ID пакетов в пакетном режиме
+BULK_WINDOW = 128  # Максимум команд пакетного режима без сверки с кассой, меньше BULK_IDS
+QUERY_CODES = {0x00, 0x01, 0x02, 0x04, 0x05, 0x11, 0x78}  # Команды запроса, не меняющие состояние ККТ
+CURSOR_COMMANDS = {(0x78, "15"), (0x78, "16")}  # (код, подкоманда) чтения документа ФН, сдвигают курсор чтения
+
+
+def is_query(code: int, params: bytes) -> bool:
+    """
+    Запрос, не меняющий состояние ККТ: такой обмен можно объединить с одновременным и безопасно повторить
+    :param code: код команды
+    :param params: параметры команды с разделителями, первый параметр - подкоманда
+    """
+    if code not in QUERY_CODES:
+        return False
+    subcode = bytes(params).split(bytes([DELIM]), 1)[0].decode("cp866", "replace")
+    return (code, subcode) not in CURSOR_COMMANDS
 
 
 class KKTAccess:
@@ -352,6 +379,23 @@ class SettingsData(KKTAccess):
                 result = result | 1 << 6
             return result
 
+    def read(self, number: int, index: int = 0) -> str:
+        """
+        Прочитать настройку
+        :param number: номер настройки
+        :param index: индекс в массиве
+        """
+        return self.kkt.send(Output(0x11).add_param(str(number)).add_param(str(index))).to_string(0)
+
+    def write(self, number: int, value, index: int = 0):
+        """
+        Записать настройку
+        :param number: номер настройки
+        :param value: значение
+        :param index: индекс в массиве
+        """
+        self.kkt.send(Output(0x12).add_param(str(number)).add_param(str(index)).add_param(str(value)))
+
     @property
     def printer(self) -> Printer:
         """Параметры ПУ"""
@@ -411,7 +455,20 @@ class SettingsData(KKTAccess):
     def kkt_number(self, value):
         self.kkt.send((Output(0x12).add_param("10").add_param("0").add_param(value)))
 
-    # TODO 11-54
+    BAUD_RATES = (2400, 4800, 9600, 14400, 19200, 38400, 57600, 115200)  # Скорости обмена по номеру настройки
+
+    @property
+    def baudrate(self) -> int:
+        """Скорость обмена с ПК"""
+        return SettingsData.BAUD_RATES[self.kkt.send(Output(0x11).add_param('11').add_param('0')).to_int(0)]
+
+    @baudrate.setter
+    def baudrate(self, value: int):
+        """Скорость обмена с ПК, ККТ переходит на новую скорость после ответа на команду"""
+        index = SettingsData.BAUD_RATES.index(value)
+        self.kkt.send((Output(0x12).add_param("11").add_param("0").add_param(str(index))))
+
+    # TODO 12-54
 
     @property
     def number_automat(self) -> str:
@@ -521,38 +578,232 @@ class ExchangeFNData(KKTAccess):
     @property
     def shift_status(self) -> FNShiftStatus:
         """Вернуть состояние текущей смены"""
-        packet = self.kkt.send(Output(0x78).add_param('6'))
-        return FNShiftStatus(packet.to_string(1), packet.to_bool(2), packet.to_string(3))
+        return FNShiftStatus(*FN_SHIFT_STATUS(self.kkt))
 
     @property
     def exchange_status(self) -> FNOFDStatus:
         """Вернуть состояние обмена с ОФД"""
-        packet = self.kkt.send(Output(0x78).add_param('7'))
-        print(packet)
-        return FNOFDStatus(packet.to_int(1), packet.to_string(2), packet.to_string(3), packet.to_datetime(4, 5))
+        return FNOFDStatus(*FN_EXCHANGE_STATUS(self.kkt))
+
+    # TODO 11-14
+
+    def start_document(self, number: int) -> (int, int):
+        """
+        Начать чтение документа из архива ФН
+        :param number: номер фискального документа
+        :return: тип документа, длина TLV данных документа
+        """
+        return tuple(FN_START_DOCUMENT.decode(self.kkt.send(FN_START_DOCUMENT.frame(number), freshness=0)))
+
+    def read_document(self) -> bytes:
+        """
+        Прочитать очередной блок TLV данных документа, начатого start_document
+        :return: блок данных, пустой - документ прочитан полностью
+        """
+        packet = self.kkt.send(FN_READ_DOCUMENT.frame(), freshness=0)
+        if len(packet.data) < 2:
+            return b""
+        return bytes.fromhex(packet.to_string(1))
+
+    # TODO 17-19
+
+
+@dataclass(frozen=True)
+class Session:
+    """Кассир и система налогообложения, от имени которых выполняются операции"""
+    operator: str  # "ИНН&Имя" кассира
+    tax_system: str  # Код системы налогообложения
 
-    # TODO 11-19
 
 class KKT:
 
     def __init__(self,
-                 port: str,
+                 port,
                  operator_inn: str,
                  operator: str,
                  tax_system: TaxSystem,
-                 password: str = "PIRI"):
+                 password: str = "PIRI",
+                 freshness: float = 0.0,
+                 tune: bool = False,
+                 breaker: CircuitBreaker = None,
+                 reconnect: float = 0.0):
+        """
+        Соединение с кассой не устанавливается до первой команды
+        :param port: имя последовательного порта, "unix:<путь сокета брокера>", "usb:<серийный номер>" или Transport
+        :param operator_inn: ИНН оператора
+        :param operator: Имя оператора
+        :param tax_system: Система налогообложения
+        :param password: пароль связи
+        :param freshness: окно свежести (сек), в течение которого ответ на запрос отдается повторно без обмена
+        :param tune: при соединении подобрать скорость обмена и параметры порта (см. tuning.tune)
+        :param breaker: предохранитель, отклоняющий команды, пока касса недоступна
+        :param reconnect: время (сек), в течение которого восстанавливается связь после ее потери, 0 - не
+            восстанавливать (см. reconnect)
+        """
         if len(operator) == 0:
             raise Exception("Имя оператора не может быть пустым")
-        self.operator = operator_inn + "&" + operator
-        self.tax_system = str(tax_system.value)
+        self.default = Session(operator_inn + "&" + operator, str(tax_system.value))  # Сеанс вне session
+        self.__session = local()  # Сеанс потока
         if len(password) != 4:
             raise Exception("Password length may be 4!")
         self.__pasword = password
-        self.port = Serial(port=port, baudrate=57600)
-        if not self.check_link():
-            raise Exception("Нет связи с кассой!")
+        # Порт открывается при первом обмене
+        self.transport: Transport = make_transport(port)
+        self.lock = RLock()  # Захватывается на время обмена с ККТ
+        self.flight = SingleFlight(freshness)  # Одновременные одинаковые запросы выполняются один раз
+        self.__tune = tune
+        self.tuning = None  # Результат подбора параметров канала связи
+        self.breaker = breaker
+        self.observers = []  # Функции (код команды, ответ), вызываются после каждого обмена, ответ None - ошибка связи
+        self.shadow = None  # Теневое состояние (см. shadow.Shadow)
+        self.reconnect_timeout = reconnect
+        self.__link = 0  # Номер соединения, увеличивается при каждом открытии канала
+        self.__recovery = local()  # Поток восстанавливает связь
         self.info = Info(self)
 
+    @property
+    def current(self) -> Session:
+        """Сеанс текущего потока"""
+        return getattr(self.__session, "value", None) or self.default
+
+    @property
+    def operator(self) -> str:
+        """Кассир текущего сеанса ("ИНН&Имя")"""
+        return self.current.operator
+
+    @operator.setter
+    def operator(self, value: str):
+        """Сменить кассира сеанса вне session ("ИНН&Имя"), открытые сеансы потоков не меняются"""
+        self.default = replace(self.default, operator=value)
+
+    @property
+    def tax_system(self) -> str:
+        """Система налогообложения текущего сеанса"""
+        return self.current.tax_system
+
+    @tax_system.setter
+    def tax_system(self, value: str):
+        """Сменить код системы налогообложения сеанса вне session, открытые сеансы потоков не меняются"""
+        self.default = replace(self.default, tax_system=value)
+
+    def session(self, operator: str = None, operator_inn: str = "", tax_system: TaxSystem = None):
+        """
+        Сеанс кассира: команды потока внутри контекста (open_doc, open_shift, close_shift, report_x) выполняются от
+        имени operator с системой налогообложения tax_system. Соединение, кэши и теневое состояние остаются общими,
+        поэтому смена кассира не требует переподключения. Сеансы могут быть вложенными
+        :param operator: имя кассира, None - кассир текущего сеанса
+        :param operator_inn: ИНН кассира
+        :param tax_system: система налогообложения, None - текущего сеанса
+        """
+        current = self.current
+        if operator is not None:
+            if len(operator) == 0:
+                raise Exception("Имя оператора не может быть пустым")
+            current = Session(operator_inn + "&" + operator, current.tax_system)
+        if tax_system is not None:
+            current = Session(current.operator, str(tax_system.value))
+        return self.use(current)
+
+    @contextmanager
+    def use(self, session: Session):
+        """Выполнять команды потока в уже созданном сеансе (например, сеансе другого потока, см. current)"""
+        previous = getattr(self.__session, "value", None)
+        self.__session.value = session
+        try:
+            yield session
+        finally:
+            self.__session.value = previous
+
+    @property
+    def port(self) -> Transport:
+        """Канал связи с ККТ, при первом обращении открывается и проверяется связь"""
+        self.open()
+        return self.transport
+
+    def open(self):
+        """Открыть канал связи, если он еще не открыт"""
+        if not self.transport.is_open:
+            with self.lock:
+                if not self.transport.is_open:
+                    self.connect()
+
+    def connect(self):
+        """Открыть канал связи и проверить связь с кассой"""
+        with self.lock:
+            self.transport.open()
+            self.transport.write([ENQ])
+            if self.transport.read(1) != bytes([ACK]) and not self.__detect():
+                self.transport.close()
+                raise TransportError("Нет связи с кассой!")
+            self.__link += 1
+            self.__notify(None, None)
+            if self.__tune and not self.__probing:
+                from viki.tuning import tune
+                self.tuning = tune(self)
+
+    def __detect(self) -> bool:
+        """Касса не ответила: подобрать скорость порта, если скорость кассы была изменена (см. tuning.tune)"""
+        if not isinstance(self.transport, SerialTransport):
+            return False
+        from viki.tuning import detect
+        return detect(self) is not None
+
+    def close(self):
+        """Закрыть канал связи"""
+        with self.lock:
+            self.transport.close()
+
+    @contextmanager
+    def probing(self):
+        """
+        Контекст подбора параметров связи (см. tuning)
+
+        Ошибки связи текущего потока не закрывают канал, не учитываются предохранителем и не запускают восстановление
+        связи, а соединение внутри контекста не запускает подбор повторно. Восстановить параметры канала после
+        неудачной пробы должен сам подбор
+        """
+        previous = self.__probing
+        self.__recovery.probing = True
+        try:
+            yield
+        finally:
+            self.__recovery.probing = previous
+
+    def reconnect(self, timeout: float = None):
+        """
+        Восстановить связь после потери (переподключение USB-адаптера, перезагрузка кассы)
+
+        Порт переоткрывается с нарастающей паузой, пока касса не ответит, затем статус перечитывается и, если касса
+        перезагрузилась, выполняется начало работы. Остальные потоки ждут на захвате кассы и продолжают работу по
+        восстановленному каналу. Предохранитель на время восстановления не проверяется, а неудачное восстановление
+        учитывается в нем как одна ошибка связи
+        :param timeout: сколько пытаться (сек), по умолчанию - заданное в конструкторе
+        """
+        timeout = self.reconnect_timeout if timeout is None else timeout
+        deadline = monotonic() + timeout
+        delay = 0.1
+        with self.lock:
+            self.__recovery.active = True
+            try:
+                while True:
+                    self.transport.close()
+                    try:
+                        self.connect()
+                        if self.status.current.no_begin:
+                            self.begin()
+                        break
+                    except TransportError as e:
+                        if monotonic() + delay > deadline:
+                            if self.breaker is not None:
+                                self.breaker.failure(str(e))
+                            raise TransportError("Связь с кассой не восстановлена за %g сек: %s" % (timeout, e))
+                    sleep(delay)
+                    delay = min(delay * 2, 2.0)
+            finally:
+                self.__recovery.active = False
+            if self.breaker is not None:
+                self.breaker.success()
+
     def send_command(self, code) -> Input:
         """
         Отправляет команду с заданным кодом на сервер
@@ -561,17 +812,225 @@ class KKT:
         """
         return self.send(Output(code))
 
-    def send(self, packet: Output) -> Input:
-        if not self.check_link():
-            raise Exception("Нет связи!")
+    def send(self, packet: Output, freshness: float = None) -> Input:
+        """
+        Отправить команду и получить ответ
+
+        Одновременные одинаковые запросы (см. is_query) объединяются в один обмен. Если задан предохранитель и он
+        разомкнут, команда сразу завершается CircuitOpenError.
+
+        Если задано время восстановления связи, после ошибки связи выполняется reconnect и команда повторяется, если
+        это безопасно: запрос (см. is_query) или команда, которую не удалось записать в порт. Иначе касса могла
+        выполнить команду, и после восстановления связи ошибка передается вызывающему
+        :param packet: команда
+        :param freshness: окно свежести ответа на запрос (сек), по умолчанию - заданное в конструкторе
+        """
+        link = self.__link
+        self.__guard()
         data = packet.get_bytes(self.__pasword, 0x30)
-        #print(" ".join("%02X" % x for x in data))
-        self.port.write(data)
-        result = Input(self.port)
+        # STX, пароль (4), ID пакета, код команды (2), параметры, ETX, CRC (2)
+        query = is_query(packet.code, data[8:-3])
+        try:
+            result = self.__transmit(packet.code, query, data, freshness)
+        except TransportError as e:
+            if not self.__recover(link):
+                raise
+            if not query and getattr(e, "delivered", True):
+                raise
+            result = self.__transmit(packet.code, query, data, freshness)
+        if packet.code == 0x00 and self.breaker is not None and result.to_int(0):
+            self.breaker.trip("фатальное состояние ККТ")
         if result.error:
             raise Exception(result.error)
         return result
 
+    def __transmit(self, code: int, query: bool, data, freshness: float) -> Input:
+        try:
+            if query:
+                # Поток, уже захвативший кассу, не может ждать чужой запрос: тот ждет освобождения кассы
+                owner = self.lock.acquire(blocking=False)
+                try:
+                    result = self.flight.do(bytes(data), lambda: self.__exchange(data), freshness, wait=not owner)
+                finally:
+                    if owner:
+                        self.lock.release()
+            else:
+                self.flight.forget()
+                result = self.__exchange(data)
+        except TransportError:
+            self.__notify(code, None)
+            raise
+        self.__notify(code, result)
+        return result
+
+    def __recover(self, link: int) -> bool:
+        """
+        Восстановить связь после ошибки связи
+        :param link: номер соединения, на котором произошла ошибка
+        :return: связь восстановлена, False - восстановление выключено или уже выполняется этим потоком
+        """
+        if not self.reconnect_timeout or self.__recovering or self.__probing:
+            return False
+        with self.lock:
+            # Связь могла быть восстановлена другим потоком, пока этот ждал кассу
+            if link == self.__link or not self.transport.is_open:
+                self.reconnect()
+        return True
+
+    @property
+    def __recovering(self) -> bool:
+        """Текущий поток восстанавливает связь"""
+        return getattr(self.__recovery, "active", False)
+
+    @property
+    def __probing(self) -> bool:
+        """Текущий поток подбирает параметры связи (см. probing)"""
+        return getattr(self.__recovery, "probing", False)
+
+    def __notify(self, code: int, result: Input):
+        for observer in self.observers:
+            observer(code, result)
+
+    def __guard(self):
+        """Проверить предохранитель и открыть канал связи"""
+        if self.breaker is not None and not (self.__recovering or self.__probing) and self.breaker.before():
+            self.__probe()
+        link = self.__link
+        try:
+            self.open()
+        except TransportError as e:
+            self.__failure(e)
+            if not self.__recover(link):
+                raise
+
+    def __probe(self):
+        """Пробный запрос после размыкания предохранителя: ENQ и статус ККТ"""
+        try:
+            with self.lock:
+                self.open()
+                if not self.check_link():
+                    raise TransportError("Нет связи с кассой!")
+                status = self.__exchange(Output(0x00).get_bytes(self.__pasword, 0x30))
+        except Exception as e:
+            self.breaker.trip(str(e))
+            raise CircuitOpenError("Касса недоступна (%s)" % e)
+        if status.error or status.to_int(0):
+            self.breaker.trip("фатальное состояние ККТ")
+            raise CircuitOpenError("Касса недоступна (фатальное состояние ККТ)")
+
+    def __failure(self, error: Exception):
+        """Ошибка связи: закрыть канал, чтобы следующий обмен начался с чистого порта"""
+        if self.__probing:
+            return
+        self.transport.close()
+        if self.breaker is not None and not self.__recovering:
+            self.breaker.failure(str(error))
+
+    def __exchange(self, data) -> Input:
+        with self.lock:
+            #print(" ".join("%02X" % x for x in data))
+            try:
+                try:
+                    self.port.write(data)
+                except TransportError as e:
+                    e.delivered = False  # Команда не передана, повтор безопасен
+                    raise
+                result = Input(self.port)
+            except TransportError as e:
+                self.__failure(e)
+                raise
+            if self.breaker is not None:
+                self.breaker.success()
+            return result
+
+    def send_bulk(self, packets, batch: int = 32) -> Input:
+        """
+        Отправка команд пакетного режима формирования документа без ожидания ответа на каждую команду
+
+        Команды пишутся в порт пачками по batch штук. Последней командой должна быть “Завершить документ”, ответ на
+        нее и возвращается. Каждой команде присваивается свой ID пакета, по которому определяется команда, вернувшая
+        ошибку, и число ответов “Функция невыполнима при данном статусе ККТ” на последующие команды. Чтобы ID пакетов
+        команд без ответа не повторялись, каждые BULK_WINDOW команд отправляется запрос статуса и ответы читаются до
+        ответа на него. После ошибки документ аннулируется. После ошибки связи документ не повторяется: связь
+        восстанавливается (если задано время восстановления), а ошибка передается вызывающему.
+        :param packets: итератор команд
+        :param batch: количество команд в одной записи в порт
+        :return: ответ на последнюю команду
+        """
+        link = self.__link
+        self.__guard()
+        self.flight.forget()
+        with self.lock:
+            try:
+                result = self.__send_bulk(packets, batch)
+            except TransportError as e:
+                self.__failure(e)
+                self.__notify(None, None)
+                self.__recover(link)
+                raise
+            if self.breaker is not None:
+                self.breaker.success()
+            self.__notify(result.code, result)
+            return result
+
+    def __send_bulk(self, packets, batch: int) -> Input:
+        packets = iter(packets)
+        last = next(packets)
+        buffer = []
+        sent = 0
+        confirmed = 0  # Команд, отправленных до последней сверки
+        failed = None
+        for packet in packets:
+            buffer.extend(last.get_bytes(self.__pasword, BULK_ID + sent % BULK_IDS))
+            sent += 1
+            last = packet
+            if sent - confirmed >= BULK_WINDOW - 1:
+                sync = BULK_ID + sent % BULK_IDS
+                buffer.extend(STATUS.frame().get_bytes(self.__pasword, sync))
+                sent += 1
+                self.port.write(buffer)
+                buffer = []
+                failed = self.__confirm(sync)
+                confirmed = sent
+                if failed is not None:
+                    # Ответы на все отправленные команды уже прочитаны
+                    self.cancel_doc()
+                    raise Exception(failed.error)
+            elif sent % batch == 0:
+                self.port.write(buffer)
+                buffer = []
+                if self.port.in_waiting:
+                    # Ответ в пакетном режиме приходит только на ошибку
+                    failed = Input(self.port)
+                    break
+        else:
+            buffer.extend(last.get_bytes(self.__pasword, BULK_ID + sent % BULK_IDS))
+            self.port.write(buffer)
+            result = Input(self.port)
+            if not result.error:
+                return result
+            failed = result
+        # На команду “Завершить документ” после ошибки ответ не возвращается, на остальные - возвращается ошибка
+        index = (failed.id - BULK_ID) % BULK_IDS
+        if index != sent % BULK_IDS:
+            for _ in range((sent - 1 - index) % BULK_IDS):
+                Input(self.port)
+        self.cancel_doc()
+        raise Exception(failed.error)
+
+    def __confirm(self, sync: int) -> Input:
+        """
+        Прочитать ответы до ответа на запрос статуса с ID пакета sync
+        :return: первая ошибка команды пакетного режима или None
+        """
+        failed = None
+        while True:
+            reply = Input(self.port)
+            if reply.id == sync:
+                return failed
+            if failed is None:
+                failed = reply
+
     def scout_paper(self):
         """
         Промотка бумаги
@@ -584,8 +1043,9 @@ class KKT:
         Если в момент проверки связи ККТ передает данные в ответ на другую команду, то ответ может быть получен только
         после завершения этой передачи
         """
-        self.port.write([0x05])
-        return ord(self.port.read(1)) == 6
+        with self.lock:
+            self.port.write([ENQ])
+            return self.port.read(1) == bytes([ACK])
 
     def cancel(self):
         """
@@ -597,8 +1057,14 @@ class KKT:
     @property
     def status(self) -> KKTStatus:
         """Команда возвращает статус фатального состояния ККТ, статус текущих флагов ККТ и статус документа"""
-        packet = self.send(Output(0x00))
-        return KKTStatus(packet.to_int(0), packet.to_int(1), packet.to_int(2))
+        return KKTStatus(*STATUS(self))
+
+    @property
+    def state(self) -> KKTStatus:
+        """Статус ККТ из теневого состояния, если оно подключено, иначе - запрос статуса"""
+        if self.shadow is not None:
+            return self.shadow.status
+        return self.status
 
     @property
     def register(self) -> Register:
@@ -618,7 +1084,7 @@ class KKT:
     @property
     def printer(self) -> PrinterStatus:
         """Эта команда позволяет получать состояние печатающего устройства"""
-        return PrinterStatus(self.send_command(0x04).to_int(0))
+        return PrinterStatus(PRINTER_STATUS(self))
 
     @property
     def service(self) -> ServiceData:
@@ -630,13 +1096,13 @@ class KKT:
         """Эта команда позволяет получать данные по ошибкам ФН и ККТ."""
         return ExtendErrorData(self)
 
-    def begin(self, host_datetime=datetime.now()):
+    def begin(self, host_datetime: datetime = None):
         """
         Начало работы с кассой
-        :param host_datetime: Время управляющего компьютера
+        :param host_datetime: Время управляющего компьютера (по умолчанию - текущее)
         """
         query = Output(0x10)
-        query.add_param(host_datetime)
+        query.add_param(host_datetime or datetime.now())
         self.send(query)
 
     @property
@@ -656,7 +1122,21 @@ class KKT:
         str_time = value.strftime("%H%M%S")
         self.send(Output(0x14).add_param(str_date).add_param(str_time))
 
-    # TODO 15 и 16 Работа с логотипом, в последную очередь)
+    def load_logo(self, data: bytes, chunk: int = LOGO_CHUNK):
+        """
+        Загрузить логотип
+
+        Логотип передается частями по chunk байт в HEX, в каждом кадре - полный размер и смещение части
+        :param data: монохромный BMP (см. logo.compile_logo)
+        :param chunk: байт логотипа в одном кадре
+        """
+        with self.lock:
+            for offset in range(0, len(data), chunk):
+                LOAD_LOGO(self, len(data), offset, data[offset:offset + chunk])
+
+    def delete_logo(self):
+        """Удалить логотип"""
+        DELETE_LOGO(self)
 
     def report_x(self):
         """Сформировать отчет без гашения (X-отчет)"""
@@ -671,7 +1151,20 @@ class KKT:
         """Открыть смену"""
         self.send(Output(0x23).add_param(self.operator))
 
-    # TODO 24 Установить дополнительные реквизиты позиции
+    def item_requisites(self, code: bytes = None, requisite: str = None, unit: str = None, country: str = None,
+                        customs: str = None, excise: float = None):
+        """
+        Установить дополнительные реквизиты позиции
+
+        Реквизиты относятся к следующей команде "Добавить товарную позицию"
+        :param code: код товара (тег 1162)
+        :param requisite: дополнительный реквизит предмета расчета (тег 1191)
+        :param unit: единица измерения предмета расчета (тег 1197)
+        :param country: код страны происхождения товара
+        :param customs: номер таможенной декларации
+        :param excise: сумма акциза
+        """
+        ITEM_REQUISITES(self, code, requisite, unit, country, customs, excise)
 
     def open_doc(self,
                  doc_type: DocumentType,
@@ -709,18 +1202,14 @@ class KKT:
         """
         param = doc_type.value
         if mode_bulk:
-            param = param & 1 << 4
+            param = param | 1 << 4
         if mode_delay:
-            param = param & 1 << 5
-        query = Output(0x30)
-        query.add_param(str(param))
-        query.add_param(str(departament))
-        query.add_param(self.operator)
-        if number == 0 and self.settings.cheque.external_counter:
+            param = param | 1 << 5
+        external_counter = self.shadow.external_counter if self.shadow is not None \
+            else self.settings.cheque.external_counter
+        if number == 0 and external_counter:
             raise Exception("Настроена внешняя нумерация чеков, необходимо передавать номер документа!")
-        query.add_param(str(number))
-        query.add_param(self.tax_system)
-        self.send(query)
+        OPEN_DOC(self, param, departament, self.operator, number, self.tax_system)
 
     def close_doc(self, cut: CutFlag, sign_internet_payment: bool = None, address: str = None, title: str = None,
                   value: str = None, buyer: str = None, buyer_inn: str = None) -> CloseDocData:
@@ -741,23 +1230,28 @@ class KKT:
         :param buyer_inn: ИНН покупателя
         :return:
         """
-        query = Output(0x31)
-        query.add_param(cut)
-        if address:
-            query.add_param(address)
-        if sign_internet_payment:
-            query.add_param(sign_internet_payment)
-        if title:
-            query.add_param(title)
-        if value:
-            query.add_param(value)
-        if buyer:
-            query.add_param(buyer)
-        if buyer_inn:
-            query.add_param(buyer_inn)
-        packet = self.send(query)
+        packet = CLOSE_DOC(self, cut, address or None, sign_internet_payment or None, title or None, value or None,
+                           buyer or None, buyer_inn or None)
         return CloseDocData(packet)
 
+    def send_document(self, frames, bulk: bool = True) -> Input:
+        """
+        Отправить заранее закодированный документ (см. helpers.Cheque.compile)
+
+        Касса захватывается только на время обмена, кадры не кодируются повторно, поэтому один и тот же документ можно
+        отправить еще раз
+        :param frames: кадры schema.Frame, первый - “Открыть документ”, последний - “Завершить документ”
+        :param bulk: документ открывается в пакетном режиме, команды после открытия отправляются через send_bulk
+        :return: ответ на “Завершить документ”
+        """
+        with self.lock:
+            self.send(frames[0])
+            if bulk:
+                return self.send_bulk(frames[1:])
+            for frame in frames[1:-1]:
+                self.send(frame)
+            return self.send(frames[-1])
+
     def cancel_doc(self):
         """
         Эта команда прерывает формирование текущего документа, данные удаляются из оперативной памяти ККТ и
@@ -775,9 +1269,9 @@ class KKT:
         печать информации по отложенным за смену чекам. При этом, если команда "Отложить чек" выполняется без параметра
         (пустая строка), то такие чеки учитываются в отчете о закрытии, если с параметром – не учитываются.
         :param cause: Причина отказа от чека (Длина 40 символов)
+        :raises ChequeError: причина длиннее 40 символов или не кодируется для кассы
         """
-        if len(cause) > 40:
-            raise Exception("Неверная длина причины отказа")
+        check_cause(cause)
         self.send(Output(0x33).add_param(cause))
 
     def cut_doc(self):
@@ -792,7 +1286,7 @@ class KKT:
         :param text: Текст
         :param font: Атрибуты текста
         """
-        self.send(Output(0x40).add_param(text).add_param(str(font)))
+        PRINT_TEXT(self, text, str(font))
 
     def print_barcode(self, out: BarcodeOut, width, height, view: BarcodeView, text):
         """
@@ -805,10 +1299,9 @@ class KKT:
         :param view: Тип штрих-кода - Определяет, какой штрих-код будет напечатан
         :param text: Штрих-код- строка содержащая штрих-код
         """
-        if self.status.current.no_begin:
+        if self.state.current.no_begin:
             raise Exception("Вызовите начало работы!")
-        self.send(Output(0x41).add_param(out.value).add_param(str(width)).add_param(str(height)).add_param(
-            view.value).add_param(text))
+        PRINT_BARCODE(self, out, width, height, view, text)
 
     def add_item(self, title: str, article: str, count: float, price: float, number_tax: int,
                  payment_type: PaymentType, subject_matter: SubjectMatter,
@@ -850,26 +1343,10 @@ class KKT:
         :param excise_total: сумма акциза
         :return:
         """
-        query = Output(0x42)
-        query.add_param(title)
-        query.add_param(article)
-        query.add_param("%0.3f" % count)
-        query.add_param("%0.3f" % price)
-        query.add_param(str(number_tax))
-        query.add_param(number_item)
-        query.add_param(str(number_departament))
-        query.add_param("").add_param("")
-        query.add_param("%0.3f" % discount_total)
-        query.add_param(str(payment_type.value))
-        query.add_param(str(subject_matter.value))
-        # Насколько я понял нужны только для расчетов ЮР лиц
-        if code_country:
-            query.add_param(code_country)
-        if number_customs:
-            query.add_param(number_customs)
-        if excise_total:
-            query.add_param(excise_total)
-        self.send(query)
+        # Насколько я понял страна, декларация и акциз нужны только для расчетов ЮР лиц
+        ADD_ITEM(self, title, article, count, price, number_tax, number_item, number_departament, "", "",
+                 discount_total, payment_type, subject_matter, code_country or None, number_customs or None,
+                 excise_total or None)
 
     def doc_subtotal(self):
         """
@@ -879,9 +1356,18 @@ class KKT:
         дополнительные реквизиты, прервать оформление чека командами «Отложить чек» и «Аннулировать чек»,
         либо продолжить оформление документа, выполнив команду «Оплата» и команду «Завершить документ».
         """
-        self.send_command(0x44)
+        SUBTOTAL(self)
+
+    def doc_discount(self, percent: bool, title: str, value: float):
+        """
+        Скидка на чек
 
-    # TODO Скидка на чек (0x45)
+        Подается после команды "Подытог", скидка распределяется по позициям чека
+        :param percent: скидка в процентах, иначе - суммой
+        :param title: название скидки
+        :param value: процент или сумма скидки
+        """
+        DISCOUNT(self, 0 if percent else 1, title, value)
 
     def doc_payment(self, code_payment: int, total: float, text: str = ""):
         """
@@ -899,9 +1385,17 @@ class KKT:
         """
         if code_payment < 0 or code_payment > 15:
             raise Exception("Неверный код типа платежа!")
-        self.send(Output(0x47).add_param(str(code_payment)).add_param("%0.3f" % total).add_param(text))
+        PAYMENT(self, code_payment, total, text)
 
-    # TODO Внесение / изъятие суммы (0x48)
+    def cash_in_out(self, total: float, text: str = ""):
+        """
+        Внесение / изъятие суммы
+
+        Подается в открытом документе "Внесение в кассу" или "Инкассация", направление определяется типом документа
+        :param total: сумма
+        :param text: дополнительный текст
+        """
+        CASH_IN_OUT(self, text, total)
 
     @property
     def exchange_fn(self):
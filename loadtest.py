@@ -0,0 +1,166 @@
+import argparse
+import json
+import random
+import sys
+from dataclasses import dataclass, asdict
+from threading import Lock, Thread, local
+from time import perf_counter
+
+from viki.data import DocumentType, PaymentType, SubjectMatter, TaxSystem
+from viki.emulator import Emulator
+from viki.helpers import KKTHelper, Cheque, Item, ItemTax
+from viki.transport import Transport, TransportWrapper, make_transport
+
+
+class CountingTransport(TransportWrapper):
+    """Транспорт, считающий обмены (записи в порт) отдельно для каждого потока"""
+
+    def __init__(self, transport: Transport):
+        super().__init__(transport)
+        self.__local = local()
+
+    @property
+    def count(self) -> int:
+        """Количество обменов текущего потока"""
+        return getattr(self.__local, "count", 0)
+
+    def on_write(self, data):
+        self.__local.count = self.count + 1
+
+
+@dataclass
+class Mix:
+    """Состав генерируемых чеков"""
+    items: tuple = (1, 1, 2, 2, 3, 4, 5, 8, 12, 20)  # Распределение количества позиций (выбирается равновероятно)
+    weighted: float = 0.2  # Доля весовых позиций
+    cashless: float = 0.5  # Доля безналичных чеков
+    returns: float = 0.03  # Доля чеков возврата
+
+    def cheque(self, rnd: random.Random) -> Cheque:
+        """Сгенерировать чек"""
+        document_type = DocumentType.SALE_RETURN if rnd.random() < self.returns else DocumentType.SALE
+        cheque = Cheque(document_type)
+        for number in range(rnd.choice(self.items)):
+            count = round(rnd.uniform(0.1, 2.5), 3) if rnd.random() < self.weighted else rnd.randint(1, 3)
+            price = rnd.randint(100, 500000) / 100
+            tax = rnd.choice((ItemTax.TAX_20, ItemTax.TAX_10, ItemTax.TAX_0))
+            cheque.items.append(Item("Товар %i" % number, count, price, tax, PaymentType.FULL_SETTLEMENT,
+                                     SubjectMatter.DEFAULT))
+        if rnd.random() < self.cashless:
+            cheque.pay(1, cheque.total)
+        return cheque
+
+
+@dataclass
+class Report:
+    """Результат нагрузочного теста"""
+    lanes: int  # Количество касс-линий
+    registers: int  # Количество касс
+    cheques: int  # Напечатано чеков
+    errors: int  # Чеков с ошибкой
+    elapsed: float  # Длительность (сек)
+    per_minute: float  # Чеков в минуту
+    p50: float  # Задержка чека (сек), перцентили
+    p95: float
+    p99: float
+    round_trips: float  # Среднее количество обменов на чек
+
+
+def percentile(values: [float], p: float) -> float:
+    """Перцентиль p (0..100) методом ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class LoadTest:
+    """
+    Нагрузочный тест
+
+    N касс-линий параллельно печатают сгенерированные чеки через KKTHelper на одной или нескольких кассах (реальных
+    или эмулированных). Для каждого чека замеряется время от начала печати до получения CloseDocData и количество
+    обменов с кассой.
+    """
+
+    def __init__(self, helpers: [KKTHelper], lanes: int = 4, cheques: int = 100, mix: Mix = None, seed: int = 0,
+                 print_cheque=None):
+        """
+        :param helpers: кассы, KKT которых работают через CountingTransport
+        :param lanes: количество касс-линий, линии распределяются по кассам по кругу
+        :param cheques: чеков на линию
+        :param mix: состав чеков
+        :param seed: зерно генератора чеков
+        :param print_cheque: функция печати чека (helper, cheque), по умолчанию - KKTHelper.print_cheque
+        """
+        self.helpers = helpers
+        self.lanes = lanes
+        self.cheques = cheques
+        self.mix = mix or Mix()
+        self.seed = seed
+        self.print_cheque = print_cheque or (lambda helper, cheque: helper.print_cheque(cheque))
+        self.latencies = []
+        self.round_trips = []
+        self.errors = 0
+        self.__lock = Lock()
+
+    def run(self) -> Report:
+        """Выполнить тест"""
+        threads = [Thread(target=self.__lane, args=(lane,), name="viki-lane-%i" % lane) for lane in range(self.lanes)]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - start
+        done = len(self.latencies)
+        return Report(self.lanes, len(self.helpers), done, self.errors, elapsed,
+                      done / elapsed * 60 if elapsed else 0.0,
+                      percentile(self.latencies, 50), percentile(self.latencies, 95), percentile(self.latencies, 99),
+                      sum(self.round_trips) / done if done else 0.0)
+
+    def __lane(self, lane: int):
+        rnd = random.Random(self.seed * 1000003 + lane)
+        helper = self.helpers[lane % len(self.helpers)]
+        transport: CountingTransport = helper.kkt.transport
+        for _ in range(self.cheques):
+            cheque = self.mix.cheque(rnd)
+            before = transport.count
+            start = perf_counter()
+            try:
+                self.print_cheque(helper, cheque)
+            except Exception:
+                with self.__lock:
+                    self.errors += 1
+                continue
+            with self.__lock:
+                self.latencies.append(perf_counter() - start)
+                self.round_trips.append(transport.count - before)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="python -m viki.loadtest", description="Нагрузочный тест печати чеков")
+    parser.add_argument("ports", nargs="*", help="порты касс; без портов используются эмуляторы")
+    parser.add_argument("--emulators", type=int, default=1, help="количество эмуляторов, если порты не заданы")
+    parser.add_argument("--latency", type=float, default=0.0, help="время выполнения команды эмулятором (сек)")
+    parser.add_argument("--lanes", type=int, default=4)
+    parser.add_argument("--cheques", type=int, default=100, help="чеков на линию")
+    parser.add_argument("--returns", type=float, default=0.03, help="доля чеков возврата")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--operator", default="Кассир")
+    parser.add_argument("--inn", default="")
+    options = parser.parse_args(args)
+    if options.ports:
+        transports = [make_transport(port) for port in options.ports]
+    else:
+        transports = [Emulator("%010i" % (number + 1), latency=options.latency) for number in range(options.emulators)]
+    helpers = [KKTHelper(CountingTransport(transport), options.inn, options.operator, TaxSystem.OVERALL)
+               for transport in transports]
+    test = LoadTest(helpers, options.lanes, options.cheques, Mix(returns=options.returns), options.seed)
+    print(json.dumps(asdict(test.run()), ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
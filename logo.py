@@ -0,0 +1,197 @@
+import hashlib
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import Lock
+
+from viki.kkt import KKT
+from viki.schema import LOGO_CHUNK
+
+MAX_WIDTH = 576  # Максимальная ширина логотипа (точек)
+MAX_HEIGHT = 126  # Максимальная высота логотипа (точек)
+
+# Матрица упорядоченного сглаживания (Байера) 8x8
+BAYER = (
+    (0, 32, 8, 40, 2, 34, 10, 42),
+    (48, 16, 56, 24, 50, 18, 58, 26),
+    (12, 44, 4, 36, 14, 46, 6, 38),
+    (60, 28, 52, 20, 62, 30, 54, 22),
+    (3, 35, 11, 43, 1, 33, 9, 41),
+    (51, 19, 59, 27, 49, 17, 57, 25),
+    (15, 47, 7, 39, 13, 45, 5, 37),
+    (63, 31, 55, 23, 61, 29, 53, 21),
+)
+
+
+@dataclass(frozen=True)
+class Logo:
+    """Логотип, подготовленный для загрузки в кассу"""
+    width: int  # Ширина (точек)
+    height: int  # Высота (точек)
+    data: bytes  # Монохромный BMP
+    digest: str  # Хэш исходного изображения и параметров преобразования
+
+
+def grayscale(image):
+    """
+    Изображение в виде массива яркостей uint8 (высота x ширина)
+    :param image: путь к файлу, PIL.Image или массив NumPy (оттенки серого, RGB или RGBA)
+    """
+    import numpy
+    if isinstance(image, (str, os.PathLike)):
+        from PIL import Image
+        with Image.open(image) as source:
+            return numpy.asarray(source.convert("L"))
+    if not isinstance(image, numpy.ndarray):
+        return numpy.asarray(image.convert("L"))
+    if image.ndim == 2:
+        return image.astype(numpy.uint8, copy=False)
+    rgb = image[..., :3].astype(numpy.float32)
+    if image.shape[2] == 4:
+        # Прозрачные точки считаются белыми
+        alpha = image[..., 3:4].astype(numpy.float32) / 255
+        rgb = rgb * alpha + 255 * (1 - alpha)
+    return (rgb @ numpy.array((0.299, 0.587, 0.114), numpy.float32)).round().astype(numpy.uint8)
+
+
+def scale(gray, width: int, height: int):
+    """Вписать изображение в width x height с сохранением пропорций (усреднение по площади)"""
+    import numpy
+    source_height, source_width = gray.shape
+    ratio = min(width / source_width, height / source_height, 1.0)
+    target_width = max(1, round(source_width * ratio))
+    target_height = max(1, round(source_height * ratio))
+    if (target_width, target_height) == (source_width, source_height):
+        return gray
+    # Каждая точка результата - среднее по прямоугольнику исходных точек, суммы считаются по интегральному изображению
+    integral = numpy.zeros((source_height + 1, source_width + 1), numpy.float64)
+    integral[1:, 1:] = gray.cumsum(0).cumsum(1)
+    rows = numpy.linspace(0, source_height, target_height + 1).round().astype(numpy.intp)
+    columns = numpy.linspace(0, source_width, target_width + 1).round().astype(numpy.intp)
+    top, bottom = rows[:-1, None], numpy.maximum(rows[1:], rows[:-1] + 1)[:, None]
+    left, right = columns[None, :-1], numpy.maximum(columns[1:], columns[:-1] + 1)[None, :]
+    total = integral[bottom, right] - integral[top, right] - integral[bottom, left] + integral[top, left]
+    return (total / ((bottom - top) * (right - left))).round().astype(numpy.uint8)
+
+
+def dither(gray):
+    """Упорядоченное сглаживание: True - черная точка"""
+    import numpy
+    height, width = gray.shape
+    threshold = (numpy.array(BAYER, numpy.float32) + 0.5) * (255 / 64)
+    tiled = numpy.tile(threshold, (height // 8 + 1, width // 8 + 1))[:height, :width]
+    return gray < tiled
+
+
+def bmp(bits) -> bytes:
+    """Монохромный BMP из массива точек (True - черная)"""
+    import numpy
+    height, width = bits.shape
+    stride = (width + 31) // 32 * 4
+    # Бит 1 - цвет палитры 1 (белый), строки хранятся снизу вверх и выравниваются до 4 байт
+    rows = numpy.packbits(~bits[::-1], axis=1)
+    pixels = numpy.zeros((height, stride), numpy.uint8)
+    pixels[:, :rows.shape[1]] = rows
+    palette = bytes((0, 0, 0, 0, 255, 255, 255, 0))
+    offset = 14 + 40 + len(palette)
+    header = struct.pack("<2sIHHI", b"BM", offset + pixels.size, 0, 0, offset)
+    info = struct.pack("<IiiHHIIiiII", 40, width, height, 1, 1, 0, pixels.size, 2835, 2835, 2, 2)
+    return header + info + palette + pixels.tobytes()
+
+
+class LogoCache:
+    """
+    Кэш подготовленных логотипов по хэшу исходного изображения
+
+    Хранится в памяти и, если задан каталог, в файлах <хэш>.bmp, поэтому при раскатке на парк касс изображение
+    преобразуется один раз
+    """
+
+    def __init__(self, path: str = None):
+        """
+        :param path: каталог для хранения подготовленных логотипов
+        """
+        self.path = path
+        self.__logos = {}
+        self.__lock = Lock()
+
+    def get(self, digest: str) -> bytes:
+        with self.__lock:
+            result = self.__logos.get(digest)
+        if result is None and self.path is not None:
+            try:
+                with open(os.path.join(self.path, digest + ".bmp"), "rb") as file:
+                    result = file.read()
+            except FileNotFoundError:
+                return None
+            with self.__lock:
+                self.__logos[digest] = result
+        return result
+
+    def put(self, digest: str, data: bytes):
+        with self.__lock:
+            self.__logos[digest] = data
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            name = os.path.join(self.path, digest + ".bmp")
+            with open(name + ".tmp", "wb") as file:
+                file.write(data)
+            os.replace(name + ".tmp", name)
+
+
+CACHE = LogoCache()
+
+
+def compile_logo(image, width: int = MAX_WIDTH, height: int = MAX_HEIGHT, cache: LogoCache = CACHE) -> Logo:
+    """
+    Подготовить логотип: оттенки серого, вписывание в размер и упорядоченное сглаживание
+
+    Требует NumPy (и Pillow для файлов и PIL.Image)
+    :param image: путь к файлу, PIL.Image или массив NumPy
+    :param width: максимальная ширина (точек)
+    :param height: максимальная высота (точек)
+    :param cache: кэш подготовленных логотипов, None - без кэша
+    """
+    gray = grayscale(image)
+    digest = hashlib.sha256(b"%i:%i:%i:%i:" % (width, height, *gray.shape) + gray.tobytes()).hexdigest()
+    data = cache.get(digest) if cache is not None else None
+    if data is None:
+        data = bmp(dither(scale(gray, width, height)))
+        if cache is not None:
+            cache.put(digest, data)
+    logo_width, logo_height = struct.unpack_from("<ii", data, 18)
+    return Logo(logo_width, logo_height, data, digest)
+
+
+def upload(kkt: KKT, logo: Logo, enable: bool = True, chunk: int = LOGO_CHUNK):
+    """
+    Загрузить логотип в кассу
+    :param kkt: касса
+    :param logo: подготовленный логотип
+    :param enable: включить печать логотипа в настройках ПУ
+    :param chunk: байт логотипа в одном кадре
+    """
+    with kkt.lock:
+        kkt.load_logo(logo.data, chunk)
+        if enable:
+            printer = kkt.settings.printer
+            if not printer.print_logo:
+                printer.print_logo = True
+                kkt.settings.printer = printer
+
+
+def rollout(kkts: [KKT], logo: Logo, jobs: int = 16, enable: bool = True) -> dict:
+    """
+    Загрузить один подготовленный логотип в несколько касс параллельно
+    :return: касса -> None или исключение
+    """
+    def push(kkt: KKT):
+        try:
+            upload(kkt, logo, enable)
+        except Exception as e:
+            return e
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        return dict(zip(kkts, executor.map(push, kkts)))
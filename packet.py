@@ -1,11 +1,13 @@
 import enum
 from abc import abstractclassmethod
 from datetime import datetime, date
-from serial import Serial
+from viki.transport import Transport, TransportError
 
 
 SXT = 0x02
 EXT = 0x03
+ENQ = 0x05  # Проверка связи
+ACK = 0x06  # Касса на связи
 DELIM = 0x1C
 
 
@@ -76,8 +78,8 @@ class Output:
 
 class Input:
 
-    def __init__(self, port: Serial):
-        self.__port: Serial = port
+    def __init__(self, port: Transport):
+        self.__port: Transport = port
         self.__buffer = []
 
         if ord(self.__read(1)) != SXT:
@@ -136,6 +138,8 @@ class Input:
 
     def __read(self, size: int):
         result = self.__port.read(size)
+        if len(result) < size:
+            raise TransportError("Нет ответа от кассы")
         self.__buffer.extend(result)
         return result
 
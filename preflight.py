@@ -0,0 +1,146 @@
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+
+from viki.data import DocumentType, ExtendErrorCode, PaymentType, SubjectMatter
+
+TITLE_LENGTH = 224  # Максимальная длина названия товара
+CAUSE_LENGTH = 40  # Максимальная длина причины отказа от чека
+COUNT_PLACES = 3  # Знаков после запятой в количестве (add_item передает "%0.3f")
+PRICE_PLACES = 2  # Знаков после запятой в цене (копейки)
+TAX_NUMBERS = range(0, 6)  # Номера ставок налога в регистрах кассы
+PAYMENT_CODES = range(0, 16)  # Коды типов платежа
+CASH = 0  # Код типа платежа "наличные"
+
+KOPECK = Decimal("0.01")
+
+
+class ChequeError(Exception):
+    """Чек не пройдет на кассе"""
+
+    def __init__(self, code: ExtendErrorCode, message: str, index: int = None):
+        """
+        :param code: код ошибки, который вернула бы касса
+        :param message: описание
+        :param index: номер позиции в чеке
+        """
+        if index is not None:
+            message = "Позиция %i: %s" % (index + 1, message)
+        super().__init__(message)
+        self.code = code
+        self.index = index
+
+
+@dataclass
+class Totals:
+    """Суммы чека так, как их посчитает касса"""
+    items: [Decimal]  # Суммы позиций
+    total: Decimal  # Итог чека
+    paid: Decimal  # Принято от покупателя
+    change: Decimal  # Сдача
+
+
+def encodable(text: str) -> bool:
+    """Текст кодируется в CP866"""
+    try:
+        text.encode("CP866")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def places(value) -> int:
+    """Количество знаков после запятой"""
+    exponent = Decimal(str(value)).normalize().as_tuple().exponent
+    return max(0, -exponent)
+
+
+def item_total(count, price) -> Decimal:
+    """
+    Сумма позиции
+
+    Цена умножается на количество и округляется до копейки: менее 0.5 коп отбрасывается, 0.5 коп и более
+    округляется до 1 коп
+    """
+    return (Decimal(str(count)) * Decimal(str(price))).quantize(KOPECK, rounding=ROUND_HALF_UP)
+
+
+def check_item(index: int, title: str, count, price, tax: int, payment: PaymentType, subject: SubjectMatter,
+               article: str = "") -> Decimal:
+    """
+    Проверить товарную позицию по правилам add_item
+    :return: сумма позиции
+    """
+    if len(title) > TITLE_LENGTH:
+        raise ChequeError(ExtendErrorCode.WRONG_ITEM_TITLE, "название длиннее %i символов" % TITLE_LENGTH, index)
+    if not encodable(title):
+        raise ChequeError(ExtendErrorCode.WRONG_ITEM_TITLE, "название не кодируется в CP866", index)
+    if not encodable(article):
+        raise ChequeError(ExtendErrorCode.WRONG_ITEM_ARTICLE, "артикул не кодируется в CP866", index)
+    if count <= 0 or places(count) > COUNT_PLACES:
+        raise ChequeError(ExtendErrorCode.WRONG_ITEM_COUNT, "неверное количество %s" % count, index)
+    if price < 0 or places(price) > PRICE_PLACES:
+        raise ChequeError(ExtendErrorCode.WRONG_ITEM_PRICE, "неверная цена %s" % price, index)
+    if tax not in TAX_NUMBERS:
+        raise ChequeError(ExtendErrorCode.WRONG_TAX_NUMBER, "неверный номер ставки налога %s" % tax, index)
+    if not isinstance(payment, PaymentType):
+        raise ChequeError(ExtendErrorCode.WRONG_SIGN_PAID_METHOD, "неверный признак способа расчета", index)
+    if not isinstance(subject, SubjectMatter):
+        raise ChequeError(ExtendErrorCode.WRONG_SIGN_PAID_SUBJECT, "неверный признак предмета расчета", index)
+    return item_total(count, price)
+
+
+def check_payment(code: int, total, text: str = ""):
+    """Проверить оплату по правилам doc_payment"""
+    if code not in PAYMENT_CODES:
+        raise ChequeError(ExtendErrorCode.WRONG_TYPE_PAID, "неверный код типа платежа %s" % code)
+    if total <= 0 or places(total) > PRICE_PLACES:
+        raise ChequeError(ExtendErrorCode.WRONG_TOTAL_PAID, "неверная сумма платежа %s" % total)
+    if not encodable(text):
+        raise ChequeError(ExtendErrorCode.WRONG_TEXT, "дополнительный текст не кодируется в CP866")
+
+
+def check_cause(cause: str):
+    """Проверить причину отказа от чека по правилам postpone_doc"""
+    if len(cause) > CAUSE_LENGTH or not encodable(cause):
+        raise ChequeError(ExtendErrorCode.WRONG_TEXT, "неверная причина отказа от чека")
+
+
+def validate(cheque, payments: [(int, float)] = None) -> Totals:
+    """
+    Проверить чек без обращения к кассе и посчитать его суммы
+
+    :param cheque: helpers.Cheque
+    :param payments: оплаты (код типа платежа, сумма), по умолчанию - весь итог наличными
+    :return: суммы чека
+    """
+    if cheque.type in (DocumentType.SERVICE, DocumentType.INTRODUCTION, DocumentType.COLLECTION):
+        raise ChequeError(ExtendErrorCode.DOC_NO_COMING, "документ не является чеком")
+    if not cheque.items:
+        raise ChequeError(ExtendErrorCode.DOC_ZERO_TOTAL, "в чеке нет позиций")
+    items = []
+    credit = 0
+    for index, item in enumerate(cheque.items):
+        items.append(check_item(index, item.title, item.count, item.price, item.tax, item.payment, item.subject))
+        if item.payment == PaymentType.LOAN_PAYMENT:
+            credit += 1
+            if credit > 1:
+                raise ChequeError(ExtendErrorCode.DOC_OVER_ONE_CREDIT, "больше одной позиции \"Оплата кредита\"",
+                                  index)
+    total = sum(items, Decimal(0))
+    if total == 0:
+        raise ChequeError(ExtendErrorCode.DOC_ZERO_TOTAL, "нулевой итог чека")
+    if payments is None:
+        payments = [(CASH, total)]
+    cash = Decimal(0)
+    cashless = Decimal(0)
+    for code, amount in payments:
+        check_payment(code, amount)
+        if code == CASH:
+            cash += Decimal(str(amount))
+        else:
+            cashless += Decimal(str(amount))
+    if cashless > total:
+        raise ChequeError(ExtendErrorCode.WRONG_TOTAL_PAID, "безналичная оплата больше итога чека")
+    if cash + cashless < total:
+        raise ChequeError(ExtendErrorCode.WRONG_TOTAL_PAID, "оплата меньше итога чека")
+    return Totals(items, total, cash + cashless, cash + cashless - total)
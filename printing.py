@@ -0,0 +1,79 @@
+import textwrap
+from dataclasses import dataclass
+
+from viki.data import BarcodeOut, BarcodeView, CutFlag, DocumentType, FontAttribute
+from viki.kkt import KKT
+from viki.schema import PRINT_TEXT, PRINT_BARCODE, CLOSE_DOC
+
+
+@dataclass
+class Barcode:
+    """Штрих-код в сервисном документе"""
+    text: str
+    view: BarcodeView = BarcodeView.CODE_128
+    out: BarcodeOut = BarcodeOut.NO
+    width: int = 2  # Ширина (2..8 точек)
+    height: int = 60  # Высота (1..255 точек)
+
+
+@dataclass
+class QRCode:
+    """QR-код в сервисном документе"""
+    text: str
+    size: int = 5  # Размер модуля (2..8 точек)
+
+
+class ServicePrinter:
+    """
+    Потоковая печать сервисного документа
+
+    Строки текста, штрих-коды и QR-коды заранее переносятся по ширине ленты, кодируются и отправляются в одном
+    сервисном документе в пакетном режиме, без ожидания ответа на каждую строку. Документ завершается одной командой
+    “Завершить документ”.
+    """
+
+    def __init__(self, kkt: KKT, width: int = 42, font: FontAttribute = None, batch: int = 32):
+        """
+        :param kkt: касса
+        :param width: ширина строки в символах для выбранного шрифта
+        :param font: атрибуты текста
+        :param batch: количество команд в одной записи в порт
+        """
+        self.kkt = kkt
+        self.width = width
+        self.font = str(font if font is not None else FontAttribute(0))
+        self.batch = batch
+
+    def wrap(self, text: str):
+        """Разбить текст на строки по ширине ленты"""
+        for line in text.splitlines() or [""]:
+            yield from textwrap.wrap(line, self.width) or [""]
+
+    def packets(self, lines):
+        """
+        Команды печати для последовательности строк, штрих-кодов и QR-кодов
+        :param lines: итератор из str, Barcode, QRCode
+        """
+        for line in lines:
+            if isinstance(line, Barcode):
+                yield PRINT_BARCODE.frame(line.out, line.width, line.height, line.view, line.text)
+            elif isinstance(line, QRCode):
+                yield PRINT_BARCODE.frame(BarcodeOut.NO, line.size, line.size, BarcodeView.QR, line.text)
+            else:
+                for text in self.wrap(line):
+                    yield PRINT_TEXT.frame(text, self.font)
+
+    def print(self, lines, cut: CutFlag = CutFlag.DEFAULT):
+        """
+        Напечатать сервисный документ
+        :param lines: итератор из str, Barcode, QRCode
+        :param cut: флаг отрезки документа
+        """
+        self.kkt.open_doc(DocumentType.SERVICE, mode_bulk=True)
+        packets = self.packets(lines)
+        self.kkt.send_bulk(self.__close(packets, cut), self.batch)
+
+    @staticmethod
+    def __close(packets, cut: CutFlag):
+        yield from packets
+        yield CLOSE_DOC.frame(cut)
@@ -0,0 +1,207 @@
+import argparse
+import json
+import sys
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from threading import Lock, local
+
+from viki.data import TaxSystem, DocumentType, PaymentType, SubjectMatter
+from viki.emulator import Emulator
+from viki.kkt import KKT, QUERY_CODES, is_query
+from viki.packet import SXT, EXT, ENQ, DELIM
+from viki.transport import Transport, TransportWrapper
+
+
+class BudgetExceeded(AssertionError):
+    """Операция превысила бюджет обменов или повторила запрос"""
+
+
+@dataclass(frozen=True)
+class Command:
+    """Команда, записанная в порт"""
+    code: int  # Код команды, None - проверка связи (ENQ)
+    params: bytes = b""  # Параметры с разделителями
+
+    @property
+    def query(self) -> bool:
+        """Запрос, не меняющий состояние ККТ"""
+        return self.code is None or is_query(self.code, self.params)
+
+    def __str__(self):
+        if self.code is None:
+            return "ENQ"
+        head = self.params.split(bytes([DELIM]), 1)[0]
+        if self.code in QUERY_CODES and head:
+            return "%02X(%s)" % (self.code, head.decode("cp866", "replace"))
+        return "%02X" % self.code
+
+
+@dataclass
+class Operation:
+    """Команды одной высокоуровневой операции"""
+    name: str
+    commands: list = field(default_factory=list)
+    trips: int = 0  # Количество обменов (записей в порт), пакетный режим пишет несколько команд за один обмен
+
+    @property
+    def redundant(self) -> [Command]:
+        """Повторные одинаковые запросы без меняющей состояние команды между ними"""
+        result = []
+        seen = set()
+        for command in self.commands:
+            if command.code is None:
+                continue
+            if not command.query:
+                seen.clear()
+            elif command in seen:
+                result.append(command)
+            else:
+                seen.add(command)
+        return result
+
+    def dict(self) -> dict:
+        return {"operation": self.name, "trips": self.trips, "commands": [str(x) for x in self.commands],
+                "redundant": [str(x) for x in self.redundant]}
+
+
+def parse(data) -> [Command]:
+    """Команды из записанных в порт байт (пакетный режим пишет несколько кадров за раз)"""
+    data = bytes(data)
+    result = []
+    index = 0
+    while index < len(data):
+        if data[index] == ENQ:
+            result.append(Command(None))
+            index += 1
+        elif data[index] == SXT:
+            end = data.index(EXT, index)
+            # STX, пароль (4), ID пакета, код команды (2 HEX), параметры, ETX, CRC (2)
+            result.append(Command(int(data[index + 6:index + 8], 16), data[index + 8:end]))
+            index = end + 3
+        else:
+            index += 1
+    return result
+
+
+class RecordingTransport(TransportWrapper):
+    """Транспорт, записывающий команды в операцию, выполняемую текущим потоком"""
+
+    def __init__(self, transport: Transport):
+        super().__init__(transport)
+        self.local = local()
+
+    def on_write(self, data):
+        operation = getattr(self.local, "operation", None)
+        if operation is not None:
+            operation.commands.extend(parse(data))
+            operation.trips += 1
+
+
+class RoundTrips:
+    """
+    Учет обменов с кассой по высокоуровневым операциям
+
+    Подменяет транспорт кассы записывающим и собирает команды, которые поток записал в порт внутри operation. Ответы,
+    отданные SingleFlight или теневым состоянием без обмена, не учитываются. Повторный одинаковый запрос без
+    меняющей состояние команды между ними считается лишним.
+    """
+
+    def __init__(self, kkt: KKT):
+        self.kkt = kkt
+        self.transport = RecordingTransport(kkt.transport)
+        kkt.transport = self.transport
+        self.operations = []
+        self.__lock = Lock()
+
+    @contextmanager
+    def operation(self, name: str, budget: int = None, redundant: bool = True):
+        """
+        Учесть команды операции
+        :param name: название операции
+        :param budget: максимальное количество обменов, при превышении - BudgetExceeded
+        :param redundant: допускать лишние запросы, иначе - BudgetExceeded
+        """
+        outer = getattr(self.transport.local, "operation", None)
+        result = Operation(name)
+        self.transport.local.operation = result
+        try:
+            yield result
+        finally:
+            self.transport.local.operation = outer
+            if outer is not None:
+                outer.commands.extend(result.commands)
+                outer.trips += result.trips
+            with self.__lock:
+                self.operations.append(result)
+        if budget is not None and result.trips > budget:
+            raise BudgetExceeded("%s: %i обменов при бюджете %i: %s" %
+                                 (name, result.trips, budget, " ".join(str(x) for x in result.commands)))
+        if not redundant and result.redundant:
+            raise BudgetExceeded("%s: лишние запросы %s" % (name, " ".join(str(x) for x in result.redundant)))
+
+    def report(self) -> dict:
+        """Название операции -> количество выполнений, обмены (минимум, среднее, максимум) и лишние запросы"""
+        result = {}
+        with self.__lock:
+            operations = list(self.operations)
+        for operation in operations:
+            entry = result.setdefault(operation.name, {"count": 0, "trips": [], "redundant": 0})
+            entry["count"] += 1
+            entry["trips"].append(operation.trips)
+            entry["redundant"] += len(operation.redundant)
+        for entry in result.values():
+            trips = entry.pop("trips")
+            entry.update(min=min(trips), mean=sum(trips) / len(trips), max=max(trips))
+        return result
+
+    def detach(self):
+        """Вернуть кассе исходный транспорт"""
+        self.kkt.transport = self.transport.transport
+
+
+def cheque(items: int):
+    """Чек прихода из items позиций, оплата наличными"""
+    from viki.helpers import Cheque, Item, ItemTax
+    result = Cheque(DocumentType.SALE)
+    for number in range(items):
+        result.items.append(Item("Товар %i" % number, 1, 10.0, ItemTax.TAX_20, PaymentType.FULL_SETTLEMENT,
+                                 SubjectMatter.DEFAULT))
+    return result
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="python -m viki.roundtrip",
+                                     description="Обмены с кассой по типовым операциям KKTHelper на эмуляторе")
+    parser.add_argument("--budget", action="append", default=[], metavar="ОПЕРАЦИЯ=N",
+                        help="максимальное количество обменов операции, можно повторять")
+    options = parser.parse_args(args)
+    budgets = {}
+    for value in options.budget:
+        name, _, limit = value.partition("=")
+        budgets[name] = int(limit)
+    from viki.helpers import KKTHelper
+    helper = KKTHelper(Emulator(), "", "Кассир", TaxSystem.OVERALL)
+    trips = RoundTrips(helper.kkt)
+    steps = [
+        ("prepare", helper.prepare),
+        ("check", helper.check),
+        ("cheque-1", lambda: helper.print_cheque(cheque(1))),
+        ("cheque-10", lambda: helper.print_cheque(cheque(10))),
+        ("report-x", helper.kkt.report_x),
+        ("cheque-after-report", lambda: helper.print_cheque(cheque(1))),
+    ]
+    failed = 0
+    for name, step in steps:
+        try:
+            with trips.operation(name, budgets.get(name)) as operation:
+                step()
+            result = operation.dict()
+        except BudgetExceeded as e:
+            failed += 1
+            result = {"operation": name, "error": str(e)}
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
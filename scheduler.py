@@ -0,0 +1,204 @@
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from threading import Condition, Thread, Event
+
+from viki.archive import ArchiveReader
+from viki.data import FNShiftStatus
+from viki.kkt import KKT
+
+log = logging.getLogger(__name__)
+
+SHIFT_OPEN_DOCUMENT = 2  # Тип документа “Отчет об открытии смены”
+
+
+class ShiftScheduler:
+    """
+    Планировщик смены
+
+    Отслеживает возраст смены по данным ФН и переоткрывает смену (отчет о закрытии + открытие) в периоды простоя
+    кассы, не дожидаясь блокировки по истечении 24 часов. На время переоткрытия новые чеки удерживаются в hold().
+
+    Время открытия каждой новой смены берется из отчета об открытии смены в архиве ФН. Если отчет не найден, возраст
+    смены неизвестен: такая смена переоткрывается в первом окне простоя, а не дожидаясь простоя - как только ФН
+    сообщит, что смена открыта больше 24 часов.
+    """
+
+    def __init__(self, kkt: KKT,
+                 max_age: timedelta = timedelta(hours=22),
+                 deadline: timedelta = timedelta(hours=23, minutes=30),
+                 idle: timedelta = timedelta(minutes=3),
+                 interval: float = 30.0,
+                 hold_timeout: float = 60.0,
+                 search: int = 16):
+        """
+        :param kkt: касса
+        :param max_age: возраст смены, после которого она переоткрывается в ближайшем окне простоя
+        :param deadline: возраст смены, после которого она переоткрывается не дожидаясь простоя
+        :param idle: длительность отсутствия чеков, считающаяся окном простоя
+        :param interval: период опроса состояния смены (сек)
+        :param hold_timeout: максимальное время ожидания чека на время переоткрытия смены (сек)
+        :param search: сколько документов архива ФН просматривать в поисках отчета об открытии смены
+        """
+        self.kkt = kkt
+        self.max_age = max_age
+        self.deadline = deadline
+        self.idle = idle
+        self.interval = interval
+        self.hold_timeout = hold_timeout
+        self.search = search
+        self.number = None  # Номер текущей смены
+        self.is_open = False  # Смена открыта
+        self.opened_at = None  # Время открытия смены (None - неизвестно)
+        self.seen_at = None  # Время первого наблюдения текущей смены
+        self.overdue = False  # ФН сообщает, что смена открыта больше 24 часов
+        self.error: Exception = None  # Последняя ошибка фонового потока
+        self.last_activity = datetime.now()  # Время последнего чека
+        self.__condition = Condition()
+        self.__busy = 0  # Количество чеков в работе
+        self.__exclusive = False  # Планировщик работает с кассой
+        self.__tracked = None  # Время последнего опроса смены
+        self.__stop = Event()
+        self.__thread = None
+
+    @property
+    def age(self) -> timedelta:
+        """Возраст смены (None - смена закрыта или время открытия неизвестно)"""
+        if not self.is_open or self.opened_at is None:
+            return None
+        return datetime.now() - self.opened_at
+
+    @contextmanager
+    def hold(self):
+        """
+        Контекст работы с документом
+
+        Ожидает окончания переоткрытия смены и не дает планировщику занять кассу до выхода из контекста
+        """
+        with self.__condition:
+            if not self.__condition.wait_for(lambda: not self.__exclusive, self.hold_timeout):
+                raise Exception("Касса занята переоткрытием смены!")
+            self.__busy += 1
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__busy -= 1
+                self.last_activity = datetime.now()
+                self.__condition.notify_all()
+
+    def track(self, opened_at: datetime = None):
+        """
+        Обновить состояние смены по данным ФН
+        :param opened_at: время открытия новой смены, если смену открыл планировщик, иначе ищется в архиве ФН
+        """
+        status = self.kkt.exchange_fn.shift_status
+        number = int(status.number)
+        if status.is_open and (not self.is_open or number != self.number):
+            self.seen_at = datetime.now()
+            self.opened_at = opened_at or self.opened(status)
+        self.number = number
+        self.is_open = status.is_open
+        # Без времени открытия границей служит признак ФН “Смена больше 24 часов”
+        self.overdue = status.is_open and self.opened_at is None and self.kkt.state.current.shift_more_24
+        self.__tracked = datetime.now()
+
+    def opened(self, status: FNShiftStatus) -> datetime:
+        """
+        Время открытия смены по отчету об открытии смены в архиве ФН
+        :param status: состояние смены
+        :return: время открытия или None, если отчет не найден
+        """
+        try:
+            reader = ArchiveReader(self.kkt)
+            # Отчет об открытии смены предшествует всем чекам смены
+            start = int(self.kkt.exchange_fn.number_last_doc) - max(int(status.cheque) - 1, 0)
+            for number in range(start, max(start - self.search, 0), -1):
+                document = reader.document(number)
+                if document.shift is not None and document.shift < int(status.number):
+                    break
+                if document.type == SHIFT_OPEN_DOCUMENT and document.shift == int(status.number):
+                    return document.datetime
+        except Exception as e:
+            log.warning("Время открытия смены не найдено в архиве ФН: %s", e)
+        return None
+
+    def due(self) -> bool:
+        """Смену пора переоткрыть: она старше max_age или ее возраст неизвестен"""
+        if not self.is_open:
+            return False
+        return self.opened_at is None or datetime.now() - self.opened_at >= self.max_age
+
+    def urgent(self) -> bool:
+        """Смену нужно переоткрыть не дожидаясь простоя"""
+        if not self.is_open:
+            return False
+        if self.opened_at is None:
+            return self.overdue
+        return datetime.now() - self.opened_at >= self.deadline
+
+    def idling(self) -> bool:
+        """Касса простаивает"""
+        return self.__busy == 0 and datetime.now() - self.last_activity >= self.idle
+
+    def rotate(self):
+        """Закрыть и заново открыть смену"""
+        with self.__exclusive_access():
+            self.__rotate()
+
+    def poll(self):
+        """Один шаг планировщика: опросить смену и при необходимости переоткрыть ее"""
+        with self.__condition:
+            fresh = self.__tracked is not None and datetime.now() - self.__tracked < timedelta(seconds=self.interval)
+            if fresh and not (self.urgent() or (self.due() and self.idling())):
+                return
+            if self.__busy and not self.urgent():
+                return
+        with self.__exclusive_access():
+            self.track()
+            if self.urgent() or (self.due() and self.idling()):
+                self.__rotate()
+
+    def start(self):
+        """Запустить планировщик в фоновом потоке"""
+        if self.__thread is not None:
+            return
+        self.__stop.clear()
+        self.__thread = Thread(target=self.__run, name="viki-shift-scheduler", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """Остановить фоновый поток планировщика"""
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __run(self):
+        while not self.__stop.wait(min(self.interval, self.idle.total_seconds())):
+            try:
+                self.poll()
+                self.error = None
+            except Exception as e:
+                # Ошибки связи не должны останавливать планировщик, повторим на следующем шаге
+                self.error = e
+                log.exception("Ошибка планировщика смены")
+
+    def __rotate(self):
+        if self.is_open:
+            self.kkt.close_shift()
+        self.kkt.open_shift()
+        self.track(datetime.now())
+
+    @contextmanager
+    def __exclusive_access(self):
+        with self.__condition:
+            self.__condition.wait_for(lambda: not self.__exclusive)
+            self.__exclusive = True
+            self.__condition.wait_for(lambda: self.__busy == 0)
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__exclusive = False
+                self.__condition.notify_all()
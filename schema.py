@@ -0,0 +1,225 @@
+from collections import namedtuple
+from datetime import datetime
+
+from viki.packet import Input, SXT, EXT, DELIM
+
+
+class Type:
+    """Тип поля команды: кодирование параметра и разбор поля ответа"""
+
+    def __init__(self, name: str, encode, decode, width: int = 1):
+        """
+        :param name: название типа
+        :param encode: значение -> байты параметра
+        :param decode: список полей ответа -> значение
+        :param width: количество полей ответа, которое занимает значение
+        """
+        self.name = name
+        self.encode = encode
+        self.decode = decode
+        self.width = width
+
+    def __repr__(self):
+        return self.name
+
+
+def _string(fields) -> str:
+    return bytes(fields[0]).decode("cp866")
+
+
+def _datetime(fields) -> datetime:
+    date = bytes(fields[0]).decode()
+    if date == "000000":
+        return datetime.min
+    return datetime.strptime(date + bytes(fields[1]).decode(), "%d%m%y%H%M%S")
+
+
+STRING = Type("STRING", lambda value: value.encode("CP866"), _string)
+INT = Type("INT", lambda value: b"%i" % value, lambda fields: int(bytes(fields[0])))
+BOOL = Type("BOOL", lambda value: b"1" if value else b"0", lambda fields: bytes(fields[0]) == b"1")
+NUMBER = Type("NUMBER", lambda value: b"%0.3f" % value, lambda fields: float(bytes(fields[0])))  # Дробное число
+ENUM = Type("ENUM", lambda value: str(value.value).encode(), _string)  # Значение Enum
+DATE = Type("DATE", lambda value: value.strftime("%d%m%y").encode(),
+            lambda fields: datetime.strptime(bytes(fields[0]).decode(), "%d%m%y"))
+TIME = Type("TIME", lambda value: value.strftime("%H%M%S").encode(),
+            lambda fields: datetime.strptime(bytes(fields[0]).decode(), "%H%M%S"))
+DATETIME = Type("DATETIME", lambda value: value.strftime("%d%m%y").encode() + bytes([DELIM]) +
+                value.strftime("%H%M%S").encode(), _datetime, 2)  # Два поля: дата и время
+HEX = Type("HEX", lambda value: value.hex().upper().encode(), lambda fields: bytes.fromhex(_string(fields)))
+RAW = Type("RAW", bytes, lambda fields: bytes(fields[0]))
+
+
+class Frame:
+    """
+    Кадр команды с закодированными параметрами
+
+    В отличие от Output не расходуется при отправке: пароль и ID пакета подставляются в get_bytes, поэтому один кадр
+    можно отправлять многократно
+    """
+
+    __slots__ = ("code", "head", "body")
+
+    def __init__(self, code: int, body: bytes):
+        """
+        :param code: код команды
+        :param body: параметры, каждый с разделителем
+        """
+        self.code = code
+        self.head = b"%02X" % code
+        self.body = body
+
+    def get_bytes(self, password: str, id: int) -> bytearray:
+        result = bytearray((SXT,))
+        result += password.encode()
+        result.append(id)
+        result += self.head
+        result += self.body
+        result.append(EXT)
+        crc = 0
+        for x in result[1:]:
+            crc ^= x
+        result += b"%02x" % crc
+        return result
+
+
+class Schema:
+    """
+    Описание команды: код, параметры и поля ответа
+
+    Кодировщики параметров и разбор ответа собираются один раз при описании команды, при вызове значения только
+    прогоняются через уже выбранные функции. Необязательные параметры в конце команды, равные None, не передаются,
+    в середине - передаются пустыми.
+    """
+
+    REQUIRED = object()  # Параметр без значения по умолчанию
+
+    def __init__(self, name: str, code: int, params=(), answer=(), fixed=()):
+        """
+        :param name: имя команды
+        :param code: код команды
+        :param params: параметры (имя, тип) или (имя, тип, значение по умолчанию)
+        :param answer: поля ответа (имя, тип), None - пропустить поле
+        :param fixed: постоянные параметры перед params (номер подкоманды, номер настройки)
+        """
+        self.name = name
+        self.code = code
+        self.params = tuple(param[0] for param in params)
+        self.defaults = tuple(param[2] if len(param) > 2 else Schema.REQUIRED for param in params)
+        self.__encoders = tuple(param[1].encode for param in params)
+        self.__prefix = b"".join(STRING.encode(value) + bytes([DELIM]) for value in fixed)
+        fields = []
+        offset = 0
+        for field in answer:
+            if field is None:
+                offset += 1
+                continue
+            fields.append((field[0], offset, offset + field[1].width, field[1].decode))
+            offset += field[1].width
+        self.__fields = tuple(fields)
+        self.answer = namedtuple(name.title().replace("_", ""), [field[0] for field in fields]) \
+            if len(fields) > 1 else None
+
+    def frame(self, *args, **kwargs) -> Frame:
+        """Закодировать команду"""
+        values = list(args) + list(self.defaults[len(args):])
+        if kwargs:
+            for index, name in enumerate(self.params):
+                if name in kwargs:
+                    values[index] = kwargs.pop(name)
+            if kwargs:
+                raise Exception("Команда %s не имеет параметров %s" % (self.name, ", ".join(kwargs)))
+        if len(values) > len(self.params):
+            raise Exception("Команда %s: лишние параметры" % self.name)
+        size = len(values)
+        while size and values[size - 1] is None:
+            size -= 1
+        body = bytearray(self.__prefix)
+        for index in range(size):
+            value = values[index]
+            if value is Schema.REQUIRED:
+                raise Exception("Команда %s: не задан параметр %s" % (self.name, self.params[index]))
+            if value is not None:
+                body += self.__encoders[index](value)
+            body.append(DELIM)
+        return Frame(self.code, bytes(body))
+
+    def decode(self, packet: Input):
+        """
+        Разобрать ответ
+        :return: значение единственного поля, namedtuple полей или None, если поля ответа не описаны
+        """
+        data = packet.data
+        if self.answer is None:
+            if not self.__fields:
+                return None
+            _, start, end, decode = self.__fields[0]
+            return decode(data[start:end])
+        return self.answer._make(decode(data[start:end]) for _, start, end, decode in self.__fields)
+
+    def __call__(self, kkt, *args, **kwargs):
+        """
+        Выполнить команду
+        :param kkt: касса
+        :return: разобранный ответ, если поля ответа описаны, иначе ответ кассы
+        """
+        packet = kkt.send(self.frame(*args, **kwargs))
+        if not self.__fields:
+            return packet
+        return self.decode(packet)
+
+    def __repr__(self):
+        return "Schema(%s, 0x%02X)" % (self.name, self.code)
+
+
+COMMANDS = {}  # Имя команды -> Schema
+
+
+def define(name: str, code: int, params=(), answer=(), fixed=()) -> Schema:
+    """Описать команду и добавить ее в реестр"""
+    if name in COMMANDS:
+        raise Exception("Команда %s уже описана" % name)
+    result = Schema(name, code, params, answer, fixed)
+    COMMANDS[name] = result
+    return result
+
+
+# Запросы
+STATUS = define("status", 0x00, answer=(("fatal", INT), ("current", INT), ("document", INT)))
+PRINTER_STATUS = define("printer_status", 0x04, answer=(("status", INT),))
+FN_SHIFT_STATUS = define("fn_shift_status", 0x78, fixed=("6",),
+                         answer=(None, ("number", STRING), ("is_open", BOOL), ("cheque", STRING)))
+FN_EXCHANGE_STATUS = define("fn_exchange_status", 0x78, fixed=("7",),
+                            answer=(None, ("status", INT), ("count", STRING), ("number", STRING),
+                                    ("date", DATETIME)))
+FN_START_DOCUMENT = define("fn_start_document", 0x78, (("number", INT),), fixed=("15",),
+                           answer=(None, ("type", INT), ("size", INT)))
+FN_READ_DOCUMENT = define("fn_read_document", 0x78, fixed=("16",))
+
+# Логотип
+FRAME_SIZE = 1024  # Максимальный размер кадра команды (байт)
+LOGO_FRAME_OVERHEAD = 32  # Заголовок, служебные параметры и CRC кадра загрузки логотипа
+LOGO_CHUNK = (FRAME_SIZE - LOGO_FRAME_OVERHEAD) // 2  # Байт логотипа в одном кадре (данные передаются в HEX)
+LOAD_LOGO = define("load_logo", 0x15, (("size", INT), ("offset", INT), ("data", HEX)))
+DELETE_LOGO = define("delete_logo", 0x16)
+
+# Документ
+OPEN_DOC = define("open_doc", 0x30, (("mode", INT), ("departament", INT), ("operator", STRING), ("number", INT),
+                                     ("tax_system", STRING)))
+CLOSE_DOC = define("close_doc", 0x31, (("cut", STRING), ("address", STRING, None), ("internet", BOOL, None),
+                                       ("title", STRING, None), ("value", STRING, None), ("buyer", STRING, None),
+                                       ("buyer_inn", STRING, None)))
+PRINT_TEXT = define("print_text", 0x40, (("text", STRING), ("font", STRING)))
+PRINT_BARCODE = define("print_barcode", 0x41, (("out", ENUM), ("width", INT), ("height", INT), ("view", ENUM),
+                                               ("text", STRING)))
+ADD_ITEM = define("add_item", 0x42, (("title", STRING), ("article", STRING), ("count", NUMBER), ("price", NUMBER),
+                                     ("tax", INT), ("number", STRING, ""), ("section", INT, 0),
+                                     ("reserved1", STRING, ""), ("reserved2", STRING, ""),
+                                     ("discount", NUMBER, 0), ("payment", ENUM), ("subject", ENUM),
+                                     ("country", STRING, None), ("customs", STRING, None), ("excise", NUMBER, None)))
+ITEM_REQUISITES = define("item_requisites", 0x24, (("code", HEX, None), ("requisite", STRING, None),
+                                                   ("unit", STRING, None), ("country", STRING, None),
+                                                   ("customs", STRING, None), ("excise", NUMBER, None)))
+SUBTOTAL = define("subtotal", 0x44)
+DISCOUNT = define("discount", 0x45, (("type", INT), ("title", STRING), ("value", NUMBER)))
+PAYMENT = define("payment", 0x47, (("code", INT), ("total", NUMBER), ("text", STRING, "")))
+CASH_IN_OUT = define("cash_in_out", 0x48, (("text", STRING), ("total", NUMBER)))
@@ -0,0 +1,123 @@
+from threading import Lock
+from time import monotonic
+
+from viki.data import KKTStatus
+from viki.kkt import KKT
+from viki.packet import Input
+
+Condition = KKTStatus.Document.Condition
+
+
+class Shadow:
+    """
+    Теневое состояние кассы
+
+    Статус ККТ (смена, начало работы, состояние документа) ведется на стороне ПК по успешно выполненным командам, без
+    запроса статуса перед каждой операцией. Статус перечитывается с кассы только после ошибки команды, ошибки связи
+    или переподключения, а также если с последней сверки прошло больше interval секунд. Любой запрос статуса (кем бы он
+    ни был отправлен) сверяет теневое состояние с кассой.
+    """
+
+    def __init__(self, kkt: KKT, interval: float = 60.0):
+        """
+        :param kkt: касса, к которой подключается теневое состояние
+        :param interval: период обязательной сверки с кассой (сек)
+        """
+        self.kkt = kkt
+        self.interval = interval
+        self.__status: KKTStatus = None
+        self.__external_counter: bool = None
+        self.__serial: str = None
+        self.__synced: float = None  # Время последней сверки (monotonic), None - требуется сверка
+        self.__lock = Lock()
+        kkt.shadow = self
+        kkt.observers.append(self.observe)
+
+    @property
+    def stale(self) -> bool:
+        """Требуется сверка с кассой"""
+        synced = self.__synced
+        return synced is None or monotonic() - synced > self.interval
+
+    def invalidate(self):
+        """Сверить состояние с кассой при следующем обращении"""
+        with self.__lock:
+            self.__synced = None
+            self.__external_counter = None
+            self.__serial = None
+
+    @property
+    def status(self) -> KKTStatus:
+        """Статус ККТ, при необходимости перечитывается с кассы"""
+        if self.stale:
+            return self.kkt.status
+        return self.__status
+
+    @property
+    def known(self) -> KKTStatus:
+        """Статус ККТ без обращения к кассе, None - требуется сверка"""
+        if self.stale:
+            return None
+        return self.__status
+
+    @property
+    def external_counter(self) -> bool:
+        """Нумерация чеков внешней программой (настройка чека)"""
+        result = self.__external_counter
+        if result is None:
+            result = self.kkt.settings.cheque.external_counter
+            with self.__lock:
+                self.__external_counter = result
+        return result
+
+    @property
+    def serial(self) -> str:
+        """Заводской номер ККТ, запрашивается один раз за соединение"""
+        result = self.__serial
+        if result is None:
+            result = self.kkt.information.manufacture_number
+            with self.__lock:
+                self.__serial = result
+        return result
+
+    def observe(self, code: int, result: Input):
+        """
+        Учесть выполненную команду
+        :param code: код команды, None - переподключение
+        :param result: ответ кассы, None - ошибка связи
+        """
+        with self.__lock:
+            if result is None or result.error:
+                self.__synced = None
+                if code is None or code == 0x12:
+                    self.__external_counter = None
+                if code is None:
+                    self.__serial = None
+                return
+            if code == 0x00:
+                self.__status = KKTStatus(result.to_int(0), result.to_int(1), result.to_int(2))
+                self.__synced = monotonic()
+                return
+            if code == 0x12:
+                self.__external_counter = None
+                return
+            if self.__status is None:
+                return
+            current = self.__status.current
+            document = self.__status.document
+            if code == 0x10:
+                current.no_begin = False
+            elif code == 0x21:
+                current.shift_open = False
+                current.shift_more_24 = False
+            elif code == 0x23:
+                current.shift_open = True
+            elif code == 0x30:
+                document.condition = Condition.OPEN
+            elif code in (0x31, 0x32, 0x33):
+                document.type = KKTStatus.Document.Type.CLOSE
+                document.condition = Condition.CLOSE
+            elif code == 0x44:
+                document.condition = Condition.SUBTOTAL if document.condition == Condition.OPEN else Condition.PAYMENT
+            elif code == 0x47:
+                document.condition = Condition.PAYMENT
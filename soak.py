@@ -0,0 +1,233 @@
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import threading
+import tracemalloc
+from dataclasses import dataclass, asdict, field
+from threading import Event, Lock, Thread
+from time import perf_counter
+
+from viki.data import TaxSystem
+from viki.emulator import Emulator
+from viki.helpers import KKTHelper
+from viki.loadtest import Mix
+
+# Допустимый рост метрики за время теста после прогрева
+LIMITS = {
+    "heap": 4 * 1024 * 1024,  # Память Python по tracemalloc (байт)
+    "rss": 32 * 1024 * 1024,  # Резидентная память процесса (байт)
+    "fds": 4,  # Открытые файловые дескрипторы
+    "threads": 2,  # Потоки
+}
+
+
+@dataclass
+class Sample:
+    """Замер ресурсов процесса"""
+    elapsed: float  # Время от начала теста (сек)
+    frames: int  # Обработано кадров
+    heap: int  # Память Python по tracemalloc (байт)
+    rss: int  # Резидентная память процесса (байт), None - неизвестно
+    fds: int  # Открытые файловые дескрипторы, None - неизвестно
+    threads: int  # Потоки
+
+
+@dataclass
+class Report:
+    """Результат длительного теста"""
+    frames: int  # Обработано кадров
+    cheques: int  # Напечатано чеков
+    errors: int  # Операций с ошибкой
+    elapsed: float  # Длительность (сек)
+    growth: dict  # Метрика -> рост за время теста, только для метрик с устойчивым ростом
+    top: list  # Места с наибольшим приростом выделенной памяти после прогрева
+    samples: list = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.growth and not self.errors
+
+
+def rss() -> int:
+    """Резидентная память процесса (байт)"""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def fds() -> int:
+    """Количество открытых файловых дескрипторов"""
+    for path in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(path))
+        except OSError:
+            continue
+    return None
+
+
+def sustained(values: list, limit: float) -> float:
+    """
+    Устойчивый рост ряда значений
+    Ряд делится на четыре части, рост считается устойчивым, если медиана каждой следующей части больше предыдущей, а
+    общий рост медиан превышает limit
+    :return: рост медиан или None
+    """
+    values = [x for x in values if x is not None]
+    if len(values) < 8:
+        return None
+    size = len(values) // 4
+    medians = [sorted(values[index * size:(index + 1) * size])[size // 2] for index in range(4)]
+    if all(a < b for a, b in zip(medians, medians[1:])) and medians[-1] - medians[0] > limit:
+        return medians[-1] - medians[0]
+    return None
+
+
+class Soak:
+    """
+    Длительный тест на утечки памяти, дескрипторов и потоков
+
+    Каждая линия печатает сгенерированные чеки через KKTHelper на своем эмуляторе, периодически запрашивает статусы
+    и данные ФН, переоткрывает канал связи и переоткрывает смену. Раз в interval секунд снимаются tracemalloc, RSS,
+    файловые дескрипторы и потоки. Первые warmup замеров (заполнение кэшей) не учитываются, по остальным ищется
+    устойчивый рост (см. sustained), а места выделения памяти сравниваются со снимком после прогрева.
+    """
+
+    def __init__(self, lanes: int = 4, frames: int = 1000000, duration: float = None, interval: float = 5.0,
+                 warmup: int = 2, depth: int = 1, top: int = 10, mix: Mix = None, seed: int = 0):
+        """
+        :param lanes: количество линий (эмуляторов)
+        :param frames: остановиться после обработки стольких кадров всеми эмуляторами
+        :param duration: остановиться через столько секунд, None - только по количеству кадров
+        :param interval: период замеров (сек)
+        :param warmup: количество замеров прогрева
+        :param depth: глубина стека мест выделения памяти
+        :param top: количество мест выделения памяти в отчете
+        :param mix: состав чеков
+        :param seed: зерно генератора чеков
+        """
+        self.lanes = lanes
+        self.frames = frames
+        self.duration = duration
+        self.interval = interval
+        self.warmup = warmup
+        self.depth = depth
+        self.top = top
+        self.mix = mix or Mix()
+        self.seed = seed
+        self.emulators = [Emulator("%010i" % (lane + 1)) for lane in range(lanes)]
+        self.cheques = 0
+        self.errors = 0
+        self.__lock = Lock()
+        self.__stop = Event()
+
+    @property
+    def processed(self) -> int:
+        """Обработано кадров"""
+        return sum(emulator.frames for emulator in self.emulators)
+
+    def run(self) -> Report:
+        """Выполнить тест"""
+        tracemalloc.start(self.depth)
+        threads = [Thread(target=self.__lane, args=(lane,), name="viki-soak-%i" % lane) for lane in range(self.lanes)]
+        start = perf_counter()
+        samples = []
+        baseline = None
+        try:
+            for thread in threads:
+                thread.start()
+            while True:
+                done = self.__stop.wait(self.interval) or self.processed >= self.frames or \
+                    (self.duration is not None and perf_counter() - start >= self.duration)
+                samples.append(self.__sample(perf_counter() - start))
+                if len(samples) == self.warmup:
+                    baseline = tracemalloc.take_snapshot()
+                if done:
+                    break
+        finally:
+            self.__stop.set()
+            for thread in threads:
+                thread.join()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        measured = samples[self.warmup:]
+        growth = {}
+        for metric, limit in LIMITS.items():
+            value = sustained([getattr(sample, metric) for sample in measured], limit)
+            if value is not None:
+                growth[metric] = value
+        top = []
+        if baseline is not None:
+            for stat in snapshot.compare_to(baseline, "traceback")[:self.top]:
+                top.append({"site": " <- ".join("%s:%i" % (frame.filename, frame.lineno) for frame in stat.traceback),
+                            "size": stat.size_diff, "count": stat.count_diff})
+        return Report(self.processed, self.cheques, self.errors, perf_counter() - start, growth, top,
+                      [asdict(sample) for sample in samples])
+
+    def stop(self):
+        """Остановить тест досрочно"""
+        self.__stop.set()
+
+    def __sample(self, elapsed: float) -> Sample:
+        gc.collect()
+        return Sample(round(elapsed, 3), self.processed, tracemalloc.get_traced_memory()[0], rss(), fds(),
+                      threading.active_count())
+
+    def __lane(self, lane: int):
+        rnd = random.Random(self.seed * 1000003 + lane)
+        helper = KKTHelper(self.emulators[lane], "", "Кассир", TaxSystem.OVERALL)
+        kkt = helper.kkt
+        count = 0
+        while not self.__stop.is_set():
+            count += 1
+            try:
+                helper.print_cheque(self.mix.cheque(rnd))
+                with self.__lock:
+                    self.cheques += 1
+                if count % 20 == 0:
+                    kkt.status
+                    kkt.printer
+                    kkt.exchange_fn.shift_status
+                    kkt.exchange_fn.exchange_status
+                    kkt.settings.cheque
+                if count % 100 == 0:
+                    kkt.close()
+                if count % 1000 == 0:
+                    helper.shift.close()
+                    helper.shift.open()
+            except Exception:
+                with self.__lock:
+                    self.errors += 1
+        helper.close()
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="python -m viki.soak",
+                                     description="Длительный тест на утечки памяти, дескрипторов и потоков")
+    parser.add_argument("--lanes", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=1000000, help="количество кадров")
+    parser.add_argument("--duration", type=float, help="ограничение длительности (сек)")
+    parser.add_argument("--interval", type=float, default=5.0, help="период замеров (сек)")
+    parser.add_argument("--warmup", type=int, default=2, help="количество замеров прогрева")
+    parser.add_argument("--depth", type=int, default=1, help="глубина стека мест выделения памяти")
+    parser.add_argument("--top", type=int, default=10, help="количество мест выделения памяти в отчете")
+    parser.add_argument("--samples", action="store_true", help="включить замеры в отчет")
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args(args)
+    soak = Soak(options.lanes, options.frames, options.duration, options.interval, options.warmup, options.depth,
+                options.top, seed=options.seed)
+    report = soak.run()
+    result = asdict(report)
+    result["ok"] = report.ok
+    if not options.samples:
+        del result["samples"]
+    print(json.dumps(result, ensure_ascii=False))
+    return 0 if report.ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,193 @@
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+
+from viki.data import KKTStatus
+from viki.kkt import KKT
+
+
+class Busy(Exception):
+    """Касса занята другим потоком"""
+
+
+def escape(value: str) -> str:
+    """Значение метки Prometheus"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Sample:
+    """Последние значения метрик одной кассы"""
+
+    def __init__(self, port: str):
+        self.port = port  # Порт кассы
+        self.serial = None  # Заводской номер ККТ, None - еще не прочитан
+        self.up = False  # Последний опрос прошел успешно
+        self.timestamp = None  # Время последнего успешного опроса
+        self.values = {}  # Метрика -> значение
+
+
+class Telemetry:
+    """
+    Телеметрия парка касс
+
+    Раз в interval секунд одним проходом опрашивает у каждой кассы состояние ПУ, статус ККТ, напряжение батарейки и
+    очередь документов для ОФД. Опрос низкоприоритетный: касса захватывается на время одного запроса, и если она
+    занята другим потоком, остаток опроса пропускается до следующего прохода. Статус ККТ берется из теневого
+    состояния, если оно подключено. Метрики отдаются из кэша в текстовом формате Prometheus, без обращения к кассам,
+    с метками порта и заводского номера. До первого успешного опроса заводской номер пустой, набор меток у всех
+    рядов один и тот же.
+    """
+
+    METRICS = {
+        "viki_up": "Последний опрос кассы прошел успешно",
+        "viki_last_sweep_timestamp_seconds": "Время последнего успешного опроса",
+        "viki_fatal": "Установлен флаг фатального состояния ККТ",
+        "viki_shift_open": "Смена открыта",
+        "viki_shift_more_24": "Смена больше 24 часов",
+        "viki_document_open": "Открыт документ",
+        "viki_printer_no_ready": "Принтер не готов",
+        "viki_printer_no_paper": "В принтере нет бумаги",
+        "viki_printer_open_cover": "Открыта крышка принтера",
+        "viki_printer_error_cutter": "Ошибка резчика принтера",
+        "viki_printer_no_link": "Нет связи с принтером",
+        "viki_battery_millivolts": "Напряжение на батарейке (мВ)",
+        "viki_ofd_backlog": "Количество документов для передачи в ОФД",
+        "viki_ofd_first_document_timestamp_seconds": "Время первого документа для передачи в ОФД",
+    }
+
+    def __init__(self, kkts: [KKT], interval: float = 30.0):
+        """
+        :param kkts: опрашиваемые кассы
+        :param interval: период опроса (сек)
+        """
+        self.kkts = list(kkts)
+        self.interval = interval
+        self.samples = {id(kkt): Sample(str(kkt.transport)) for kkt in self.kkts}
+        self.__lock = Lock()
+        self.__stop = Event()
+        self.__thread = None
+        self.__server = None
+
+    def sweep(self):
+        """Один проход опроса всех касс"""
+        for kkt in self.kkts:
+            self.__collect(kkt)
+
+    @staticmethod
+    def __query(kkt: KKT, function):
+        """Выполнить один запрос, если касса свободна, иначе - Busy"""
+        if not kkt.lock.acquire(blocking=False):
+            raise Busy()
+        try:
+            return function()
+        finally:
+            kkt.lock.release()
+
+    def __collect(self, kkt: KKT):
+        sample = self.samples[id(kkt)]
+        try:
+            if sample.serial is None:
+                serial = self.__query(kkt, lambda: kkt.information.manufacture_number)
+                with self.__lock:
+                    sample.serial = serial
+            status = self.__query(kkt, lambda: kkt.state)
+            printer = self.__query(kkt, lambda: kkt.printer)
+            battery = self.__query(kkt, lambda: kkt.service.battery)
+            ofd = self.__query(kkt, lambda: kkt.exchange_fn.exchange_status)
+        except Busy:
+            return
+        except Exception:
+            with self.__lock:
+                sample.up = False
+            return
+        values = {
+            "viki_fatal": any(vars(status.fatal).values()),
+            "viki_shift_open": status.current.shift_open,
+            "viki_shift_more_24": status.current.shift_more_24,
+            "viki_document_open": status.document.condition != KKTStatus.Document.Condition.CLOSE,
+            "viki_printer_no_ready": printer.no_ready,
+            "viki_printer_no_paper": printer.no_paper,
+            "viki_printer_open_cover": printer.open_cover,
+            "viki_printer_error_cutter": printer.error_cutter,
+            "viki_printer_no_link": printer.no_link,
+            "viki_battery_millivolts": battery,
+            "viki_ofd_backlog": int(ofd.count),
+        }
+        if ofd.date != datetime.min:
+            values["viki_ofd_first_document_timestamp_seconds"] = ofd.date.timestamp()
+        with self.__lock:
+            sample.up = True
+            sample.timestamp = datetime.now()
+            sample.values = values
+
+    def render(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        with self.__lock:
+            rows = {name: [] for name in Telemetry.METRICS}
+            for sample in self.samples.values():
+                label = '{port="%s",serial="%s"}' % (escape(sample.port), escape(sample.serial or ""))
+                rows["viki_up"].append((label, sample.up))
+                if sample.timestamp is not None:
+                    rows["viki_last_sweep_timestamp_seconds"].append((label, sample.timestamp.timestamp()))
+                for name, value in sample.values.items():
+                    rows[name].append((label, value))
+        lines = []
+        for name, description in Telemetry.METRICS.items():
+            lines.append("# HELP %s %s" % (name, description))
+            lines.append("# TYPE %s gauge" % name)
+            for label, value in rows[name]:
+                lines.append("%s%s %s" % (name, label, float(value)))
+        return "\n".join(lines) + "\n"
+
+    def start(self):
+        """Запустить опрос в фоновом потоке"""
+        if self.__thread is not None:
+            return
+        self.__stop.clear()
+        self.__thread = Thread(target=self.__run, name="viki-telemetry", daemon=True)
+        self.__thread.start()
+
+    def serve(self, host: str = "127.0.0.1", port: int = 9108) -> ThreadingHTTPServer:
+        """
+        Отдавать метрики по HTTP (GET /metrics) на локальном сокете
+        :param host: адрес
+        :param port: порт
+        """
+        telemetry = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = telemetry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer((host, port), Handler)
+        Thread(target=self.__server.serve_forever, name="viki-telemetry-http", daemon=True).start()
+        return self.__server
+
+    def stop(self):
+        """Остановить опрос и HTTP сервер"""
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+
+    def __run(self):
+        while True:
+            self.sweep()
+            if self.__stop.wait(self.interval):
+                break
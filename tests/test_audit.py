@@ -0,0 +1,170 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from threading import Event
+
+from viki.audit import AuditWriter, JsonlSink, Sink, SqliteSink, record
+from viki.data import CloseDocData, TaxSystem
+from viki.emulator import Emulator
+from viki.helpers import KKTHelper
+from viki.roundtrip import cheque
+
+
+def close_data(number: int) -> CloseDocData:
+    return CloseDocData.load({"number": number, "counter": "1", "string_fd_fp": "", "number_fd": number,
+                              "fp_sign": number * 7, "shift_number": 1, "number_doc_in_shift": number,
+                              "date": "010125", "time": "120000"})
+
+
+class ListSink(Sink):
+    """Хранилище в памяти, запоминает размеры пачек"""
+
+    def __init__(self):
+        self.records = []
+        self.batches = []
+        self.closed = False
+
+    def write(self, records: [dict]):
+        self.records.extend(records)
+        self.batches.append(len(records))
+
+    def close(self):
+        self.closed = True
+
+
+class BlockedSink(ListSink):
+    """Хранилище, запись в которое ждет разрешения"""
+
+    def __init__(self):
+        super().__init__()
+        self.entered = Event()
+        self.release = Event()
+
+    def write(self, records: [dict]):
+        self.entered.set()
+        self.release.wait(5)
+        super().write(records)
+
+
+class BrokenSink(Sink):
+
+    def write(self, records: [dict]):
+        raise OSError("диск переполнен")
+
+
+class RecordTest(unittest.TestCase):
+
+    def test_record(self):
+        value = cheque(2)
+        value.pay(1, 20.0)
+        result = record(close_data(5), value, "0000000001")
+        self.assertEqual(result["serial"], "0000000001")
+        self.assertEqual(result["close"]["number_fd"], 5)
+        self.assertEqual(result["cheque"]["type"], "SALE")
+        self.assertEqual([x["title"] for x in result["cheque"]["items"]], ["Товар 0", "Товар 1"])
+        self.assertEqual(result["cheque"]["payments"], [[1, 20.0]])
+        json.dumps(result)
+
+    def test_without_cheque(self):
+        self.assertNotIn("cheque", record(close_data(5)))
+
+
+class SinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "audit")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def lines(self, path: str) -> [dict]:
+        with open(path, encoding="utf-8") as file:
+            return [json.loads(line) for line in file]
+
+    def test_jsonl_rotation(self):
+        sink = JsonlSink(self.path, max_bytes=1, backups=2)
+        for number in range(1, 5):
+            sink.write([record(close_data(number))])
+        sink.flush()
+        sink.close()
+        # Каждая пачка превышает размер, поэтому текущий файл пуст, а хранятся две последние пачки
+        self.assertEqual(self.lines(self.path), [])
+        self.assertEqual(self.lines(self.path + ".1")[0]["close"]["number_fd"], 4)
+        self.assertEqual(self.lines(self.path + ".2")[0]["close"]["number_fd"], 3)
+        self.assertFalse(os.path.exists(self.path + ".3"))
+
+    def test_jsonl_append(self):
+        sink = JsonlSink(self.path)
+        sink.write([record(close_data(1)), record(close_data(2))])
+        sink.close()
+        sink = JsonlSink(self.path)
+        sink.write([record(close_data(3))])
+        sink.close()
+        self.assertEqual([x["close"]["number_fd"] for x in self.lines(self.path)], [1, 2, 3])
+
+    def test_sqlite(self):
+        sink = SqliteSink(self.path)
+        sink.write([record(close_data(1), cheque(1), "0000000001"), record(close_data(2), serial="0000000001")])
+        sink.close()
+        db = sqlite3.connect(self.path)
+        rows = db.execute("SELECT serial, number_fd, fp_sign, datetime, data FROM audit ORDER BY id").fetchall()
+        db.close()
+        self.assertEqual([row[:4] for row in rows],
+                         [("0000000001", 1, 7, "010125120000"), ("0000000001", 2, 14, "010125120000")])
+        self.assertEqual(json.loads(rows[0][4])["cheque"]["items"][0]["title"], "Товар 0")
+
+
+class AuditWriterTest(unittest.TestCase):
+
+    def test_close_writes_queue(self):
+        sink = ListSink()
+        writer = AuditWriter([sink], batch=3)
+        for number in range(10):
+            self.assertTrue(writer.submit({"number": number}))
+        writer.close(5)
+        self.assertEqual([x["number"] for x in sink.records], list(range(10)))
+        self.assertLessEqual(max(sink.batches), 3)
+        self.assertTrue(sink.closed)
+        self.assertEqual(writer.stats(), {"queued": 0, "written": 10, "dropped": 0, "failed": 0})
+
+    def test_full_queue_drops(self):
+        sink = BlockedSink()
+        writer = AuditWriter([sink], size=2)
+        writer.submit({"number": 0})
+        sink.entered.wait(5)
+        # Поток записи занят, в очередь помещаются только две записи
+        results = [writer.submit({"number": number}) for number in range(1, 5)]
+        self.assertEqual(results, [True, True, False, False])
+        sink.release.set()
+        writer.close(5)
+        self.assertEqual(writer.stats()["dropped"], 2)
+        self.assertEqual([x["number"] for x in sink.records], [0, 1, 2])
+
+    def test_failed_sink(self):
+        sink = ListSink()
+        writer = AuditWriter([BrokenSink(), sink])
+        writer.submit({"number": 1})
+        writer.close(5)
+        # Исправное хранилище получает запись, но она учитывается как не записанная
+        self.assertEqual(sink.records, [{"number": 1}])
+        self.assertEqual(writer.stats()["failed"], 1)
+        self.assertIsInstance(writer.error, OSError)
+
+    def test_printed_cheque_is_audited(self):
+        sink = ListSink()
+        helper = KKTHelper(Emulator("0000000042"), "", "Кассир", TaxSystem.OVERALL)
+        helper.audit = AuditWriter([sink])
+        result = helper.print_cheque(cheque(2))
+        helper.audit.close(5)
+        helper.close()
+        self.assertEqual(len(sink.records), 1)
+        self.assertEqual(sink.records[0]["serial"], "0000000042")
+        self.assertEqual(sink.records[0]["close"]["number_fd"], result.number_fd)
+        self.assertEqual(len(sink.records[0]["cheque"]["items"]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
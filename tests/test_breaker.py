@@ -0,0 +1,100 @@
+import unittest
+from threading import Timer
+from time import sleep
+
+from viki.breaker import CircuitBreaker, CircuitOpenError
+from viki.data import TaxSystem
+from viki.emulator import Emulator
+from viki.kkt import KKT
+from viki.transport import TransportError
+
+
+class UnpluggedEmulator(Emulator):
+    """Эмулятор, который можно отключить, как USB-адаптер"""
+
+    def __init__(self):
+        super().__init__()
+        self.unplugged = False
+
+    def open(self):
+        if self.unplugged:
+            raise TransportError("порт не найден")
+        super().open()
+
+    def write(self, data):
+        if self.unplugged:
+            self.close()
+            raise TransportError("устройство отключено")
+        super().write(data)
+
+
+class BreakerTest(unittest.TestCase):
+
+    def test_states(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=0.05)
+        self.assertFalse(breaker.before())
+        breaker.failure("таймаут")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.failure("таймаут")
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before()
+        sleep(0.06)
+        self.assertTrue(breaker.before())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        # Пока идет проверка, остальные команды отклоняются
+        with self.assertRaises(CircuitOpenError):
+            breaker.before()
+        breaker.failure("таймаут")
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        sleep(0.06)
+        self.assertTrue(breaker.before())
+        breaker.success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.failures, 0)
+
+    def test_fast_fail_and_probe(self):
+        emulator = UnpluggedEmulator()
+        breaker = CircuitBreaker(threshold=2, reset_timeout=0.05)
+        kkt = KKT(emulator, "", "Кассир", TaxSystem.OVERALL, breaker=breaker)
+        kkt.status
+        emulator.unplugged = True
+        for _ in range(2):
+            with self.assertRaises(TransportError):
+                kkt.status
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            kkt.status
+        emulator.unplugged = False
+        sleep(0.06)
+        self.assertTrue(kkt.status.fatal.check())
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_reconnect_with_open_breaker(self):
+        emulator = UnpluggedEmulator()
+        breaker = CircuitBreaker(threshold=1, reset_timeout=60)
+        kkt = KKT(emulator, "", "Кассир", TaxSystem.OVERALL, breaker=breaker, reconnect=5)
+        kkt.status
+        emulator.unplugged = True
+        replug = Timer(0.5, lambda: setattr(emulator, "unplugged", False))
+        replug.start()
+        # Первая ошибка размыкает предохранитель, но восстановление связи продолжается до подключения
+        self.assertTrue(kkt.status.fatal.check())
+        replug.join()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_reconnect_counts_once(self):
+        emulator = UnpluggedEmulator()
+        breaker = CircuitBreaker(threshold=3, reset_timeout=60)
+        kkt = KKT(emulator, "", "Кассир", TaxSystem.OVERALL, breaker=breaker, reconnect=0.5)
+        kkt.status
+        emulator.unplugged = True
+        with self.assertRaises(TransportError):
+            kkt.status
+        # Ошибка обмена и неудачное восстановление, без учета попыток переподключения
+        self.assertEqual(breaker.failures, 2)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import time
+import unittest
+from threading import Thread
+
+from viki.broker import Broker, BrokerTransport
+from viki.data import TaxSystem
+from viki.emulator import Emulator
+from viki.helpers import KKTHelper
+from viki.kkt import KKT
+from viki.roundtrip import cheque
+from viki.transport import TransportError
+
+
+class LatePort(Emulator):
+    """Порт, в котором после потерянного ответа остаются опоздавшие байты, как в настоящем последовательном порту"""
+
+    def __init__(self):
+        super().__init__()
+        self.lose = False  # Следующее чтение завершается ошибкой, ответ остается в буфере
+
+    def read(self, size: int) -> bytes:
+        if self.lose:
+            self.lose = False
+            raise TransportError("таймаут чтения")
+        return super().read(size)
+
+    def close(self):
+        self.opened = False
+
+
+class BrokerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "kkt.sock")
+        self.port = LatePort()
+        self.broker = Broker(self.port, self.path)
+        self.broker.start()
+        deadline = time.monotonic() + 5
+        while self.broker.server is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.broker.shutdown()
+        self.directory.cleanup()
+
+    def client(self) -> KKTHelper:
+        helper = KKTHelper("unix:" + self.path, "", "Кассир", TaxSystem.OVERALL, reconnect=0)
+        self.clients.append(helper)
+        return helper
+
+    def test_processes_share_port(self):
+        helpers = [self.client() for _ in range(3)]
+        helpers[0].prepare()
+        errors = []
+
+        def lane(helper, printing):
+            try:
+                for _ in range(10):
+                    # Документы печатает один процесс, остальные опрашивают кассу между его кадрами
+                    if printing:
+                        helper.print_cheque(cheque(5))
+                    else:
+                        helper.kkt.status
+                        self.assertEqual(helper.kkt.information.manufacture_number, self.port.serial)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [Thread(target=lane, args=(helper, index == 0)) for index, helper in enumerate(helpers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.port.cheque, 11)
+        self.assertEqual(self.port.condition, 0)
+
+    def test_error_is_passed_to_client(self):
+        kkt = self.client().kkt
+        kkt.status
+        self.port.lose = True
+        with self.assertRaises(TransportError) as raised:
+            kkt.status
+        self.assertIn("таймаут чтения", str(raised.exception))
+        # Опоздавший ответ вычитан при повторном открытии порта и не принят за ответ на следующий запрос
+        self.assertGreater(self.port.in_waiting, 0)
+        self.assertEqual(kkt.information.manufacture_number, self.port.serial)
+
+    def test_client_without_broker(self):
+        self.broker.shutdown()
+        transport = BrokerTransport(self.path)
+        with self.assertRaises(TransportError):
+            transport.open()
+        self.assertFalse(transport.is_open)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from viki.data import TaxSystem
+from viki.emulator import Emulator
+from viki.helpers import KKTHelper
+from viki.kkt import BULK_IDS
+from viki.packet import Output
+from viki.roundtrip import cheque
+
+
+class BulkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator()
+        self.helper = KKTHelper(self.emulator, "", "Кассир", TaxSystem.OVERALL)
+        self.helper.prepare()
+        self.kkt = self.helper.kkt
+
+    def tearDown(self):
+        self.helper.close()
+
+    def frames(self, items: int) -> list:
+        return list(cheque(items).compile(self.kkt).frames)
+
+    def test_long_document(self):
+        items = BULK_IDS + 76
+        result = self.kkt.send_document(self.frames(items))
+        self.assertFalse(result.error)
+        self.assertEqual(self.emulator.fd, 2)
+        self.assertEqual(self.emulator.in_waiting, 0)
+
+    def test_error_after_ids_wrap(self):
+        for batch in (32, 1000):
+            with self.subTest(batch=batch):
+                # Ошибка после BULK_IDS команд, за ней еще больше BULK_IDS команд без ответа
+                frames = self.frames(3 * BULK_IDS)
+                frames[BULK_IDS + 26] = Output(0x7F)  # Недопустимый номер функции
+                with self.assertRaises(Exception):
+                    self.kkt.send(frames[0])
+                    self.kkt.send_bulk(frames[1:], batch)
+                # Ответы на все команды документа прочитаны, документ аннулирован
+                self.assertEqual(self.emulator.in_waiting, 0)
+                self.assertEqual(self.emulator.condition, 0)
+                self.assertFalse(self.kkt.status.document.condition.value)
+                self.assertEqual(self.helper.print_cheque(cheque(1)).number_fd, self.emulator.fd)
+
+
+if __name__ == "__main__":
+    unittest.main()
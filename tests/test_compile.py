@@ -0,0 +1,46 @@
+import threading
+import unittest
+
+from viki.data import TaxSystem
+from viki.emulator import Emulator
+from viki.helpers import KKTHelper
+from viki.roundtrip import cheque
+
+
+def compilers() -> int:
+    return sum(1 for thread in threading.enumerate() if thread.name.startswith("viki-compile"))
+
+
+class CompileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator()
+        self.helper = KKTHelper(self.emulator, "", "Кассир", TaxSystem.OVERALL)
+
+    def tearDown(self):
+        self.helper.close()
+
+    def test_compiled_cheque_prints(self):
+        self.helper.prepare()
+        compiled = self.helper.compile(cheque(3)).result(5)
+        self.assertEqual(len(compiled.frames), 6)
+        self.assertEqual(self.helper.print_cheque(compiled).number_fd, self.emulator.fd)
+
+    def test_close_stops_worker(self):
+        before = compilers()
+        other = KKTHelper(Emulator(), "", "Кассир", TaxSystem.OVERALL)
+        self.helper.compile(cheque(1)).result(5)
+        other.compile(cheque(1)).result(5)
+        # У каждого помощника свой поток
+        self.assertEqual(compilers(), before + 2)
+        other.close()
+        self.assertEqual(compilers(), before + 1)
+        self.helper.close()
+        self.assertEqual(compilers(), before)
+        # После закрытия поток создается заново
+        self.helper.compile(cheque(1)).result(5)
+        self.assertEqual(compilers(), before + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
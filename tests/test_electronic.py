@@ -0,0 +1,56 @@
+import unittest
+
+from viki.data import TaxSystem
+from viki.emulator import Emulator
+from viki.helpers import KKTHelper
+from viki.roundtrip import cheque
+
+
+class ElectronicTest(unittest.TestCase):
+
+    def setUp(self):
+        self.helper = KKTHelper(Emulator(), "", "Кассир", TaxSystem.OVERALL)
+        self.kkt = self.helper.kkt
+
+    def tearDown(self):
+        self.helper.close()
+
+    def open_document(self):
+        """Оставить открытым документ, чтобы параметры ПУ нельзя было восстановить"""
+        self.kkt.send(cheque(1).compile(self.kkt).frames[0])
+
+    def test_switch_and_restore(self):
+        with self.helper.electronic():
+            self.assertTrue(self.kkt.settings.printer.no_print_doc)
+            with self.helper.electronic():
+                pass
+            self.assertTrue(self.kkt.settings.printer.no_print_doc)
+        self.assertFalse(self.kkt.settings.printer.no_print_doc)
+        self.assertFalse(self.helper.paperless)
+
+    def test_failed_restore_keeps_caller_error_and_retries(self):
+        with self.assertLogs("viki.helpers", "ERROR"):
+            with self.assertRaises(ValueError):
+                with self.helper.electronic():
+                    self.open_document()
+                    raise ValueError("ошибка вызывающего")
+        # Касса осталась без печати, и это видно
+        self.assertTrue(self.kkt.settings.printer.no_print_doc)
+        self.assertTrue(self.helper.paperless)
+        self.kkt.cancel_doc()
+        with self.helper.electronic():
+            pass
+        self.assertFalse(self.kkt.settings.printer.no_print_doc)
+        self.assertFalse(self.helper.paperless)
+
+    def test_failed_restore_raises_without_caller_error(self):
+        with self.assertLogs("viki.helpers", "ERROR"):
+            with self.assertRaises(Exception) as raised:
+                with self.helper.electronic():
+                    self.open_document()
+        self.assertIn("Открыт документ", str(raised.exception))
+        self.assertTrue(self.helper.paperless)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import time
+import unittest
+from threading import Event, Thread
+
+from viki.flight import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+
+    def request(self, value="ответ"):
+        self.calls += 1
+        return value
+
+    def concurrent(self, flight: SingleFlight, function, followers: int = 3) -> list:
+        """Запустить лидера с function и followers потоков, присоединяющихся к его запросу"""
+        started = Event()
+        release = Event()
+        results = []
+
+        def leader():
+            started.set()
+            release.wait(5)
+            return function()
+
+        def run(target):
+            try:
+                results.append(flight.do("status", target))
+            except Exception as e:
+                results.append(e)
+
+        threads = [Thread(target=run, args=(leader,))]
+        threads[0].start()
+        started.wait(5)
+        for _ in range(followers):
+            threads.append(Thread(target=run, args=(lambda: self.fail("повторный запрос"),)))
+            threads[-1].start()
+        # Дать последователям дойти до ожидания
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_followers_share_result(self):
+        results = self.concurrent(SingleFlight(), self.request)
+        self.assertEqual(results, ["ответ"] * 4)
+        self.assertEqual(self.calls, 1)
+
+    def test_followers_share_error(self):
+        error = Exception("нет связи")
+
+        def fail():
+            raise error
+
+        flight = SingleFlight(10.0)
+        results = self.concurrent(flight, fail)
+        self.assertEqual(results, [error] * 4)
+        # Ошибка не сохраняется, следующий запрос выполняется заново
+        self.assertEqual(flight.do("status", self.request), "ответ")
+
+    def test_no_freshness_repeats_request(self):
+        flight = SingleFlight()
+        flight.do("status", self.request)
+        flight.do("status", self.request)
+        self.assertEqual(self.calls, 2)
+
+    def test_fresh_result_is_reused(self):
+        flight = SingleFlight(0.1)
+        self.assertEqual(flight.do("status", self.request), "ответ")
+        self.assertEqual(flight.do("status", lambda: self.request("новый")), "ответ")
+        self.assertEqual(flight.do("printer", lambda: self.request("принтер")), "принтер")
+        self.assertEqual(self.calls, 2)
+        time.sleep(0.15)
+        self.assertEqual(flight.do("status", lambda: self.request("новый")), "новый")
+
+    def test_freshness_per_call(self):
+        flight = SingleFlight()
+        flight.do("status", self.request, freshness=10.0)
+        self.assertEqual(flight.do("status", lambda: self.request("новый"), freshness=10.0), "ответ")
+        # Окно по умолчанию (0) не принимает сохраненный результат
+        self.assertEqual(flight.do("status", lambda: self.request("новый")), "новый")
+
+    def test_no_wait_runs_own_request(self):
+        flight = SingleFlight()
+        started = Event()
+        release = Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return "медленный"
+
+        thread = Thread(target=flight.do, args=("status", slow))
+        thread.start()
+        started.wait(5)
+        self.assertEqual(flight.do("status", lambda: self.request("свой"), wait=False), "свой")
+        release.set()
+        thread.join()
+
+    def test_forget(self):
+        flight = SingleFlight(10.0)
+        flight.do("status", self.request)
+        flight.forget()
+        flight.do("status", self.request)
+        self.assertEqual(self.calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
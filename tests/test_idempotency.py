@@ -0,0 +1,157 @@
+import os
+import tempfile
+import unittest
+from threading import Event, Thread
+
+from viki.data import CloseDocData, TaxSystem
+from viki.emulator import Emulator
+from viki.helpers import KKTHelper
+from viki.idempotency import IdempotencyStore
+from viki.roundtrip import cheque, parse
+from viki.transport import TransportError
+
+
+class FaultyEmulator(Emulator):
+    """Эмулятор, теряющий запись или ответ на заданную команду один раз"""
+
+    def __init__(self):
+        super().__init__()
+        self.lose_write = None  # Код команды, запись которой не доходит до кассы
+        self.lose_reply = None  # Код команды, которую касса выполняет, но ответ теряется
+        self.__drop = False
+
+    def write(self, data):
+        codes = [command.code for command in parse(data)]
+        if self.lose_write is not None and self.lose_write in codes:
+            self.lose_write = None
+            raise TransportError("запись потеряна")
+        if self.lose_reply is not None and self.lose_reply in codes:
+            self.lose_reply = None
+            self.__drop = True
+        super().write(data)
+
+    def read(self, size: int) -> bytes:
+        if self.__drop:
+            self.__drop = False
+            super().read(self.in_waiting)
+            raise TransportError("ответ потерян")
+        return super().read(size)
+
+
+def close_data(number: int) -> CloseDocData:
+    return CloseDocData.load({"number": number, "counter": "1", "string_fd_fp": "", "number_fd": number,
+                              "fp_sign": number * 7, "shift_number": 1, "number_doc_in_shift": number,
+                              "date": "010125", "time": "120000"})
+
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "keys.db")
+        self.store = IdempotencyStore(self.path, cache=2)
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_evicted_result_is_read_from_database(self):
+        for number in range(1, 5):
+            self.store.put("key-%i" % number, close_data(number))
+        self.assertEqual(self.store.get("key-1").number_fd, 1)
+        reopened = IdempotencyStore(self.path)
+        self.assertEqual(reopened.get("key-4").fp_sign, 28)
+        reopened.close()
+
+    def test_pending_marker_is_not_a_result(self):
+        self.store.mark("key", {"number": 5})
+        self.assertIsNone(self.store.get("key"))
+        self.assertEqual(self.store.pending("key"), {"number": 5})
+        self.store.put("key", close_data(6))
+        self.assertIsNone(self.store.pending("key"))
+
+    def test_reconcile_replaces_function(self):
+        self.store.mark("key", {"number": 5})
+        result = self.store.run("key", lambda: self.fail("печать при найденном документе"),
+                                lambda marker: close_data(marker["number"] + 1))
+        self.assertEqual(result.number_fd, 6)
+        self.assertEqual(self.store.get("key").number_fd, 6)
+
+    def test_failed_put_returns_result(self):
+        def put(key, result):
+            raise Exception("диск переполнен")
+        self.store.put = put
+        with self.assertLogs("viki.idempotency", "ERROR"):
+            self.assertEqual(self.store.run("key", lambda: close_data(1)).number_fd, 1)
+
+    def test_concurrent_retry_waits_for_first_attempt(self):
+        started = Event()
+        release = Event()
+        calls = []
+
+        def function():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return close_data(1)
+
+        results = []
+        first = Thread(target=lambda: results.append(self.store.run("key", function)))
+        first.start()
+        started.wait(5)
+        second = Thread(target=lambda: results.append(self.store.run("key", function)))
+        second.start()
+        release.set()
+        first.join()
+        second.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([x.number_fd for x in results], [1, 1])
+
+
+class ReconcileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = FaultyEmulator()
+        self.helper = KKTHelper(self.emulator, "", "Кассир", TaxSystem.OVERALL, reconnect=0)
+        self.helper.keys = IdempotencyStore()
+        self.helper.prepare()
+
+    def tearDown(self):
+        self.helper.keys.close()
+        self.helper.close()
+
+    def test_fiscalized_before_error(self):
+        before = self.emulator.fd
+        self.emulator.lose_reply = 0x31
+        with self.assertRaises(TransportError):
+            self.helper.print_cheque(cheque(2), key="order-1")
+        self.assertEqual(self.emulator.fd, before + 1)
+        result = self.helper.print_cheque(cheque(2), key="order-1")
+        self.assertEqual(result.number_fd, before + 1)
+        self.assertEqual(self.emulator.fd, before + 1)
+
+    def test_left_open(self):
+        before = self.emulator.fd
+        self.emulator.lose_write = 0x42
+        with self.assertRaises(TransportError):
+            self.helper.print_cheque(cheque(2), key="order-2")
+        self.assertEqual(self.emulator.fd, before)
+        self.assertNotEqual(self.emulator.condition, 0)
+        result = self.helper.print_cheque(cheque(2), key="order-2")
+        self.assertEqual(result.number_fd, before + 1)
+        self.assertEqual(self.emulator.fd, before + 1)
+        self.assertEqual(self.emulator.condition, 0)
+
+    def test_other_cheque_in_slot(self):
+        before = self.emulator.fd
+        self.helper.keys.mark("order-3", {"number": before, "operation": 1, "total": 2000, "items": 2})
+        # Другой поток закрыл чек на ту же сумму, но с другим количеством позиций
+        other = cheque(1)
+        other.items[0].price = 20.0
+        self.helper.print_cheque(other)
+        result = self.helper.print_cheque(cheque(2), key="order-3")
+        self.assertEqual(result.number_fd, before + 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+from datetime import date
+
+from viki.archive import CHEQUE_DOCUMENT
+from viki.data import DocumentType, TaxSystem
+from viki.emulator import Emulator
+from viki.helpers import KKTHelper
+from viki.index import DocumentIndex
+from viki.roundtrip import cheque
+
+
+class DocumentIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "index.db")
+        self.index = DocumentIndex(self.path)
+        self.emulator = Emulator()
+        self.helper = KKTHelper(self.emulator, "", "Кассир", TaxSystem.OVERALL)
+        self.helper.prepare()
+
+    def tearDown(self):
+        self.helper.close()
+        self.index.close()
+        self.directory.cleanup()
+
+    def print(self, *sizes: int):
+        for size in sizes:
+            self.helper.print_cheque(cheque(size))
+
+    def test_sync_is_incremental(self):
+        self.print(1, 2, 3)
+        # Отчет о регистрации и три чека
+        self.assertEqual(self.index.sync(self.helper.kkt, batch=2), 4)
+        self.assertEqual(self.index.position, self.emulator.fd)
+        self.print(4)
+        self.assertEqual(self.index.sync(self.helper.kkt), 1)
+        self.assertEqual(self.index.sync(self.helper.kkt), 0)
+        self.assertEqual([x.items for x in self.index.by_shift(1) if x.type == CHEQUE_DOCUMENT], [1, 2, 3, 4])
+
+    def test_queries(self):
+        self.print(1, 2, 2)
+        self.index.sync(self.helper.kkt)
+        last = self.index.by_number(self.emulator.fd)
+        self.assertEqual((last.type, last.operation, last.total, last.items), (CHEQUE_DOCUMENT, 1, 2000, 2))
+        self.assertEqual(self.index.by_fp(last.fp), [last])
+        self.assertEqual(len(self.index.by_total(20.0)), 2)
+        self.assertEqual(len(self.index.by_total(20.0, date.today())), 2)
+        self.assertEqual(self.index.by_total(20.0, date(2000, 1, 1)), [])
+        self.assertEqual(len(self.index.by_date(date.today())), 4)
+        self.assertIsNone(self.index.by_number(self.emulator.fd + 1))
+
+    def test_printed_cheque_is_indexed(self):
+        self.helper.index = self.index
+        result = self.helper.print_cheque(cheque(3))
+        document = self.index.by_number(result.number_fd)
+        self.assertEqual((document.type, document.operation, document.total), (CHEQUE_DOCUMENT, 1, 3000))
+        self.assertEqual(document.fp, result.fp_sign)
+        # Ответ закрытия документа не содержит позиций, их добавляет чтение архива
+        self.index.sync(self.helper.kkt)
+        self.assertEqual(self.index.by_number(result.number_fd).items, 3)
+        self.assertEqual(len(self.index.by_total(30.0)), 1)
+
+    def test_return_operation(self):
+        self.helper.index = self.index
+        refund = cheque(1)
+        refund.type = DocumentType.SALE_RETURN
+        result = self.helper.print_cheque(refund)
+        self.assertEqual(self.index.by_number(result.number_fd).operation, 2)
+
+    def test_reopen(self):
+        self.print(1)
+        self.index.sync(self.helper.kkt)
+        self.index.close()
+        self.index = DocumentIndex(self.path)
+        self.assertEqual(self.index.position, self.emulator.fd)
+        self.assertEqual(self.index.by_number(self.emulator.fd).total, 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+from decimal import Decimal
+
+from viki.data import DocumentType, ExtendErrorCode, PaymentType, SubjectMatter, TaxSystem
+from viki.emulator import Emulator
+from viki.helpers import Cheque, Item, ItemTax, KKTHelper
+from viki.preflight import ChequeError, item_total, validate
+from viki.roundtrip import cheque
+
+
+def item(count=1, price=10.0, title="Товар", tax=ItemTax.TAX_20, payment=PaymentType.FULL_SETTLEMENT) -> Item:
+    return Item(title, count, price, tax, payment, SubjectMatter.DEFAULT)
+
+
+def sale(*items: Item) -> Cheque:
+    result = Cheque(DocumentType.SALE)
+    result.items.extend(items)
+    return result
+
+
+class ItemTotalTest(unittest.TestCase):
+
+    def test_rounding(self):
+        self.assertEqual(item_total(1, 10.0), Decimal("10.00"))
+        # Половина копейки округляется вверх, меньше половины - отбрасывается
+        self.assertEqual(item_total(0.5, 0.01), Decimal("0.01"))
+        self.assertEqual(item_total(0.4, 0.01), Decimal("0.00"))
+        # Без ошибок двоичного представления: 0.3 * 3.35 = 1.005
+        self.assertEqual(item_total(0.3, 3.35), Decimal("1.01"))
+        self.assertEqual(item_total(1.5, 33.33), Decimal("50.00"))
+
+
+class ValidateTest(unittest.TestCase):
+
+    def assertCode(self, code: ExtendErrorCode, cheque: Cheque, payments=None, index=None):
+        with self.assertRaises(ChequeError) as raised:
+            validate(cheque, payments)
+        self.assertEqual(raised.exception.code, code)
+        self.assertEqual(raised.exception.index, index)
+
+    def test_totals(self):
+        totals = validate(sale(item(), item(0.3, 3.35)), [(0, 20.0)])
+        self.assertEqual(totals.items, [Decimal("10.00"), Decimal("1.01")])
+        self.assertEqual(totals.total, Decimal("11.01"))
+        self.assertEqual(totals.paid, Decimal("20.0"))
+        self.assertEqual(totals.change, Decimal("8.99"))
+
+    def test_default_payment_is_cash(self):
+        totals = validate(sale(item(2, 5.5)))
+        self.assertEqual((totals.paid, totals.change), (Decimal("11.00"), Decimal(0)))
+
+    def test_items(self):
+        self.assertCode(ExtendErrorCode.WRONG_ITEM_TITLE, sale(item(), item(title="x" * 225)), index=1)
+        self.assertCode(ExtendErrorCode.WRONG_ITEM_TITLE, sale(item(title="Товар €")), index=0)
+        self.assertCode(ExtendErrorCode.WRONG_ITEM_COUNT, sale(item(count=0)), index=0)
+        self.assertCode(ExtendErrorCode.WRONG_ITEM_COUNT, sale(item(count=0.0001)), index=0)
+        self.assertCode(ExtendErrorCode.WRONG_ITEM_PRICE, sale(item(price=0.001)), index=0)
+        self.assertCode(ExtendErrorCode.WRONG_TAX_NUMBER, sale(item(tax=6)), index=0)
+        self.assertCode(ExtendErrorCode.WRONG_SIGN_PAID_METHOD, sale(item(payment="4")), index=0)
+
+    def test_document(self):
+        self.assertCode(ExtendErrorCode.DOC_NO_COMING, Cheque(DocumentType.SERVICE))
+        self.assertCode(ExtendErrorCode.DOC_ZERO_TOTAL, sale())
+        self.assertCode(ExtendErrorCode.DOC_ZERO_TOTAL, sale(item(price=0)))
+        loan = item(payment=PaymentType.LOAN_PAYMENT)
+        self.assertCode(ExtendErrorCode.DOC_OVER_ONE_CREDIT, sale(loan, item(), loan), index=2)
+
+    def test_payments(self):
+        self.assertCode(ExtendErrorCode.WRONG_TYPE_PAID, sale(item()), [(16, 10.0)])
+        self.assertCode(ExtendErrorCode.WRONG_TOTAL_PAID, sale(item()), [(0, 10.001)])
+        self.assertCode(ExtendErrorCode.WRONG_TOTAL_PAID, sale(item()), [(0, 5.0)])
+        # Сдача выдается только с наличных
+        self.assertCode(ExtendErrorCode.WRONG_TOTAL_PAID, sale(item()), [(1, 15.0)])
+        self.assertEqual(validate(sale(item()), [(1, 5.0), (0, 10.0)]).change, Decimal("5.0"))
+
+
+class PrintTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator()
+        self.helper = KKTHelper(self.emulator, "", "Кассир", TaxSystem.OVERALL)
+        self.helper.prepare()
+
+    def tearDown(self):
+        self.helper.close()
+
+    def test_rejected_before_kkt(self):
+        frames = self.emulator.frames
+        with self.assertRaises(ChequeError):
+            self.helper.print_cheque(sale(item(count=-1)))
+        self.assertEqual(self.emulator.frames, frames)
+        self.assertEqual(self.emulator.condition, 0)
+
+    def test_total_matches_kkt(self):
+        result = sale(item(0.3, 3.35), item(1.5, 33.33))
+        self.assertEqual(result.total, 51.01)
+        self.helper.print_cheque(result)
+        self.assertEqual(self.emulator.total, 5101)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from viki.data import TaxSystem
+from viki.emulator import Emulator
+from viki.helpers import KKTHelper
+from viki.roundtrip import RoundTrips, cheque
+
+# Измеренные бюджеты обменов типовых операций, рост - регрессия
+BUDGETS = {
+    "prepare": 3,
+    "cheque-1": 3,
+    "cheque-10": 2,
+}
+
+
+class RoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.helper = KKTHelper(Emulator(), "", "Кассир", TaxSystem.OVERALL)
+        self.trips = RoundTrips(self.helper.kkt)
+
+    def tearDown(self):
+        self.trips.detach()
+        self.helper.close()
+
+    def test_budgets(self):
+        steps = [
+            ("prepare", self.helper.prepare),
+            ("cheque-1", lambda: self.helper.print_cheque(cheque(1))),
+            ("cheque-10", lambda: self.helper.print_cheque(cheque(10))),
+        ]
+        for name, step in steps:
+            with self.subTest(name):
+                with self.trips.operation(name, BUDGETS[name], redundant=False):
+                    step()
+
+
+if __name__ == "__main__":
+    unittest.main()
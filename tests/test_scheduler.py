@@ -0,0 +1,70 @@
+import unittest
+from datetime import datetime, timedelta
+
+from viki.archive import ArchiveReader
+from viki.data import TaxSystem
+from viki.emulator import Emulator
+from viki.kkt import KKT
+from viki.scheduler import ShiftScheduler
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator()
+        self.kkt = KKT(self.emulator, "", "Кассир", TaxSystem.OVERALL)
+        self.kkt.begin()
+
+    def tearDown(self):
+        self.kkt.close()
+
+    def scheduler(self, **kwargs) -> ShiftScheduler:
+        kwargs.setdefault("idle", timedelta(0))
+        result = ShiftScheduler(self.kkt, **kwargs)
+        result.last_activity = datetime.now() - timedelta(hours=1)
+        return result
+
+    def test_unknown_age_is_due_at_first_idle_window(self):
+        # Смена эмулятора открыта без отчета об открытии в архиве ФН
+        scheduler = self.scheduler()
+        scheduler.track()
+        self.assertIsNone(scheduler.opened_at)
+        self.assertTrue(scheduler.due())
+        self.assertFalse(scheduler.urgent())
+        scheduler.poll()
+        self.assertEqual(scheduler.number, 2)
+        self.assertIsNotNone(scheduler.opened_at)
+        self.assertFalse(scheduler.due())
+
+    def test_unknown_age_over_24_hours_is_urgent(self):
+        self.emulator.shift_more_24 = True
+        scheduler = self.scheduler(idle=timedelta(hours=1))
+        scheduler.track()
+        self.assertTrue(scheduler.urgent())
+        scheduler.poll()
+        self.assertEqual(scheduler.number, 2)
+        self.assertFalse(scheduler.urgent())
+
+    def test_opened_at_from_archive(self):
+        self.kkt.close_shift()
+        self.kkt.open_shift()
+        scheduler = self.scheduler()
+        scheduler.track()
+        self.assertEqual(scheduler.opened_at, self.emulator_opened_at())
+        self.assertFalse(scheduler.due())
+
+    def test_shift_opened_while_running_is_looked_up(self):
+        scheduler = self.scheduler()
+        scheduler.track()
+        self.kkt.close_shift()
+        self.kkt.open_shift()
+        scheduler.track()
+        self.assertEqual(scheduler.number, 2)
+        self.assertEqual(scheduler.opened_at, self.emulator_opened_at())
+
+    def emulator_opened_at(self) -> datetime:
+        return ArchiveReader(self.kkt).document(self.emulator.fd).datetime
+
+
+if __name__ == "__main__":
+    unittest.main()
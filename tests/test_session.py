@@ -0,0 +1,66 @@
+import unittest
+from threading import Thread
+
+from viki.data import TaxSystem
+from viki.emulator import Emulator
+from viki.helpers import KKTHelper
+from viki.packet import DELIM
+from viki.roundtrip import cheque
+
+
+def open_doc(compiled) -> tuple:
+    """Кассир и система налогообложения из кадра открытия документа"""
+    params = [x.decode("CP866") for x in compiled.frames[0].body.split(bytes([DELIM]))]
+    return params[2], params[4]
+
+
+class SessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.helper = KKTHelper(Emulator(), "", "Кассир", TaxSystem.OVERALL)
+        self.kkt = self.helper.kkt
+
+    def tearDown(self):
+        self.helper.close()
+
+    def test_setters_change_default(self):
+        self.kkt.operator = "7700000000&Старший"
+        self.kkt.tax_system = str(TaxSystem.SIMPLE_INCOME.value)
+        self.assertEqual(self.kkt.default.operator, "7700000000&Старший")
+        self.assertEqual((self.kkt.operator, self.kkt.tax_system),
+                         ("7700000000&Старший", str(TaxSystem.SIMPLE_INCOME.value)))
+        # Открытый сеанс не меняется
+        with self.kkt.session("Второй"):
+            self.kkt.operator = "&Третий"
+            self.assertEqual(self.kkt.operator, "&Второй")
+        self.assertEqual(self.kkt.operator, "&Третий")
+
+    def test_nested_sessions(self):
+        with self.kkt.session("Первый", tax_system=TaxSystem.SIMPLE_INCOME):
+            with self.kkt.session("Второй", "7700000000"):
+                self.assertEqual(self.kkt.operator, "7700000000&Второй")
+                # Система налогообложения наследуется от внешнего сеанса
+                self.assertEqual(self.kkt.tax_system, str(TaxSystem.SIMPLE_INCOME.value))
+            self.assertEqual(self.kkt.operator, "&Первый")
+        self.assertEqual(self.kkt.operator, "&Кассир")
+        self.assertEqual(self.kkt.tax_system, str(TaxSystem.OVERALL.value))
+
+    def test_session_is_per_thread(self):
+        seen = []
+        with self.kkt.session("Первый"):
+            thread = Thread(target=lambda: seen.append(self.kkt.operator))
+            thread.start()
+            thread.join()
+        self.assertEqual(seen, ["&Кассир"])
+
+    def test_compile_uses_caller_session(self):
+        with self.kkt.session("Первый", tax_system=TaxSystem.SIMPLE_INCOME):
+            future = self.helper.compile(cheque(1))
+        self.assertEqual(open_doc(future.result(5)), ("&Первый", str(TaxSystem.SIMPLE_INCOME.value)))
+        # Поток компиляции не сохраняет сеанс предыдущего чека
+        self.assertEqual(open_doc(self.helper.compile(cheque(1)).result(5)),
+                         ("&Кассир", str(TaxSystem.OVERALL.value)))
+
+
+if __name__ == "__main__":
+    unittest.main()
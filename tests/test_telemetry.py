@@ -0,0 +1,51 @@
+import unittest
+from threading import Event, Thread
+
+from viki.data import TaxSystem
+from viki.emulator import Emulator
+from viki.helpers import KKTHelper
+from viki.telemetry import Telemetry
+
+
+class TelemetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.helper = KKTHelper(Emulator("0000000042"), "", "Кассир", TaxSystem.OVERALL)
+        self.helper.prepare()
+        self.kkt = self.helper.kkt
+        self.telemetry = Telemetry([self.kkt])
+
+    def tearDown(self):
+        self.helper.close()
+
+    def test_serial_label_before_first_sweep(self):
+        self.assertIn('viki_up{port="%s",serial=""} 0.0' % self.kkt.transport, self.telemetry.render())
+
+    def test_serial_label_after_sweep(self):
+        self.telemetry.sweep()
+        text = self.telemetry.render()
+        self.assertIn('viki_up{port="%s",serial="0000000042"} 1.0' % self.kkt.transport, text)
+        self.assertIn('viki_shift_open{port="%s",serial="0000000042"} 1.0' % self.kkt.transport, text)
+        self.assertNotIn('serial=""', text)
+
+    def test_busy_kkt_is_skipped(self):
+        held = Event()
+        release = Event()
+
+        def hold():
+            with self.kkt.lock:
+                held.set()
+                release.wait(5)
+
+        thread = Thread(target=hold)
+        thread.start()
+        held.wait(5)
+        self.telemetry.sweep()
+        release.set()
+        thread.join()
+        # Касса была занята: заводской номер не прочитан, метка остается пустой
+        self.assertIn('viki_up{port="%s",serial=""} 0.0' % self.kkt.transport, self.telemetry.render())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+
+from viki.breaker import CircuitBreaker
+from viki.data import TaxSystem
+from viki.emulator import Emulator
+from viki.kkt import KKT, SettingsData
+from viki.transport import SerialTransport
+
+
+class Line:
+    """Последовательная линия к эмулятору: данные проходят, только если скорости порта и кассы совпадают"""
+
+    def __init__(self, emulator: Emulator, baudrate: int, timeout: float):
+        self.emulator = emulator
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.is_open = True
+
+    @property
+    def rate(self) -> int:
+        """Скорость кассы из настройки 11"""
+        index = int(self.emulator.settings.get("11", "6"))
+        return SettingsData.BAUD_RATES[index] if index < len(SettingsData.BAUD_RATES) else None
+
+    def write(self, data):
+        if self.baudrate == self.rate:
+            self.emulator.write(data)
+
+    def read(self, size: int) -> bytes:
+        if self.baudrate != self.rate:
+            return b""
+        return self.emulator.read(size)
+
+    @property
+    def in_waiting(self) -> int:
+        return self.emulator.in_waiting if self.baudrate == self.rate else 0
+
+    def set_low_latency_mode(self, value: bool):
+        pass
+
+    def close(self):
+        self.is_open = False
+        self.emulator.close()
+
+
+class EmulatedPort(SerialTransport):
+    """Последовательный порт, подключенный к эмулятору"""
+
+    def __init__(self, emulator: Emulator, **kwargs):
+        super().__init__("emulated", **kwargs)
+        self.emulator = emulator
+        self.opened = 0  # Количество открытий порта
+
+    def open(self):
+        self.opened += 1
+        self.emulator.open()
+        self.serial = Line(self.emulator, self.baudrate, self.timeout)
+
+
+class TuneTest(unittest.TestCase):
+
+    def test_reconnect_after_tune(self):
+        emulator = Emulator()
+        kkt = KKT(EmulatedPort(emulator), "", "Кассир", TaxSystem.OVERALL, tune=True)
+        self.assertTrue(kkt.status.fatal.check())
+        self.assertEqual(kkt.tuning.baudrate_after, 115200)
+        kkt.close()
+        # Новый процесс открывает порт на скорости по умолчанию
+        restarted = KKT(EmulatedPort(emulator), "", "Кассир", TaxSystem.OVERALL)
+        self.assertTrue(restarted.status.current.no_begin)
+        self.assertEqual(restarted.transport.baudrate, 115200)
+
+    def test_tune_stays_on_one_connection(self):
+        # Ответ на запись скорости приходит уже на новой скорости и теряется
+        port = EmulatedPort(Emulator())
+        breaker = CircuitBreaker(threshold=1)
+        kkt = KKT(port, "", "Кассир", TaxSystem.OVERALL, tune=True, breaker=breaker, reconnect=5)
+        self.assertTrue(kkt.status.fatal.check())
+        self.assertEqual(kkt.tuning.baudrate_after, 115200)
+        self.assertEqual(port.opened, 1)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.failures, 0)
+
+    def test_no_answer(self):
+        emulator = Emulator()
+        port = EmulatedPort(emulator)
+        kkt = KKT(port, "", "Кассир", TaxSystem.OVERALL)
+        emulator.settings["11"] = "99"  # Касса не отвечает ни на одной скорости
+        with self.assertRaises(ConnectionError):
+            kkt.status
+        self.assertEqual(port.baudrate, 57600)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+class TransportError(ConnectionError):
+    """Ошибка канала связи: порт недоступен или касса не ответила вовремя"""
+
+
+class Transport:
+    """
+    Канал связи с ККТ
+
+    Минимальный файлоподобный интерфейс, через который KKT и Input обмениваются байтами с кассой
+    """
+
+    @property
+    def is_open(self) -> bool:
+        """Канал открыт"""
+        raise NotImplementedError
+
+    def open(self):
+        """Открыть канал"""
+        raise NotImplementedError
+
+    def close(self):
+        """Закрыть канал"""
+        raise NotImplementedError
+
+    def write(self, data):
+        """Записать байты"""
+        raise NotImplementedError
+
+    def read(self, size: int) -> bytes:
+        """Прочитать size байт"""
+        raise NotImplementedError
+
+    @property
+    def in_waiting(self) -> int:
+        """Количество байт, ожидающих чтения"""
+        raise NotImplementedError
+
+
+class TransportWrapper(Transport):
+    """
+    Транспорт поверх другого транспорта
+
+    Вызовы передаются исходному транспорту, перед каждой записью вызывается on_write (учет обменов, запись команд)
+    """
+
+    def __init__(self, transport: Transport):
+        self.transport = transport
+
+    @property
+    def is_open(self) -> bool:
+        return self.transport.is_open
+
+    def open(self):
+        self.transport.open()
+
+    def close(self):
+        self.transport.close()
+
+    def write(self, data):
+        self.on_write(data)
+        self.transport.write(data)
+
+    def on_write(self, data):
+        """Байты data записываются в порт"""
+
+    def read(self, size: int) -> bytes:
+        return self.transport.read(size)
+
+    @property
+    def in_waiting(self) -> int:
+        return self.transport.in_waiting
+
+    def __str__(self):
+        return str(self.transport)
+
+
+class SerialTransport(Transport):
+    """
+    Последовательный порт
+
+    pyserial импортируется только при открытии порта, ошибки порта превращаются в TransportError. Чтобы порт
+    находился после переподключения USB-адаптера, его можно задать постоянным путем (/dev/serial/by-id/...) или
+    серийным номером USB-устройства, по которому имя порта ищется при каждом открытии.
+    """
+
+    def __init__(self, port: str, baudrate: int = 57600, timeout: float = 15.0, serial_number: str = None,
+                 **kwargs):
+        """
+        :param port: имя порта (/dev/ttyUSB0, /dev/serial/by-id/..., COM3), None - искать по serial_number
+        :param baudrate: скорость обмена
+        :param timeout: таймаут чтения (сек), None - без таймаута
+        :param serial_number: серийный номер USB-устройства
+        :param kwargs: дополнительные параметры serial.Serial
+        """
+        self.port = port
+        self.serial_number = serial_number
+        self.__baudrate = baudrate
+        self.kwargs = kwargs
+        self.kwargs["timeout"] = timeout
+        self.serial = None
+
+    @property
+    def baudrate(self) -> int:
+        """Скорость обмена"""
+        return self.__baudrate
+
+    @baudrate.setter
+    def baudrate(self, value: int):
+        self.__baudrate = value
+        if self.serial is not None:
+            self.serial.baudrate = value
+
+    @property
+    def timeout(self) -> float:
+        """Таймаут чтения (сек), None - без таймаута"""
+        if self.serial is not None:
+            return self.serial.timeout
+        return self.kwargs.get("timeout")
+
+    @timeout.setter
+    def timeout(self, value: float):
+        self.kwargs["timeout"] = value
+        if self.serial is not None:
+            self.serial.timeout = value
+
+    def low_latency(self) -> bool:
+        """
+        Включить режим низкой задержки драйвера (ASYNC_LOW_LATENCY, для USB-serial - минимальный latency timer)
+        :return: режим включен, False - драйвер или ОС его не поддерживают
+        """
+        try:
+            self.serial.set_low_latency_mode(True)
+        except (AttributeError, NotImplementedError, ValueError, OSError):
+            return False
+        return True
+
+    @property
+    def is_open(self) -> bool:
+        return self.serial is not None and self.serial.is_open
+
+    def resolve(self) -> str:
+        """Имя порта, для USB-устройства - по серийному номеру среди подключенных"""
+        if self.serial_number is None:
+            return self.port
+        from serial.tools.list_ports import comports
+        for info in comports():
+            if info.serial_number == self.serial_number:
+                return info.device
+        raise TransportError("USB-устройство %s не подключено" % self.serial_number)
+
+    def open(self):
+        from serial import Serial
+        device = self.resolve()
+        try:
+            self.serial = Serial(port=device, baudrate=self.__baudrate, **self.kwargs)
+        except OSError as e:
+            raise TransportError("Не удалось открыть порт %s: %s" % (device, e))
+
+    def close(self):
+        if self.serial is not None:
+            try:
+                self.serial.close()
+            except OSError:
+                # Устройство уже отключено
+                pass
+            self.serial = None
+
+    def write(self, data):
+        try:
+            self.serial.write(data)
+        except OSError as e:
+            raise TransportError("Ошибка записи в порт %s: %s" % (self, e))
+
+    def read(self, size: int) -> bytes:
+        try:
+            return self.serial.read(size)
+        except OSError as e:
+            raise TransportError("Ошибка чтения из порта %s: %s" % (self, e))
+
+    @property
+    def in_waiting(self) -> int:
+        try:
+            return self.serial.in_waiting
+        except OSError as e:
+            raise TransportError("Ошибка чтения из порта %s: %s" % (self, e))
+
+    def __str__(self):
+        if self.serial_number is not None:
+            return "usb:" + self.serial_number
+        return self.port
+
+
+def make_transport(port) -> Transport:
+    """
+    Канал связи по описанию порта
+    :param port: Transport, "unix:<путь сокета брокера>", "usb:<серийный номер USB-устройства>" или имя
+        последовательного порта
+    """
+    if isinstance(port, Transport):
+        return port
+    if port.startswith("unix:"):
+        from viki.broker import BrokerTransport
+        return BrokerTransport(port[len("unix:"):])
+    if port.startswith("usb:"):
+        return SerialTransport(None, serial_number=port[len("usb:"):])
+    return SerialTransport(port)
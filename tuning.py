@@ -0,0 +1,110 @@
+from dataclasses import dataclass
+from statistics import median
+from time import perf_counter, sleep
+
+from viki.kkt import KKT, SettingsData
+from viki.packet import Output
+from viki.transport import SerialTransport
+
+
+@dataclass
+class TuneReport:
+    """Результат подбора параметров канала связи"""
+    baudrate_before: int  # Скорость обмена до подбора
+    baudrate_after: int  # Скорость обмена после подбора
+    low_latency: bool  # Включен режим низкой задержки драйвера
+    rtt_before: float  # Время запроса статуса до подбора (сек, медиана)
+    rtt_after: float  # Время запроса статуса после подбора (сек, медиана)
+
+
+def round_trip(kkt: KKT, samples: int = 5) -> float:
+    """
+    Измерить время обмена
+    :param kkt: касса
+    :param samples: количество замеров
+    :return: медиана времени запроса статуса (сек)
+    """
+    result = []
+    for _ in range(samples):
+        start = perf_counter()
+        kkt.send(Output(0x00), freshness=0)
+        result.append(perf_counter() - start)
+    return median(result)
+
+
+def drain(transport: SerialTransport):
+    """Отбросить принятые байты: ответ на прерванный пробный обмен или данные, принятые на другой скорости"""
+    while transport.in_waiting:
+        transport.read(transport.in_waiting)
+
+
+def detect(kkt: KKT, rates=SettingsData.BAUD_RATES, timeout: float = 0.5) -> int:
+    """
+    Найти скорость, на которой отвечает касса, и перевести на нее порт
+    :param kkt: касса
+    :param rates: проверяемые скорости
+    :param timeout: таймаут ответа на каждой скорости (сек)
+    :return: скорость или None, если касса не отвечает ни на одной (порт остается на прежней скорости)
+    """
+    transport: SerialTransport = kkt.transport
+    saved_rate = transport.baudrate
+    saved_timeout = transport.timeout
+    transport.timeout = timeout
+    try:
+        for rate in sorted(rates, reverse=True):
+            transport.baudrate = rate
+            drain(transport)
+            if kkt.check_link():
+                return rate
+        transport.baudrate = saved_rate
+        return None
+    finally:
+        transport.timeout = saved_timeout
+
+
+def tune(kkt: KKT, rates=(115200,), samples: int = 5, timeout: float = 0.5) -> TuneReport:
+    """
+    Подобрать параметры канала связи с кассой
+
+    Включает режим низкой задержки драйвера и переводит кассу и порт на самую высокую из скоростей rates, на
+    которой касса отвечает. Если после переключения связи нет, порт возвращается на прежнюю скорость; если нет связи
+    и на ней, скорость кассы определяется перебором. Скорость кассы сохраняется в ее настройках, поэтому при
+    следующем соединении на прежней скорости KKT.connect находит ее перебором (см. detect). Подбор выполняется в
+    KKT.probing: ошибки пробных обменов не закрывают порт и не запускают восстановление связи, а скорость порта
+    возвращается напрямую, без повторного соединения.
+    :param kkt: касса на последовательном порту
+    :param rates: желаемые скорости обмена
+    :param samples: количество замеров времени обмена
+    :param timeout: таймаут чтения на время подбора (сек)
+    """
+    transport: SerialTransport = kkt.port
+    if not isinstance(transport, SerialTransport):
+        raise Exception("Подбор параметров возможен только для последовательного порта")
+    with kkt.lock, kkt.probing():
+        saved_timeout = transport.timeout
+        transport.timeout = timeout
+        try:
+            before = transport.baudrate
+            rtt_before = round_trip(kkt, samples)
+            low_latency = transport.low_latency()
+            for rate in sorted(rates, reverse=True):
+                if rate <= transport.baudrate:
+                    break
+                try:
+                    kkt.settings.baudrate = rate
+                except Exception:
+                    # Ответ мог прийти уже на новой скорости
+                    pass
+                current = transport.baudrate
+                transport.baudrate = rate
+                sleep(timeout)
+                drain(transport)
+                if kkt.check_link():
+                    break
+                transport.baudrate = current
+                drain(transport)
+                if not kkt.check_link() and detect(kkt) is None:
+                    raise Exception("Нет связи с кассой после смены скорости!")
+            return TuneReport(before, transport.baudrate, low_latency, rtt_before, round_trip(kkt, samples))
+        finally:
+            transport.timeout = saved_timeout